@@ -1,8 +1,10 @@
 import os
 import shutil
 
+from src.Application.Generate_Squares.Generate_Squares_Manifest import source_files_are_already_processed
 
-def copy_tm_data_from_paint_source(source_dir, destination_dir):
+
+def copy_tm_data_from_paint_source(source_dir, destination_dir, generate_squares_parameters=None):
     # Ensure the destination directory exists
     os.makedirs(destination_dir, exist_ok=True)
 
@@ -16,10 +18,14 @@ def copy_tm_data_from_paint_source(source_dir, destination_dir):
             dest_path = os.path.join(destination_dir, subdir)
             os.makedirs(dest_path, exist_ok=True)
 
+            # Copying the TrackMate data again would only replace the Generate Squares output with the same input
+            already_processed = (generate_squares_parameters is not None and
+                                 source_files_are_already_processed(subdir_path, dest_path, generate_squares_parameters))
+
             # Copy only the specified files if they exist
             for file in ['All Tracks.csv', 'All Recordings.csv']:
                 src_file_path = os.path.join(subdir_path, file)
-                if os.path.exists(src_file_path):
+                if os.path.exists(src_file_path) and not already_processed:
                     dest_file_path = os.path.join(dest_path, file)
                     shutil.copy(src_file_path, dest_file_path)  # copy2 preserves metadata
 
@@ -32,7 +38,7 @@ def copy_with_overwrite(src, dst):
     shutil.copytree(src, dst)
 
 
-def copy_tm_data_from_paint_source_with_images(source_dir, destination_dir):
+def copy_tm_data_from_paint_source_with_images(source_dir, destination_dir, generate_squares_parameters=None):
     # Ensure the destination directory exists
     os.makedirs(destination_dir, exist_ok=True)
 
@@ -46,10 +52,16 @@ def copy_tm_data_from_paint_source_with_images(source_dir, destination_dir):
             dest_path = os.path.join(destination_dir, subdir)
             os.makedirs(dest_path, exist_ok=True)
 
+            # Copying the TrackMate data again would only replace the Generate Squares output with the same input
+            already_processed = (generate_squares_parameters is not None and
+                                 source_files_are_already_processed(subdir_path, dest_path, generate_squares_parameters))
+
             # Copy only the specified files if they exist
             for file in ['All Tracks.csv', 'All Recordings.csv', 'Experiment Info.csv']:
                 src_file_path = os.path.join(subdir_path, file)
                 dest_file_path = os.path.join(dest_path, file)
+                if already_processed and file != 'Experiment Info.csv':
+                    continue
                 if os.path.exists(src_file_path):
                     shutil.copy(src_file_path, dest_file_path)  # Overwrite if exists
                     # print(f"Copied {src_file_path} to {dest_file_path}")
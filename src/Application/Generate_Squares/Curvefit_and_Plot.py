@@ -25,6 +25,33 @@ def mono_exp(x, m, t, b):
     return calc
 
 
+# TrackMate records the frames 0.05 seconds apart, so a track duration is a whole number of frames. The durations are
+# stored in seconds, rounded to 3 decimals. Histograms are made of the frame counts and converted back to seconds only
+# for the fit.
+FRAME_INTERVAL = 0.05
+
+
+def get_duration_in_frames(durations):
+    return np.rint(np.asarray(durations, dtype=float) / FRAME_INTERVAL).astype(np.int64)
+
+
+def get_duration_in_seconds(frames):
+    return np.round(np.asarray(frames) * FRAME_INTERVAL, 3)
+
+
+def get_frame_bins(frames):
+    """
+    The function determines, without sorting, which frame counts occur and to which of these each track belongs.
+    :param frames: The durations of the tracks in frames
+    :return: The frame counts that occur in increasing order, and for each track the number of its bin
+    """
+
+    first_frame = frames.min() if len(frames) > 0 else 0
+    occurs = np.bincount(frames - first_frame) > 0
+    bin_nr_of_frame = np.cumsum(occurs) - 1
+    return np.flatnonzero(occurs) + first_frame, bin_nr_of_frame[frames - first_frame]
+
+
 def compile_duration(tracks):
     """
     The function produces a frequency distribution of the track durations.
@@ -32,19 +59,26 @@ def compile_duration(tracks):
     :return: A dataframe with two columns containing the histogram
     """
 
-    # histdata is returned as a Pandas Series, make histdata into a dataframe
     # The index values are the duration, and the first (and only) column is 'Frequency'
-    histdata = tracks.groupby('Track Duration')['Track Duration'].size()
-    histdata = pd.DataFrame(histdata)
-    histdata.columns = ['Frequency']
-    histdata['Track Duration'] = histdata.index
+    durations = tracks['Track Duration'].to_numpy(dtype=float)
+    frames = get_duration_in_frames(durations[~np.isnan(durations)])
+    frame_bins, bin_nrs = get_frame_bins(frames)
+    return compile_duration_from_histogram(frame_bins, np.bincount(bin_nrs, minlength=len(frame_bins)))
 
-    # This is alternative code to the above
-    # histdata_1 = tracks['Track Duration'].value_counts().reset_index()
-    # histdata_1.columns = ['Track Duration', 'Frequency']
-    # histdata_1 = histdata_1.sort_values(by='Track Duration')
-    # histdata_1 = histdata_1.set_index('Track Duration', drop=False)
 
+def compile_duration_from_histogram(frames, histogram):
+    """
+    The function produces a frequency distribution of the track durations from track counts by duration.
+    :param frames: The track durations that are counted, in frames
+    :param histogram: The number of tracks for each duration
+    :return: A dataframe with two columns containing the histogram, with only the durations that occur
+    """
+
+    occurs = histogram > 0
+    durations = get_duration_in_seconds(frames[occurs])
+    histdata = pd.DataFrame({'Frequency': histogram[occurs].astype(np.int64)},
+                            index=pd.Index(durations, name='Track Duration'))
+    histdata['Track Duration'] = histdata.index
     return histdata
 
 
@@ -149,6 +183,157 @@ def curve_fit_and_plot(
     return tau_per_sec, r_squared
 
 
+def curve_fit_batched(
+        x: np.ndarray,
+        frequencies: np.ndarray,
+        max_iterations: int = 200) -> tuple:
+    """
+    The function fits the exponential decay function m * np.exp(-t * x) + b to a whole stack of duration
+    histograms at once, with Levenberg-Marquardt iterations that are vectorised over the histograms.
+    All histograms share the duration bins x. As in curve_fit_and_plot, only the bins that hold tracks take part
+    in the fit of a histogram. Each fit starts from a log-linear estimate of its own histogram.
+
+    :param x: The durations of the bins, shape (nr_bins,)
+    :param frequencies: The number of tracks per bin, shape (nr_histograms, nr_bins)
+    :param max_iterations: The fits that have not converged by then are considered to have failed
+    :return: Two arrays with the Tau (in ms) and R squared of each histogram. Tau is -2 (and R squared 0)
+             when the fit failed.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(frequencies, dtype=float)
+    weights = (y > 0).astype(float)
+    nr_points = weights.sum(axis=1)
+
+    with np.errstate(all='ignore'):
+
+        # Log-linear initial guess: fit log(y) = log(m) - t * x through the bins that hold tracks
+        log_y = np.where(y > 0, np.log(np.where(y > 0, y, 1)), 0)
+        mean_x = (weights * x).sum(axis=1) / nr_points
+        mean_log_y = (weights * log_y).sum(axis=1) / nr_points
+        dx = weights * (x - mean_x[:, None])
+        slope = (dx * (log_y - mean_log_y[:, None])).sum(axis=1) / (dx * dx).sum(axis=1)
+        m = np.exp(mean_log_y - slope * mean_x)
+        t = -slope
+        b = np.zeros(len(y))
+
+        # Fall back to the starting point used by curve_fit_and_plot when the estimate is not usable
+        no_estimate = ~np.isfinite(m) | ~np.isfinite(t) | (t <= 0)
+        m[no_estimate], t[no_estimate], b[no_estimate] = 2000, 4, 10
+        params = np.stack([m, t, b], axis=1)
+
+        def residuals_of(p):
+            return weights * (y - (p[:, 0:1] * np.exp(-p[:, 1:2] * x) + p[:, 2:3]))
+
+        residuals = residuals_of(params)
+        cost = (residuals * residuals).sum(axis=1)
+
+        # There have to be at least as many points as parameters to do a fit
+        active = nr_points >= 3
+        converged = np.zeros(len(y), dtype=bool)
+        damping = np.full(len(y), 1e-3)
+
+        for _ in range(max_iterations):
+            if not active.any():
+                break
+
+            # The Jacobian of the fitted function with respect to m, t and b
+            exp_tx = np.exp(-params[:, 1:2] * x)
+            jacobian = np.stack([exp_tx, -params[:, 0:1] * x * exp_tx, np.ones_like(exp_tx)], axis=2)
+            jacobian *= weights[:, :, None]
+
+            # Solve the damped normal equations (J'J + lambda * diag(J'J)) delta = J'r for all fits at once
+            jtj = np.einsum('sbi,sbj->sij', jacobian, jacobian)
+            jtr = np.einsum('sbi,sb->si', jacobian, residuals)
+            diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+            diagonal = diagonal + 1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300
+            damped = jtj + damping[:, None, None] * (diagonal[:, :, None] * np.eye(3))
+            damped[~active] = np.eye(3)
+            delta = np.linalg.solve(damped, jtr[:, :, None])[:, :, 0]
+
+            new_params = params + delta
+            new_residuals = residuals_of(new_params)
+            new_cost = (new_residuals * new_residuals).sum(axis=1)
+
+            improved = active & np.isfinite(new_cost) & (new_cost < cost)
+            small_change = improved & ((cost - new_cost) <= 1e-10 * cost)
+            small_step = active & (np.abs(delta).max(axis=1) <= 1e-10 * (np.abs(params).max(axis=1) + 1e-10))
+
+            params[improved] = new_params[improved]
+            residuals[improved] = new_residuals[improved]
+            cost[improved] = new_cost[improved]
+            damping = np.where(improved, damping / 10, damping * 10)
+
+            converged |= small_change | small_step | (active & (cost == 0))
+            active &= ~converged & (damping < 1e16)
+
+        # Determine the quality of the fits
+        mean_y = (weights * y).sum(axis=1) / nr_points
+        squared_diffs_from_mean = (weights * (y - mean_y[:, None]) ** 2).sum(axis=1)
+        r_squared = np.where(squared_diffs_from_mean == 0, 0, 1 - cost / squared_diffs_from_mean)
+
+        # Convert to milliseconds
+        tau = 1000 / params[:, 1]
+
+    failed = ~converged | ~np.isfinite(params).all(axis=1) | ~np.isfinite(tau) | (params[:, 1] <= 0)
+    tau = np.where(failed, -2, tau)
+    r_squared = np.where(failed, 0, r_squared)
+    return tau, r_squared
+
+
+def maximum_likelihood_fit(
+        frames: np.ndarray,
+        frequencies: np.ndarray,
+        min_frames: int) -> tuple:
+    """
+    The function estimates the Tau of a whole stack of duration histograms by maximum likelihood, directly from the
+    track counts, without fitting a curve. A track duration is a whole number of frames and only tracks of at least
+    min_frames are recorded, so the durations are taken to follow an exponential decay that starts at min_frames:
+    P(k) = (1 - q) * q ** (k - min_frames), with q = exp(-FRAME_INTERVAL / Tau).
+    The likelihood is largest for q = m / (1 + m), where m is the mean number of frames the tracks last beyond
+    min_frames, so Tau follows in closed form.
+    The R squared compares, at the durations that occur, the fraction of tracks that last at least that long with
+    q ** (k - min_frames). Unlike a histogram, this fraction does not depend on how many tracks fall in each bin.
+    It is not the R squared of a curve fit to the histogram, but it is compared with the same Min Required R Squared,
+    so with the same threshold other squares get a Tau than with the curve fit.
+
+    :param frames: The durations of the bins in frames, shape (nr_bins,)
+    :param frequencies: The number of tracks per bin, shape (nr_histograms, nr_bins)
+    :param min_frames: The duration of the shortest track TrackMate keeps, in frames
+    :return: Two arrays with the Tau (in ms) and R squared of each histogram. Tau is -2 (and R squared 0)
+             when the durations do not determine a Tau, because no track lasts longer than min_frames.
+    """
+
+    frames = np.asarray(frames, dtype=float)
+    y = np.asarray(frequencies, dtype=float)
+
+    # Tracks shorter than the cutoff are only possible when the cutoff was changed after the tracks were made
+    if len(frames) > 0:
+        min_frames = min(min_frames, frames.min())
+    frames_beyond_min = frames - min_frames
+
+    with np.errstate(all='ignore'):
+        nr_tracks = y.sum(axis=1)
+        mean_frames_beyond_min = (y * frames_beyond_min).sum(axis=1) / nr_tracks
+        q = mean_frames_beyond_min / (1 + mean_frames_beyond_min)
+
+        # Convert to milliseconds: Tau = -FRAME_INTERVAL / log(q)
+        tau = 1000 * FRAME_INTERVAL / np.log1p(1 / mean_frames_beyond_min)
+
+        # Determine the quality of the fits
+        weights = (y > 0).astype(float)
+        survival = np.cumsum(y[:, ::-1], axis=1)[:, ::-1] / nr_tracks[:, None]
+        expected_survival = q[:, None] ** frames_beyond_min
+        mean_survival = (weights * survival).sum(axis=1) / weights.sum(axis=1)
+        squared_diffs = (weights * (survival - expected_survival) ** 2).sum(axis=1)
+        squared_diffs_from_mean = (weights * (survival - mean_survival[:, None]) ** 2).sum(axis=1)
+        r_squared = np.where(squared_diffs_from_mean == 0, 0, 1 - squared_diffs / squared_diffs_from_mean)
+
+    failed = ~(mean_frames_beyond_min > 0) | ~np.isfinite(tau) | ~np.isfinite(r_squared)
+    tau = np.where(failed, -2, tau)
+    r_squared = np.where(failed, 0, r_squared)
+    return tau, r_squared
+
 
 if __name__ == "__main__":
     # Example usage
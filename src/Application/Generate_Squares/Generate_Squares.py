@@ -1,5 +1,8 @@
+import logging
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 import numpy as np
 import pandas as pd
@@ -9,6 +12,7 @@ from src.Application.Recording_Viewer.Select_Squares import (
     label_selected_squares_and_tracks)
 from src.Fiji.LoggerConfig import (
     paint_logger,
+    PAINT_WORKER_ENVIRONMENT_VARIABLE,
     paint_logger_change_file_handler_name,
     paint_logger_file_name_assigned)
 
@@ -17,23 +21,52 @@ if not paint_logger_file_name_assigned:
 
 from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
     get_square_coordinates,
-    calc_variability,
+    get_row_and_col_nr_of_tracks,
+    get_square_nr_from_row_and_col,
+    grids_nest,
+    group_tracks_by_square,
+    share_track_columns,
+    read_shared_track_columns,
+    grouped_count,
+    grouped_max,
+    grouped_sum,
+    grouped_mean,
+    grouped_median,
+    calc_variability_of_squares,
     calculate_density,
     calc_area_of_square,
     calc_average_track_count_in_background_squares,
     create_unique_key_for_squares,
+    create_unique_key_for_tracks,
     extra_constraints_on_tracks_for_tau_calculation,
     add_columns_to_experiment,
     read_recordings_of_experiment,
     read_tracks_of_experiment,
+    read_tracks_of_experiment_by_recording,
     get_row_and_column,
     calculate_tau,
-    calculate_median_long_track,
-    calculate_median_short_track
+    calculate_tau_of_squares,
+    get_duration_histograms_of_squares,
+    calculate_tau_from_duration_histograms,
+    grouped_order_statistics
 )
 
+from src.Application.Generate_Squares.Generate_Squares_Manifest import (
+    experiment_is_up_to_date,
+    get_generate_squares_parameters,
+    get_input_fingerprints,
+    remove_manifest,
+    write_manifest)
+
+from src.Application.Generate_Squares.Square_Statistics_Cache import (
+    get_square_statistics_key,
+    read_square_statistics_cache,
+    write_square_statistics_cache)
+
 from src.Application.Support.General_Support_Functions import (
-    format_time_nicely)
+    concat_csv_files,
+    format_time_nicely,
+    save_csv_atomically)
 
 from src.Fiji.DirectoriesAndLocations import (
     delete_files_in_directory)
@@ -59,10 +92,15 @@ def process_project(
         nr_of_squares_in_row: int,
         min_required_r_squared: float,
         min_tracks_for_tau: int,
-        paint_force: bool = False) -> None:
+        paint_force: bool = False,
+        nr_of_workers: int = None) -> int:
     """
     This function processes all Recordings in a Project.
     It calls the function 'process_experiment' for each Experiment in the Project.
+
+    Experiments are independent of each other, so with more than one worker they are processed in parallel in a
+    pool of processes. The number of workers is taken from the Paint configuration when not specified; 1 processes
+    the experiments one after the other and 0 uses all cores.
     """
 
     paint_logger.info(f"Starting generating squares for all recordings in {project_path}")
@@ -70,7 +108,10 @@ def process_project(
     experiment_dirs = os.listdir(project_path)
     experiment_dirs.sort()
 
-    nr_experiments_processed = 0
+    # Decide for each experiment whether it needs processing
+    parameters = get_generate_squares_parameters(
+        select_parameters, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+    experiments = []
     for experiment_dir in experiment_dirs:
 
         # Skip if not a directory or if it is in the skipped directories list
@@ -81,30 +122,181 @@ def process_project(
         if any(x in experiment_dir for x in skip_dirs):
             continue
 
-        # Look at the time tags and decide if reprocessing is needed. Always process when the paint_force flag is set
-        if (os.path.exists(os.path.join(project_path, experiment_dir)) and
+        # Look at the manifest and decide if reprocessing is needed. Always process when the paint_force flag is set
+        skip = (os.path.exists(os.path.join(project_path, experiment_dir)) and
                 os.path.exists(os.path.join(project_path, experiment_dir, 'All Squares.csv')) and
                 os.path.exists(os.path.join(project_path, experiment_dir, 'All Recordings.csv')) and
                 os.path.exists(os.path.join(project_path, experiment_dir, 'All Tracks.csv')) and
-                not paint_force):
-            paint_logger.info('')
-            paint_logger.info(f"Experiment output exists and skipped: {experiment_dir}")
-            paint_logger.info('')
-            continue
+                not paint_force)
+        if skip and not experiment_is_up_to_date(os.path.join(project_path, experiment_dir), parameters):
+            paint_logger.info(f"Experiment inputs or parameters changed since the last run: {experiment_dir}")
+            skip = False
+        experiments.append((experiment_dir, skip))
+
+    if nr_of_workers is None:
+        nr_of_workers = get_paint_attribute_with_default('Generate Squares', 'Nr of Workers', 1)
+    if nr_of_workers == 0:
+        nr_of_workers = os.cpu_count() or 1
+    nr_of_workers = min(nr_of_workers, sum(1 for _, skip in experiments if not skip))
+
+    experiment_parameters = dict(
+        select_parameters=select_parameters,
+        nr_of_squares_in_row=nr_of_squares_in_row,
+        min_required_r_squared=min_required_r_squared,
+        min_tracks_for_tau=min_tracks_for_tau,
+        paint_force=paint_force)
+
+    if nr_of_workers <= 1:
+        nr_experiments_processed = 0
+        for experiment_dir, skip in experiments:
+            if skip:
+                log_experiment_skipped(experiment_dir)
+                continue
+
+            # Process the experiment
+            if process_experiment(os.path.join(project_path, experiment_dir), **experiment_parameters):
+                nr_experiments_processed += 1
+            else:
+                paint_logger.error(f"Experiment {experiment_dir} failed")
+        return nr_experiments_processed
+
+    return process_experiments_in_parallel(project_path, experiments, experiment_parameters, nr_of_workers)
+
+
+def log_experiment_skipped(experiment_dir: str) -> None:
+    paint_logger.info('')
+    paint_logger.info(f"Experiment output exists and skipped: {experiment_dir}")
+    paint_logger.info('')
+
+
+def process_experiments_in_parallel(
+        project_path: str,
+        experiments: list,
+        experiment_parameters: dict,
+        nr_of_workers: int) -> int:
+    """
+    Processes the experiments in a pool of worker processes.
+
+    The log messages of every experiment are collected in its worker and written out here, in the order of the
+    experiments, so the log reads the same as that of a sequential run. An experiment that fails is reported and does
+    not stop the other experiments.
+    """
 
-        # Process the experiment
-        process_experiment(
-            os.path.join(project_path, experiment_dir),
-            select_parameters=select_parameters,
-            nr_of_squares_in_row=nr_of_squares_in_row,
-            min_required_r_squared=min_required_r_squared,
-            min_tracks_for_tau=min_tracks_for_tau,
-            paint_force=paint_force)
-        nr_experiments_processed += 1
+    paint_logger.info(f"Processing experiments with {nr_of_workers} workers")
+    paint_logger.info('')
+    time_stamp = time.time()
+
+    # The recordings of an experiment are not processed in parallel as well, the experiments keep the workers busy
+    experiment_parameters = dict(experiment_parameters, nr_of_recording_workers=1)
+
+    with paint_worker_pool(nr_of_workers) as executor:
+        futures = {
+            experiment_dir: executor.submit(
+                process_experiment_in_worker, os.path.join(project_path, experiment_dir), experiment_parameters)
+            for experiment_dir, skip in experiments if not skip}
+
+        # Report in experiment order, waiting for each experiment in turn
+        experiment_results = []
+        for experiment_dir, skip in experiments:
+            if skip:
+                log_experiment_skipped(experiment_dir)
+                continue
+            try:
+                status, run_time, log_records = futures[experiment_dir].result()
+            except Exception as e:  # The worker process itself died
+                status, run_time, log_records = 'Failed', 0, []
+                paint_logger.error(f"Worker for {experiment_dir} stopped unexpectedly: {e}")
+            for record in log_records:
+                paint_logger.handle(record)
+            if status != 'Processed':
+                paint_logger.error(f"Experiment {experiment_dir} failed")
+            experiment_results.append((experiment_dir, status, run_time))
+
+    # Summarise the status and timing of each experiment
+    nr_experiments_processed = sum(1 for _, status, _ in experiment_results if status == 'Processed')
+    paint_logger.info('')
+    for experiment_dir, status, run_time in experiment_results:
+        paint_logger.info(f"{experiment_dir:40s} {status:10s} {format_time_nicely(run_time)}")
+    paint_logger.info(
+        f"Processed {nr_experiments_processed} of {len(experiment_results)} experiments with {nr_of_workers} workers "
+        f"in {format_time_nicely(time.time() - time_stamp)}")
+    paint_logger.info('')
 
     return nr_experiments_processed
 
 
+def process_experiment_in_worker(experiment_path: str, experiment_parameters: dict):
+    """
+    Runs process_experiment in a worker process and returns its status, run time and log records.
+    """
+
+    time_stamp = time.time()
+    with collecting_log_records() as log_records:
+        try:
+            status = 'Processed' if process_experiment(experiment_path, **experiment_parameters) else 'Failed'
+        except (Exception, SystemExit):  # The checks of the All Recordings file exit on an invalid file
+            paint_logger.exception(f"Error processing {experiment_path}")
+            status = 'Failed'
+
+    return status, time.time() - time_stamp, log_records
+
+
+@contextmanager
+def paint_worker_pool(nr_of_workers: int):
+    """
+    A pool of worker processes. The workers inherit the environment, the variable set here stops them from creating
+    (and truncating) the log files, which belong to the parent process.
+    """
+
+    previous_worker_setting = os.environ.get(PAINT_WORKER_ENVIRONMENT_VARIABLE)
+    os.environ[PAINT_WORKER_ENVIRONMENT_VARIABLE] = '1'
+    try:
+        with ProcessPoolExecutor(max_workers=nr_of_workers) as executor:
+            yield executor
+    finally:
+        if previous_worker_setting is None:
+            del os.environ[PAINT_WORKER_ENVIRONMENT_VARIABLE]
+        else:
+            os.environ[PAINT_WORKER_ENVIRONMENT_VARIABLE] = previous_worker_setting
+
+
+@contextmanager
+def collecting_log_records():
+    """
+    Collect the log messages instead of writing them, so that a worker can hand them to the parent process, which
+    writes them out in order.
+    """
+
+    collector = CollectingLogHandler()
+    original_handlers = paint_logger.handlers[:]
+    for handler in original_handlers:
+        paint_logger.removeHandler(handler)
+    paint_logger.addHandler(collector)
+    try:
+        yield collector.records
+    finally:
+        paint_logger.removeHandler(collector)
+        for handler in original_handlers:
+            paint_logger.addHandler(handler)
+
+
+class CollectingLogHandler(logging.Handler):
+    """
+    Keeps log records in memory, reduced to plain messages so that they can be sent to another process.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message += '\n' + logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info, record.exc_text = message, None, None, None
+        self.records.append(record)
+
+
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
@@ -120,26 +312,44 @@ def process_experiment(
         nr_of_squares_in_row: int,
         min_required_r_squared: float,
         min_tracks_for_tau: int,
-        paint_force: bool = False) -> None:
+        paint_force: bool = False,
+        nr_of_recording_workers: int = None) -> bool:
     """
     This function processes all Recordings in an Experiment.
     It reads the All Recordings file to find out which Recordings need processing
+    Returns True when the output files and the manifest have been written, False when the Experiment could not be
+    processed (for instance because there are no recordings or tracks to process).
+
+    With more than one recording worker, the recordings are processed in parallel in a pool of processes. The
+    number of workers is taken from the Paint configuration when not specified; 0 uses all cores.
+
+    With 'Stream Tracks' set in the Paint configuration, the All Tracks file is not read at once, but Recording by
+    Recording, and the tracks of a Recording are written out as soon as it is processed. Memory use is then bounded
+    by the largest Recording rather than the Experiment. The recordings are processed one after the other then.
     """
 
     # Preparations
     plot_to_file = get_paint_attribute_with_default('Generate Squares', 'Plot to File', False)
+    stream_tracks = get_paint_attribute_with_default('Generate Squares', 'Stream Tracks', False)
     time_stamp = time.time()
-    df_squares_of_experiment = pd.DataFrame()
-    df_tracks_of_experiment_with_labels = pd.DataFrame()
+    # The squares and tracks of the recordings are collected and concatenated once, at the end
+    squares_of_recordings = {}
+    tracks_of_recordings = []
+
+    # Fingerprint the input files before they are read, for the manifest. The manifest of an earlier run is removed
+    # and only written again when this run succeeds, so an Experiment that fails is not skipped next time
+    input_fingerprints = get_input_fingerprints(experiment_path)
+    remove_manifest(experiment_path)
 
     # Read the Recordings file, check the integrity and add some columns
     df_recordings_of_experiment = read_recordings_of_experiment(experiment_path)
     if len(df_recordings_of_experiment) == 0:
         paint_logger.info(f"No Recordings found in {experiment_path}")
-        return
+        return False
 
     # Read the Tracks file and add (or reinitialise two columns for the square and label numbers)
-    df_tracks_of_experiment = read_tracks_of_experiment(experiment_path)
+    if not stream_tracks:
+        df_tracks_of_experiment = read_tracks_of_experiment(experiment_path)
 
     # Add some parameters that the user just specified to the experiment
     df_recordings_of_experiment = add_columns_to_experiment(
@@ -150,19 +360,19 @@ def process_experiment(
         select_parameters['min_required_density_ratio'],
         select_parameters['max_allowable_variability'])
 
-    # Determine how many names there are from Recordings and Tracks and compare
-    nr_files_tracks = df_tracks_of_experiment['Ext Recording Name'].nunique()
-
+    # Determine how many names there are from Recordings and Tracks and compare (when streaming, once all tracks
+    # have been read)
     mask = (df_recordings_of_experiment['Process'].fillna('').str.lower().isin(['yes', 'y']) &
             (df_recordings_of_experiment['Nr Tracks'] > 0))
     nr_of_recordings_to_process = mask.sum()
 
-    if nr_of_recordings_to_process != nr_files_tracks:
-        paint_logger.info(f"All Tracks file is not consistent with All Recordings for {experiment_path}")
-    nr_files = nr_files_tracks
-    if nr_files <= 0:
-        paint_logger.info("No files selected for processing")
-        return
+    if not stream_tracks:
+        # A missing or unreadable tracks file gives an empty table without recording names
+        nr_recordings_in_tracks = (df_tracks_of_experiment['Ext Recording Name'].nunique()
+                                   if 'Ext Recording Name' in df_tracks_of_experiment.columns else 0)
+        nr_files = check_recordings_in_tracks(nr_recordings_in_tracks, nr_of_recordings_to_process, experiment_path)
+        if nr_files <= 0:
+            return False
 
     # --------------------------------------------------------------------------------------------
     # Loop though selected recordings
@@ -171,32 +381,127 @@ def process_experiment(
     current_image_nr = 1
     processed = 0
 
-    paint_logger.info(f"Processing {nr_of_recordings_to_process:2d} images in {experiment_path}")
-    for index, recording_data in df_recordings_of_experiment.iterrows():
+    recordings_to_process = [
+        (index, recording_data) for index, recording_data in df_recordings_of_experiment.iterrows()
+        if not (recording_data['Process'] in {'No', 'n', 'N'} or recording_data['Nr Tracks'] == -1)]
+
+    if nr_of_recording_workers is None:
+        nr_of_recording_workers = get_paint_attribute_with_default('Generate Squares', 'Nr of Recording Workers', 1)
+    if nr_of_recording_workers == 0:
+        nr_of_recording_workers = os.cpu_count() or 1
+    if stream_tracks:
+        nr_of_recording_workers = 1
+
+    # The square statistics do not depend on the selection parameters, so they are reused for unchanged recordings
+    use_cache = get_paint_attribute_with_default('Generate Squares', 'Cache Square Statistics', True)
+    cached_square_statistics = read_square_statistics_cache(experiment_path) if use_cache else {}
+    square_statistics = {}
+    square_statistics_keys = {}
+
+    # The tracks of a recording are taken from the experiment by their row numbers, which are determined once
+    if not stream_tracks:
+        row_nrs_of_recordings = df_tracks_of_experiment.groupby('Ext Recording Name', sort=False).indices
+
+        def get_tracks_of_recording(recording_data):
+            return df_tracks_of_experiment.iloc[row_nrs_of_recordings.get(recording_data['Ext Recording Name'], [])]
+
+    # With the cache, the keys are needed up front to know which recordings to compile; the tracks of the
+    # recordings are then kept for the loop below
+    tracks_of_recordings_by_index = {}
+    if use_cache and not stream_tracks:
+        for index, recording_data in recordings_to_process:
+            tracks_of_recordings_by_index[index] = get_tracks_of_recording(recording_data)
+            square_statistics_keys[index] = get_square_statistics_key(
+                tracks_of_recordings_by_index[index],
+                recording_data,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau)
+    recordings_to_compile = [(index, recording_data) for index, recording_data in recordings_to_process
+                             if square_statistics_keys.get(index) not in cached_square_statistics]
 
-        if recording_data['Process'] in {'No', 'n', 'N'} or recording_data['Nr Tracks'] == -1:
-            continue
+    if plot_to_file:
+        prepare_plot_directory(experiment_path)
+
+    # With more than one worker, compile the square statistics of all recordings in parallel first; the results are
+    # then used in order below
+    nr_of_recording_workers = min(nr_of_recording_workers, len(recordings_to_compile))
+    recording_results = {}
+    if nr_of_recording_workers > 1:
+        recording_results = compile_square_statistics_in_parallel(
+            df_tracks_of_experiment,
+            recordings_to_compile,
+            nr_of_squares_in_row,
+            min_required_r_squared,
+            min_tracks_for_tau,
+            nr_of_recording_workers)
+
+    # When streaming, the tracks of a recording are written to a temporary file as soon as it is processed
+    if stream_tracks:
+        recording_names_in_tracks = []
+        tracks_of_recordings_to_process = stream_tracks_of_recordings(
+            experiment_path, recordings_to_process, recording_names_in_tracks)
+        temp_tracks_file_path = os.path.join(experiment_path, 'All Tracks.csv.tmp')
+        tracks_written = False
+    else:
+        tracks_of_recordings_to_process = (
+            (index, recording_data,
+             tracks_of_recordings_by_index.pop(index) if use_cache else get_tracks_of_recording(recording_data))
+            for index, recording_data in recordings_to_process)
+
+    paint_logger.info(f"Processing {nr_of_recordings_to_process:2d} images in {experiment_path}")
+    for index, recording_data, df_tracks_of_recording in tracks_of_recordings_to_process:
 
         recording_name = recording_data['Ext Recording Name']
 
         # Process the Recording
         paint_logger.debug(f"Processing file {current_image_nr} of {nr_of_recordings_to_process}: {recording_name}")
 
-        df_tracks_of_recording = df_tracks_of_experiment[
-            df_tracks_of_experiment['Ext Recording Name'] == recording_name]
-        df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density = process_recording(
-            df_tracks_of_recording,
-            select_parameters,
-            recording_data,
-            experiment_path,
-            recording_name,
-            nr_of_squares_in_row,
-            min_required_r_squared,
-            min_tracks_for_tau,
-            plot_to_file)
+        # Phase 1: the square statistics, from the cache, from the parallel workers or calculated here
+        square_statistics_key = None
+        if use_cache and stream_tracks:
+            square_statistics_key = get_square_statistics_key(
+                df_tracks_of_recording,
+                recording_data,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau)
+        elif use_cache:
+            square_statistics_key = square_statistics_keys[index]
+        if square_statistics_key in cached_square_statistics:
+            df_squares_of_recording, square_nrs_of_tracks = cached_square_statistics[square_statistics_key]
+            df_squares_of_recording = df_squares_of_recording.copy()
+            df_tracks_of_recording['Square Nr'] = square_nrs_of_tracks
+        elif index in recording_results:
+            df_squares_of_recording, square_nrs_of_tracks, log_records = recording_results[index]
+            for record in log_records:
+                paint_logger.handle(record)
+            df_tracks_of_recording['Square Nr'] = square_nrs_of_tracks
+        else:
+            df_squares_of_recording = compile_square_statistics_of_recording(
+                df_tracks_of_recording,
+                recording_data,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau)
+        if use_cache:
+            square_statistics[square_statistics_key] = (
+                df_squares_of_recording.copy(), df_tracks_of_recording['Square Nr'].array)
+
+        # Phase 2: the selection of the squares and the Recording Tau
+        df_squares_of_recording, df_tracks_of_recording, recording_tau, recording_r_squared, recording_density = \
+            select_squares_of_recording(
+                df_squares_of_recording,
+                df_tracks_of_recording,
+                select_parameters,
+                recording_data,
+                recording_name,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau)
         if df_squares_of_recording is None:
             paint_logger.error("Aborted with error")
-            return None
+            return False
 
         # Update the Experiment with the results
         df_recordings_of_experiment.at[index, 'Ext Recording Name'] = recording_name
@@ -206,22 +511,336 @@ def process_experiment(
 
         current_image_nr += 1
         processed += 1
-        df_squares_of_experiment = pd.concat([df_squares_of_experiment, df_squares_of_recording], ignore_index=True)
-        df_tracks_of_experiment_with_labels = pd.concat([df_tracks_of_experiment_with_labels, df_tracks_of_recording],
-                                                        ignore_index=True)
+        squares_of_recordings[index] = df_squares_of_recording
+        if stream_tracks:
+            create_unique_key_for_tracks(df_tracks_of_recording).to_csv(
+                temp_tracks_file_path, mode='a' if tracks_written else 'w', header=not tracks_written, index=False)
+            tracks_written = True
+        else:
+            tracks_of_recordings.append(df_tracks_of_recording)
 
     # Save the updated tracks to the All Tracks file (the square and label columns have been updated)
-    df_tracks_of_experiment_with_labels.to_csv(os.path.join(experiment_path, 'All Tracks.csv'), index=False)
+    if stream_tracks:
+        nr_files = check_recordings_in_tracks(
+            len(recording_names_in_tracks), nr_of_recordings_to_process, experiment_path)
+        if nr_files <= 0:
+            return False
+        if tracks_written:
+            os.replace(temp_tracks_file_path, os.path.join(experiment_path, 'All Tracks.csv'))
+        else:
+            save_csv_atomically(pd.DataFrame(), os.path.join(experiment_path, 'All Tracks.csv'))
+    else:
+        # The experiment-level table is built in one concatenation; the recordings' own frames are released on the way
+        df_tracks_of_experiment_with_labels = create_unique_key_for_tracks(concat_recordings(tracks_of_recordings))
+        save_csv_atomically(df_tracks_of_experiment_with_labels, os.path.join(experiment_path, 'All Tracks.csv'))
+        del df_tracks_of_experiment_with_labels
+
+    # The squares are kept in the order of the recordings
+    df_squares_of_experiment = concat_recordings(
+        [squares_of_recordings[index] for index, _ in recordings_to_process if index in squares_of_recordings])
 
     # Save df_squares_of_experiment into the All Recordings file
-    df_recordings_of_experiment.to_csv(os.path.join(experiment_path, "All Recordings.csv"), index=False)
+    save_csv_atomically(df_recordings_of_experiment, os.path.join(experiment_path, "All Recordings.csv"))
 
     # Make a unique index and then save df_squares_of_experiment into the All Squares file
     df_squares_of_experiment = create_unique_key_for_squares(df_squares_of_experiment)
-    df_squares_of_experiment.to_csv(os.path.join(experiment_path, "All Squares.csv"), index=False)
+    save_csv_atomically(df_squares_of_experiment, os.path.join(experiment_path, "All Squares.csv"))
+
+    if use_cache:
+        write_square_statistics_cache(experiment_path, square_statistics)
+
+    # Record what the output was generated from, so that an unchanged Experiment can be skipped next time
+    write_manifest(
+        experiment_path,
+        input_fingerprints,
+        get_generate_squares_parameters(
+            select_parameters, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau))
 
     run_time = round(time.time() - time_stamp, 1)
     paint_logger.info(f"Processed  {nr_files:2d} images in {experiment_path} in {format_time_nicely(run_time)}")
+    return True
+
+
+def check_recordings_in_tracks(
+        nr_recordings_in_tracks: int,
+        nr_of_recordings_to_process: int,
+        experiment_path: str) -> int:
+    """
+    Compares the number of recordings in the All Tracks file with the number to process and returns it.
+    """
+
+    if nr_of_recordings_to_process != nr_recordings_in_tracks:
+        paint_logger.info(f"All Tracks file is not consistent with All Recordings for {experiment_path}")
+    if nr_recordings_in_tracks <= 0:
+        paint_logger.info("No files selected for processing")
+    return nr_recordings_in_tracks
+
+
+def stream_tracks_of_recordings(experiment_path: str, recordings_to_process: list, recording_names_in_tracks: list):
+    """
+    Yields the index, data and tracks of the recordings to process, one at a time in the order of the All Tracks
+    file, as soon as the tracks of a recording have been read. Recordings without tracks follow at the end. The names
+    of all recordings found in the All Tracks file are added to recording_names_in_tracks.
+    """
+
+    recordings_by_name = {}
+    for index, recording_data in recordings_to_process:
+        recordings_by_name.setdefault(recording_data['Ext Recording Name'], []).append((index, recording_data))
+
+    df_no_tracks = None
+    for recording_name, df_tracks_of_recording in read_tracks_of_experiment_by_recording(experiment_path):
+        recording_names_in_tracks.append(recording_name)
+        df_no_tracks = df_tracks_of_recording.iloc[0:0]
+        recordings = recordings_by_name.pop(recording_name, [])
+        for index, recording_data in recordings:
+            yield index, recording_data, \
+                df_tracks_of_recording if len(recordings) == 1 else df_tracks_of_recording.copy()
+
+    # Nothing is processed when the All Tracks file holds no tracks at all
+    if df_no_tracks is None:
+        return
+    for recordings in recordings_by_name.values():
+        for index, recording_data in recordings:
+            yield index, recording_data, df_no_tracks.copy()
+
+
+def concat_recordings(frames_of_recordings: list) -> pd.DataFrame:
+    """
+    Concatenate the frames of the recordings in one go. The list is emptied, so that the frames of the recordings
+    can be freed as soon as the concatenation is done.
+    """
+
+    if len(frames_of_recordings) == 0:
+        return pd.DataFrame()
+    df = pd.concat(frames_of_recordings, ignore_index=True)
+    frames_of_recordings.clear()
+    return df
+
+
+def compile_square_statistics_in_parallel(
+        df_tracks_of_experiment: pd.DataFrame,
+        recordings_to_compile: list,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        nr_of_workers: int) -> dict:
+    """
+    Compiles the square statistics of the recordings of an experiment in a pool of worker processes.
+
+    The numeric track columns are placed in shared memory once, grouped by recording, so a worker receives only the
+    range of rows of its recording rather than a pickled copy of its tracks.
+    Returns, by recording index, the squares of the recording, the square numbers of its tracks and the log records
+    of the worker.
+    """
+
+    # Group the tracks by recording, keeping the order of the tracks within a recording
+    recording_codes, recording_names = pd.factorize(df_tracks_of_experiment['Ext Recording Name'])
+    order = np.argsort(recording_codes, kind='stable')
+    recording_offsets = np.searchsorted(recording_codes[order], np.arange(len(recording_names) + 1))
+    track_ranges = {name: (recording_offsets[code], recording_offsets[code + 1])
+                    for code, name in enumerate(recording_names)}
+
+    shared_block, layout = share_track_columns(df_tracks_of_experiment, order)
+    try:
+        with paint_worker_pool(nr_of_workers) as executor:
+            futures = {}
+            for index, recording_data in recordings_to_compile:
+                start, stop = track_ranges.get(recording_data['Ext Recording Name'], (0, 0))
+                futures[index] = executor.submit(
+                    compile_square_statistics_in_worker,
+                    shared_block.name,
+                    layout,
+                    len(order),
+                    int(start),
+                    int(stop),
+                    recording_data,
+                    nr_of_squares_in_row,
+                    min_required_r_squared,
+                    min_tracks_for_tau)
+            recording_results = {index: future.result() for index, future in futures.items()}
+    finally:
+        shared_block.close()
+        shared_block.unlink()
+
+    return recording_results
+
+
+def compile_square_statistics_in_worker(
+        shared_block_name: str,
+        layout: list,
+        nr_tracks: int,
+        start: int,
+        stop: int,
+        recording_data: pd.Series,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> tuple:
+    """
+    Runs compile_square_statistics_of_recording in a worker process on the tracks of the recording in shared memory.
+    """
+
+    df_tracks_of_recording = read_shared_track_columns(shared_block_name, layout, nr_tracks, start, stop)
+
+    with collecting_log_records() as log_records:
+        df_squares_of_recording = compile_square_statistics_of_recording(
+            df_tracks_of_recording,
+            recording_data,
+            nr_of_squares_in_row,
+            min_required_r_squared,
+            min_tracks_for_tau)
+
+    return df_squares_of_recording, df_tracks_of_recording['Square Nr'].array, log_records
+
+
+# ----------------------------------------------------------------------------------------------------
+# ----------------------------------------------------------------------------------------------------
+# ----------------------------------------------------------------------------------------------------
+#                                Process Multiple Resolutions
+# ----------------------------------------------------------------------------------------------------
+# ----------------------------------------------------------------------------------------------------
+# ----------------------------------------------------------------------------------------------------
+
+def process_project_for_resolutions(
+        project_path: str,
+        select_parameters: dict,
+        nrs_of_squares_in_row: list,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> int:
+    """
+    Generates the squares of all Experiments in a Project for several grid sizes, with one read of the tracks of
+    every Experiment (see process_experiment_for_resolutions). The per-Experiment outputs are then combined into
+    'All Squares - <n>.csv' and 'All Recordings - <n>.csv' files in the Project directory.
+    """
+
+    paint_logger.info(f"Starting generating squares for {nrs_of_squares_in_row} squares in a row in {project_path}")
+    experiment_dirs = sorted(
+        experiment_dir for experiment_dir in os.listdir(project_path)
+        if os.path.isdir(os.path.join(project_path, experiment_dir)) and
+        not any(x in experiment_dir for x in ['Output', 'Diagnostics']))
+
+    experiments_processed = []
+    for experiment_dir in experiment_dirs:
+        if process_experiment_for_resolutions(
+                os.path.join(project_path, experiment_dir),
+                select_parameters,
+                nrs_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau):
+            experiments_processed.append(experiment_dir)
+
+    if len(experiments_processed) > 0:
+        for nr_of_squares_in_row in nrs_of_squares_in_row:
+            for file_name in [f'All Squares - {nr_of_squares_in_row}.csv', f'All Recordings - {nr_of_squares_in_row}.csv']:
+                concat_csv_files(os.path.join(project_path, file_name),
+                                 [os.path.join(project_path, experiment_dir, file_name)
+                                  for experiment_dir in experiments_processed])
+    return len(experiments_processed)
+
+
+def process_experiment_for_resolutions(
+        experiment_path: str,
+        select_parameters: dict,
+        nrs_of_squares_in_row: list,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> bool:
+    """
+    Generates the squares of an Experiment for several grid sizes with one read of the tracks. For every grid size
+    n, the files 'All Squares - <n>.csv' and 'All Recordings - <n>.csv' are written, identical to the All Squares
+    and All Recordings files that process_experiment produces for that grid size. The input files are not changed.
+
+    The grid sizes are handled from fine to coarse. When a coarse grid nests exactly in a finer one, the squares of
+    the tracks are derived from the finer squares instead of binning the tracks again.
+    """
+
+    time_stamp = time.time()
+    nrs_of_squares_in_row = sorted(set(nrs_of_squares_in_row), reverse=True)
+
+    df_recordings_of_experiment = read_recordings_of_experiment(experiment_path)
+    if len(df_recordings_of_experiment) == 0:
+        paint_logger.info(f"No Recordings found in {experiment_path}")
+        return False
+    df_tracks_of_experiment = read_tracks_of_experiment(experiment_path)
+
+    # A missing or unreadable tracks file gives an empty table without recording names
+    if 'Ext Recording Name' not in df_tracks_of_experiment.columns or \
+            df_tracks_of_experiment['Ext Recording Name'].nunique() <= 0:
+        paint_logger.info("No files selected for processing")
+        return False
+
+    recordings_to_process = [
+        (index, recording_data) for index, recording_data in df_recordings_of_experiment.iterrows()
+        if not (recording_data['Process'] in {'No', 'n', 'N'} or recording_data['Nr Tracks'] == -1)]
+
+    squares_of_recordings = {nr_of_squares_in_row: [] for nr_of_squares_in_row in nrs_of_squares_in_row}
+    recording_results = {nr_of_squares_in_row: {} for nr_of_squares_in_row in nrs_of_squares_in_row}
+
+    paint_logger.info(f"Processing {len(recordings_to_process):2d} images in {experiment_path} for "
+                      f"{nrs_of_squares_in_row} squares in a row")
+    for index, recording_data in recordings_to_process:
+        recording_name = recording_data['Ext Recording Name']
+        df_tracks_of_recording = df_tracks_of_experiment[
+            df_tracks_of_experiment['Ext Recording Name'] == recording_name]
+
+        rows_and_cols_of_tracks = {}
+        for nr_of_squares_in_row in nrs_of_squares_in_row:
+
+            # Derive the squares from the finest grid that this grid nests in, or bin the tracks
+            finer_nr_of_squares_in_row = next(
+                (finer for finer in reversed(list(rows_and_cols_of_tracks)) if grids_nest(finer, nr_of_squares_in_row)),
+                None)
+            if finer_nr_of_squares_in_row is None:
+                row_nrs, col_nrs = get_row_and_col_nr_of_tracks(df_tracks_of_recording, nr_of_squares_in_row)
+            else:
+                ratio = finer_nr_of_squares_in_row // nr_of_squares_in_row
+                finer_row_nrs, finer_col_nrs = rows_and_cols_of_tracks[finer_nr_of_squares_in_row]
+                row_nrs, col_nrs = finer_row_nrs // ratio, finer_col_nrs // ratio
+            rows_and_cols_of_tracks[nr_of_squares_in_row] = (row_nrs, col_nrs)
+
+            df_squares_of_recording = compile_square_statistics_of_recording(
+                df_tracks_of_recording,
+                recording_data,
+                nr_of_squares_in_row,
+                min_required_r_squared,
+                min_tracks_for_tau,
+                square_nrs=get_square_nr_from_row_and_col(row_nrs, col_nrs, nr_of_squares_in_row))
+            df_squares_of_recording, _, recording_tau, recording_r_squared, recording_density = \
+                select_squares_of_recording(
+                    df_squares_of_recording,
+                    df_tracks_of_recording,
+                    select_parameters,
+                    recording_data,
+                    recording_name,
+                    nr_of_squares_in_row,
+                    min_required_r_squared,
+                    min_tracks_for_tau)
+
+            squares_of_recordings[nr_of_squares_in_row].append(df_squares_of_recording)
+            recording_results[nr_of_squares_in_row][index] = (recording_tau, recording_r_squared, recording_density)
+
+    # Write the outputs for every grid size
+    for nr_of_squares_in_row in nrs_of_squares_in_row:
+        df_recordings = add_columns_to_experiment(
+            df_recordings_of_experiment.copy(),
+            nr_of_squares_in_row,
+            min_tracks_for_tau,
+            min_required_r_squared,
+            select_parameters['min_required_density_ratio'],
+            select_parameters['max_allowable_variability'])
+        for index, (recording_tau, recording_r_squared, recording_density) in recording_results[
+                nr_of_squares_in_row].items():
+            df_recordings.at[index, 'Tau'] = round(recording_tau, 0)
+            df_recordings.at[index, 'Density'] = round(recording_density, 5)
+            df_recordings.at[index, 'R Squared'] = round(recording_r_squared, 3)
+        save_csv_atomically(df_recordings,
+                            os.path.join(experiment_path, f'All Recordings - {nr_of_squares_in_row}.csv'))
+
+        df_squares = create_unique_key_for_squares(concat_recordings(squares_of_recordings[nr_of_squares_in_row]))
+        save_csv_atomically(df_squares, os.path.join(experiment_path, f'All Squares - {nr_of_squares_in_row}.csv'))
+
+    run_time = round(time.time() - time_stamp, 1)
+    paint_logger.info(f"Processed  {len(recordings_to_process):2d} images in {experiment_path} for "
+                      f"{len(nrs_of_squares_in_row)} grid sizes in {format_time_nicely(run_time)}")
+    return True
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -246,54 +865,74 @@ def process_recording(
     """
     This function processes a single Recording in an Experiment. It creates a grid of squares.
     For each square, the Tau and Density ratio is calculated. The squares are then filtered on visibility.
+
+    This is done in two phases: compile_square_statistics_of_recording calculates everything that does not depend
+    on the selection parameters, select_squares_of_recording does the selection and the Recording Tau.
     """
 
     # Create the Plot directory if needed
     if plot_to_file:
-        plot_dir = os.path.join(experiment_path, 'Plot')
-        if not os.path.exists(plot_dir):
-            os.makedirs(plot_dir)
-        else:
-            delete_files_in_directory(plot_dir)
+        prepare_plot_directory(experiment_path)
 
-    # -----------------------------------------------------------------------------------------------------
-    # A df_squares_of_recording dataframe is generated and, if the 'process_square_tau' flag is set, for every square the
-    # Tau and Density are calculated. The results are stored in 'All Squares'.
-    # -----------------------------------------------------------------------------------------------------
+    df_squares_of_recording = compile_square_statistics_of_recording(
+        df_tracks_of_recording,
+        recording_data,
+        nr_of_squares_in_row,
+        min_required_r_squared,
+        min_tracks_for_tau)
 
-    # Create the tau_matrix
-    tau_matrix = np.zeros((nr_of_squares_in_row, nr_of_squares_in_row), dtype=int)
+    return select_squares_of_recording(
+        df_squares_of_recording,
+        df_tracks_of_recording,
+        select_parameters,
+        recording_data,
+        recording_name,
+        nr_of_squares_in_row,
+        min_required_r_squared,
+        min_tracks_for_tau)
 
-    # Create an empty squares dataframe, that will contain the data for each square
-    df_squares_of_recording = pd.DataFrame()
-    nr_total_squares = int(nr_of_squares_in_row * nr_of_squares_in_row)
-    square_area = calc_area_of_square(nr_of_squares_in_row)
 
-    # --------------------------------------------------------------------------------------------
-    # Generate the data for a square in a row and append it to the squares dataframe
-    # --------------------------------------------------------------------------------------------
+def prepare_plot_directory(experiment_path: str) -> None:
+    plot_dir = os.path.join(experiment_path, 'Plot')
+    if not os.path.exists(plot_dir):
+        os.makedirs(plot_dir)
+    else:
+        delete_files_in_directory(plot_dir)
 
-    for square_seq_nr in range(nr_total_squares):
-        # Calculate the square_data and column number from the sequence number (all are 0-based)
-        row_nr, col_nr = get_row_and_column(square_seq_nr, nr_of_squares_in_row)
-        concentration = float(recording_data['Concentration'])
 
-        square_data = process_square(
-            df_tracks_of_recording,
-            df_tracks_of_recording,
-            recording_data,
-            nr_of_squares_in_row,
-            concentration,
-            min_required_r_squared,
-            min_tracks_for_tau,
-            square_area,
-            square_seq_nr,
-            row_nr,
-            col_nr)
+def compile_square_statistics_of_recording(
+        df_tracks_of_recording: pd.DataFrame,
+        recording_data: pd.Series,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int,
+        square_nrs: np.ndarray = None) -> pd.DataFrame:
+    """
+    Phase 1 of processing a Recording: bin the tracks into squares and calculate the Tau, Density, Variability,
+    track statistics and Density Ratio of every square. None of these depend on the selection parameters.
+    The 'Square Nr' column of df_tracks_of_recording is filled in. When the square numbers of the tracks are
+    already known, they can be passed in square_nrs.
+    """
 
-        # And add it to the squares dataframe and the recording_tau to the tau_matrix
-        df_squares_of_recording = pd.concat([df_squares_of_recording, pd.DataFrame.from_records([square_data])])
-        tau_matrix[row_nr, col_nr] = int(square_data['Tau'])
+    # -----------------------------------------------------------------------------------------------------
+    # A df_squares_of_recording dataframe is generated and for every square the Tau and Density are calculated.
+    # The results are stored in 'All Squares'.
+    # -----------------------------------------------------------------------------------------------------
+
+    nr_total_squares = int(nr_of_squares_in_row * nr_of_squares_in_row)
+
+    # Bin all tracks into squares in one pass, this also fills in the 'Square Nr' of the tracks
+    df_tracks_sorted_by_square, square_offsets = group_tracks_by_square(
+        df_tracks_of_recording, nr_of_squares_in_row, square_nrs)
+
+    # Generate the data for all squares of the recording in one go
+    df_squares_of_recording = compile_squares_of_recording(
+        df_tracks_sorted_by_square,
+        square_offsets,
+        recording_data,
+        nr_of_squares_in_row,
+        min_required_r_squared,
+        min_tracks_for_tau)
 
     nr_tracks_in_background = calc_average_track_count_in_background_squares(df_squares_of_recording,
                                                                              int(0.1 * nr_total_squares))
@@ -302,6 +941,22 @@ def process_recording(
     else:
         df_squares_of_recording['Density Ratio'] = round(df_squares_of_recording['Nr Tracks'] / nr_tracks_in_background,
                                                          1)
+    return df_squares_of_recording
+
+
+def select_squares_of_recording(
+        df_squares_of_recording: pd.DataFrame,
+        df_tracks_of_recording: pd.DataFrame,
+        select_parameters: dict,
+        recording_data: pd.Series,
+        recording_name: str,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> tuple:
+    """
+    Phase 2 of processing a Recording: select and label the squares and determine the Tau, R squared and Density
+    of the Recording from the tracks in the selected squares.
+    """
 
     # Assign labels in All Squares, so that selected tracks are assigned to squares.
     select_squares_with_parameters(
@@ -309,7 +964,6 @@ def process_recording(
         select_parameters=select_parameters,
         nr_of_squares_in_row=nr_of_squares_in_row,
         only_valid_tau=True)
-    df_squares_of_recording = create_unique_key_for_squares(df_squares_of_recording)
     df_squares_of_recording, df_tracks_of_recording = label_selected_squares_and_tracks(df_squares_of_recording,
                                                                                         df_tracks_of_recording)
 
@@ -321,9 +975,12 @@ def process_recording(
     # Refresh df_tracks_of_recording now to pick up Label and Square Nrs
     df_tracks_of_recording = df_tracks_of_recording[df_tracks_of_recording['Ext Recording Name'] == recording_name]
 
+    # Count the tracks per square and duration once, the Recording Tau is calculated from these counts
+    duration_histograms = get_duration_histograms_of_squares(df_tracks_of_recording, nr_of_squares_in_row)
+
     recording_tau, recording_r_squared, recording_density = calculate_tau_and_density_for_recording(
         df_squares_of_recording,
-        df_tracks_of_recording,
+        duration_histograms,
         min_tracks_for_tau,
         min_required_r_squared,
         nr_of_squares_in_row,
@@ -336,115 +993,165 @@ def process_recording(
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
-#                                    Process Square
+#                                    Compile Squares
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
 # ----------------------------------------------------------------------------------------------------
 
-def process_square(
-        df_tracks_of_experiment: pd.DataFrame,
-        df_tracks_of_recording: pd.DataFrame,
+def compile_squares_of_recording(
+        df_tracks_sorted_by_square: pd.DataFrame,
+        square_offsets: np.ndarray,
         recording_data: pd.Series,
         nr_of_squares_in_row: int,
-        concentration: float,
         min_required_r_squared: float,
-        min_tracks_for_tau: int,
-        square_area: float,
-        square_seq_nr: int,
-        row_nr: int,
-        col_nr: int) -> pd.Series:
-
-    # Determine which tracks fall within the square defined by boundaries x0, y0, x1, y1
-    x0, y0, x1, y1 = get_square_coordinates(nr_of_squares_in_row, square_seq_nr)
-    mask = ((df_tracks_of_recording['Track X Location'] >= x0) &
-            (df_tracks_of_recording['Track X Location'] < x1) &
-            (df_tracks_of_recording['Track Y Location'] >= y0) &
-            (df_tracks_of_recording['Track Y Location'] < y1))
-    df_tracks_of_square = df_tracks_of_recording[mask]
-    df_tracks_of_experiment.loc[df_tracks_of_square['Unique Key'], 'Square Nr'] = int(square_seq_nr)
-
-    # Provide reasonable values for squares not containing any tracks
-    nr_of_tracks_in_square = len(df_tracks_of_square)
-    if nr_of_tracks_in_square == 0:
-        r_squared = 0
-        tau = -1
-        density = 0
-        variability = 0
-    else:
-        # Calculate the Tau and R squared for the square
-        df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_of_square)
-        tau, r_squared = calculate_tau(
-            df_tracks_for_tau,
+        min_tracks_for_tau: int) -> pd.DataFrame:
+    """
+    This function produces the 'All Squares' records for all squares of a Recording in one go.
+    The tracks are sorted by square (see group_tracks_by_square) and the track statistics are calculated with
+    grouped reductions over the contiguous per-square slices, directly into column arrays.
+    The columns, their order, types and rounding are the same as when the squares were compiled one by one.
+    """
+
+    nr_total_squares = int(nr_of_squares_in_row * nr_of_squares_in_row)
+    square_area = calc_area_of_square(nr_of_squares_in_row)
+    concentration = float(recording_data['Concentration'])
+    square_nrs = np.arange(nr_total_squares)
+    row_nrs, col_nrs = get_row_and_column(square_nrs, nr_of_squares_in_row)
+    nr_tracks = grouped_count(square_offsets)
+    non_empty = nr_tracks > 0
+
+    def column(name):
+        return df_tracks_sorted_by_square[name].to_numpy(dtype=float)
+
+    # --------------------------------------------------------------------------------------------
+    # The per-square calculations: Tau and R squared.
+    # Squares without tracks keep the defaults.
+    # --------------------------------------------------------------------------------------------
+
+    tau_fit_mode = get_paint_attribute_with_default('Generate Squares', 'Tau Fit Mode', 'Curve Fit')
+    if tau_fit_mode not in ('Curve Fit', 'Batched Curve Fit', 'Maximum Likelihood'):
+        raise ValueError(f"Tau fit mode '{tau_fit_mode}' not recognized.")
+
+    tau = np.full(nr_total_squares, -1.0)
+    r_squared = np.zeros(nr_total_squares)
+
+    # Tau and R squared are only floats when at least one fit produced them, otherwise the columns hold error codes
+    tau_is_float = False
+    r_squared_is_float = False
+
+    if tau_fit_mode in ('Batched Curve Fit', 'Maximum Likelihood'):
+        tau, r_squared = calculate_tau_of_squares(
+            df_tracks_sorted_by_square,
+            nr_of_squares_in_row,
             min_tracks_for_tau,
-            min_required_r_squared)
+            min_required_r_squared,
+            tau_fit_mode=tau_fit_mode)
+        tau_is_float = bool((tau >= 0).any())
+        r_squared_is_float = bool((r_squared != 0).any())
 
-        # Calculate the density for the square
-        density = calculate_density(
-            nr_tracks=nr_of_tracks_in_square, area=square_area, time=100, concentration=concentration)
+    else:
+        for square_seq_nr in np.flatnonzero(non_empty):
+            df_tracks_of_square = df_tracks_sorted_by_square.iloc[
+                square_offsets[square_seq_nr]:square_offsets[square_seq_nr + 1]]
+
+            # Calculate the Tau and R squared for the square
+            df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_of_square)
+            square_tau, square_r_squared = calculate_tau(
+                df_tracks_for_tau,
+                min_tracks_for_tau,
+                min_required_r_squared)
+            tau[square_seq_nr] = square_tau
+            r_squared[square_seq_nr] = square_r_squared
+            tau_is_float |= isinstance(square_tau, float)
+            r_squared_is_float |= isinstance(square_r_squared, float)
+
+    # The track duration statistics of all squares come from one sort of the durations within the squares.
+    # The long and short track medians are 0 for squares without tracks.
+    fraction = get_paint_attribute_with_default('Generate Squares', 'Fraction of Squares to Determine Background', 0.1)
+    median_track_duration, max_track_duration, median_long_track, median_short_track = grouped_order_statistics(
+        column('Track Duration'), square_offsets, fraction)
+    median_long_track = np.where(non_empty, median_long_track, 0)
+    median_short_track = np.where(non_empty, median_short_track, 0)
+
+    # Calculate the variability for all squares
+    variability = calc_variability_of_squares(df_tracks_sorted_by_square, nr_of_squares_in_row, 10)
+
+    # Calculate the density for the squares (rounded as Python floats, as before)
+    density = [round(calculate_density(nr_tracks=int(nr), area=square_area, time=100, concentration=concentration), 5)
+               if nr > 0 else 0 for nr in nr_tracks]
+
+    # The square coordinates are the same for every recording
+    coordinates = [get_square_coordinates(nr_of_squares_in_row, square_seq_nr) for square_seq_nr in square_nrs]
+
+    # Columns that only hold integer defaults when no square has tracks
+    def float_if_any_tracks(values, decimals):
+        return np.round(values, decimals) if non_empty.any() else values.astype(int)
 
-        # Calculate the variability for the square
-        variability = calc_variability(df_tracks_of_square, square_seq_nr, nr_of_squares_in_row, 10)
+    # --------------------------------------------------------------------------------------------
+    # Assemble the squares dataframe from the column arrays
+    # --------------------------------------------------------------------------------------------
 
-    # Create the new squares record to add all the data for this square
-    square_data = {
+    squares_data = {
         'Recording Sequence Nr': recording_data['Recording Sequence Nr'],
         'Ext Recording Name': recording_data['Ext Recording Name'],
         'Experiment Name': recording_data['Experiment Name'],
         'Experiment Date': recording_data['Experiment Date'],
         'Condition Nr': recording_data['Condition Nr'],
         'Replicate Nr': recording_data['Replicate Nr'],
-        'Square Nr': int(square_seq_nr),
+        'Square Nr': square_nrs,
         'Probe': recording_data['Probe'],
         'Probe Type': recording_data['Probe Type'],
         'Cell Type': recording_data['Cell Type'],
         'Adjuvant': recording_data['Adjuvant'],
         'Concentration': recording_data['Concentration'],
         'Threshold': recording_data['Threshold'],
-        'Row Nr': int(row_nr + 1),
-        'Col Nr': int(col_nr + 1),
+        'Row Nr': row_nrs + 1,
+        'Col Nr': col_nrs + 1,
         'Label Nr': 0,
         'Cell Id': 0,
         'Nr Spots': recording_data['Nr Spots'],
-        'Nr Tracks': int(nr_of_tracks_in_square),
-        'X0': round(x0, 2),
-        'Y0': round(y0, 2),
-        'X1': round(x1, 2),
-        'Y1': round(y1, 2),
+        'Nr Tracks': nr_tracks,
+        'X0': [round(x0, 2) for x0, _, _, _ in coordinates],
+        'Y0': [round(y0, 2) for _, y0, _, _ in coordinates],
+        'X1': [round(x1, 2) for _, _, x1, _ in coordinates],
+        'Y1': [round(y1, 2) for _, _, _, y1 in coordinates],
         'Selected': True,
-        'Variability': round(variability, 2),
-        'Density': round(density, 5),
+        'Variability': float_if_any_tracks(variability, 2),
+        'Density': density,
         'Density Ratio': 0.0,
-        'Tau': round(tau, 0),
-        'R Squared': round(r_squared, 2),
+        'Tau': np.round(tau, 0) if tau_is_float else tau.astype(int),
+        'R Squared': np.round(r_squared, 2) if r_squared_is_float else r_squared.astype(int),
 
-        'Median Diffusion Coefficient': round(df_tracks_of_square['Diffusion Coefficient'].median(), 4),
-        'Mean Diffusion Coefficient': round(df_tracks_of_square['Diffusion Coefficient'].mean(), 4),
+        'Median Diffusion Coefficient': np.round(grouped_median(column('Diffusion Coefficient'), square_offsets), 4),
+        'Mean Diffusion Coefficient': np.round(grouped_mean(column('Diffusion Coefficient'), square_offsets), 4),
 
-        'Median Diffusion Coefficient Ext': round(df_tracks_of_square['Diffusion Coefficient Ext'].median(), 4),
-        'Mean Diffusion Coefficient Ext': round(df_tracks_of_square['Diffusion Coefficient Ext'].mean(), 4),
+        'Median Diffusion Coefficient Ext': np.round(
+            grouped_median(column('Diffusion Coefficient Ext'), square_offsets), 4),
+        'Mean Diffusion Coefficient Ext': np.round(
+            grouped_mean(column('Diffusion Coefficient Ext'), square_offsets), 4),
 
-        'Median Long Track Duration': round(calculate_median_long_track(df_tracks_of_square), 3),
-        'Median Short Track Duration': round(calculate_median_short_track(df_tracks_of_square), 3),
+        'Median Long Track Duration': float_if_any_tracks(median_long_track, 3),
+        'Median Short Track Duration': float_if_any_tracks(median_short_track, 3),
 
-        'Median Displacement': round(df_tracks_of_square['Track Displacement'].median(), 3),
-        'Max Displacement': round(df_tracks_of_square['Track Displacement'].max(), 3),
-        'Total Displacement': round(df_tracks_of_square['Track Displacement'].sum(), 3),
+        'Median Displacement': np.round(grouped_median(column('Track Displacement'), square_offsets), 3),
+        'Max Displacement': np.round(grouped_max(column('Track Displacement'), square_offsets), 3),
+        'Total Displacement': np.round(grouped_sum(column('Track Displacement'), square_offsets), 3),
 
-        'Median Max Speed': round(df_tracks_of_square['Track Max Speed'].median(), 3),
-        'Max Max Speed':  round(df_tracks_of_square['Track Max Speed'].max(), 3),
+        'Median Max Speed': np.round(grouped_median(column('Track Max Speed'), square_offsets), 3),
+        'Max Max Speed': np.round(grouped_max(column('Track Max Speed'), square_offsets), 3),
 
-        'Median Mean Speed': round(df_tracks_of_square['Track Mean Speed'].median(), 3),
-        'Max Mean Speed': round(df_tracks_of_square['Track Mean Speed'].max(), 3),
+        'Median Mean Speed': np.round(grouped_median(column('Track Mean Speed'), square_offsets), 3),
+        'Max Mean Speed': np.round(grouped_max(column('Track Mean Speed'), square_offsets), 3),
 
-        'Max Track Duration': round(df_tracks_of_square['Track Duration'].max(), 3),
-        'Total Track Duration': round(df_tracks_of_square['Track Duration'].sum(), 3),
-        'Median Track Duration': round(df_tracks_of_square['Track Duration'].median(), 3),
+        'Max Track Duration': np.round(max_track_duration, 3),
+        'Total Track Duration': np.round(grouped_sum(column('Track Duration'), square_offsets), 3),
+        'Median Track Duration': np.round(median_track_duration, 3),
 
         'Square Manually Excluded': False,
         'Image Excluded': False
     }
 
-    return square_data
+    return pd.DataFrame(squares_data, index=pd.RangeIndex(nr_total_squares))
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -453,7 +1160,7 @@ def process_square(
 
 def calculate_tau_and_density_for_recording(
         df_squares: pd.DataFrame,
-        df_recording_tracks: pd.DataFrame,
+        duration_histograms: tuple,
         min_tracks_for_tau: int,
         min_required_r_squared: float,
         nr_of_squares_in_row: int,
@@ -465,6 +1172,7 @@ def calculate_tau_and_density_for_recording(
     in the image that meet the selection criteria.
     Note that also squares are included for which no square Tau could be calculated (provided they meet the selection
     criteria). The Tau and Density are calculated for the entire image, not for individual squares.
+    The tracks are not needed, only their counts per square and duration (see get_duration_histograms_of_squares).
     """
 
     # Within that recording use all the selected squares. Note: no need to filter out squares with Ta < 0
@@ -473,19 +1181,15 @@ def calculate_tau_and_density_for_recording(
         select_parameters=select_parameters,
         nr_of_squares_in_row=nr_of_squares_in_row,
         only_valid_tau=False)
-    df_squares_for_single_tau = df_squares[df_squares['Selected']]
-
-    # Select only the tracks that fall within these squares.
-    # The following code filters df_tracks to include rows where Square Nr values match those
-    # in df_squares_for_single_tau
+    selected_square_nrs = df_squares.loc[df_squares['Selected'], 'Square Nr'].to_numpy(dtype=int)
 
-    df_tracks_for_tau = df_recording_tracks[
-        df_recording_tracks['Square Nr'].isin(df_squares_for_single_tau['Square Nr'])]
-    nr_of_tracks_for_single_tau = len(df_tracks_for_tau)
+    # The tracks that fall within these squares
+    _, _, nr_tracks_in_squares = duration_histograms
+    nr_of_tracks_for_single_tau = int(nr_tracks_in_squares[selected_square_nrs].sum())
 
-    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_for_tau)
-    tau, r_squared = calculate_tau(
-        df_tracks_for_tau,
+    tau, r_squared = calculate_tau_from_duration_histograms(
+        duration_histograms,
+        selected_square_nrs,
         min_tracks_for_tau,
         min_required_r_squared)
 
@@ -19,7 +19,8 @@ from src.Fiji.LoggerConfig import (
     paint_logger_file_name_assigned)
 from src.Fiji.NewPaintConfig import (
     get_paint_attribute_with_default,
-    update_paint_attribute)
+    update_paint_attribute,
+    paint_config_batch_updates)
 
 if not paint_logger_file_name_assigned:
     paint_logger_change_file_handler_name('Generate Squares.log')
@@ -202,16 +203,18 @@ class GenerateSquaresDialog:
         self.on_exit_pressed()
 
     def save_parameters(self):
-        update_paint_attribute('Generate Squares', 'Nr of Squares in Row', self.nr_of_squares_in_row.get())
-        update_paint_attribute('Generate Squares', 'Min Tracks to Calculate Tau', self.min_tracks_for_tau.get())
-        update_paint_attribute('Generate Squares', 'Min Required R Squared', self.min_required_r_squared.get())
-        update_paint_attribute('Generate Squares', 'Min Required Density Ratio', self.min_required_density_ratio.get())
-        update_paint_attribute('Generate Squares', 'Max Allowable Variability', self.max_allowable_variability.get())
-
-        update_paint_attribute('User Directories', 'Project Directory', self.project_directory)
-        update_paint_attribute('User Directories', 'Experiment Directory', self.experiment_directory)
-        update_paint_attribute('User Directories', 'Images Directory', self.images_directory)
-        update_paint_attribute('User Directories', 'Level', self.level)
+        # Write all parameters to Paint.json in one go
+        with paint_config_batch_updates():
+            update_paint_attribute('Generate Squares', 'Nr of Squares in Row', self.nr_of_squares_in_row.get())
+            update_paint_attribute('Generate Squares', 'Min Tracks to Calculate Tau', self.min_tracks_for_tau.get())
+            update_paint_attribute('Generate Squares', 'Min Required R Squared', self.min_required_r_squared.get())
+            update_paint_attribute('Generate Squares', 'Min Required Density Ratio', self.min_required_density_ratio.get())
+            update_paint_attribute('Generate Squares', 'Max Allowable Variability', self.max_allowable_variability.get())
+
+            update_paint_attribute('User Directories', 'Project Directory', self.project_directory)
+            update_paint_attribute('User Directories', 'Experiment Directory', self.experiment_directory)
+            update_paint_attribute('User Directories', 'Images Directory', self.images_directory)
+            update_paint_attribute('User Directories', 'Level', self.level)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# The Generate Squares manifest records, per Experiment, the fingerprints of the input files as they were read,
+# the fingerprints of the output files as they were written and the parameters used.
+# An Experiment only needs to be generated again when one of these differs.
+#
+# A fingerprint is the size, the modification time and the SHA-256 hash of a file. A file matches a fingerprint
+# when the size is the same and either the modification time or the hash is the same, so the hash is only
+# calculated for files that were touched.
+# ----------------------------------------------------------------------------------------------------
+
+MANIFEST_FILE_NAME = 'Generate Squares Manifest.json'
+INPUT_FILES = ['All Recordings.csv', 'All Tracks.csv']
+OUTPUT_FILES = ['All Recordings.csv', 'All Tracks.csv', 'All Squares.csv']
+
+# The Paint.json attributes that change the output of Generate Squares
+GENERATE_SQUARES_ATTRIBUTES = {
+    'Tau Fit Mode': 'Curve Fit',
+    'Exclude zero DC tracks from Tau Calculation': False,
+    'Fraction of Squares to Determine Background': 0.1,
+    'Cluster Connectivity': 8,
+    'Min Cluster Size': 3,
+}
+
+# The TrackMate attributes of Paint.json that change the output of Generate Squares: the Maximum Likelihood Tau
+# starts at the duration of the shortest track TrackMate keeps
+TRACKMATE_ATTRIBUTES = {
+    'MIN_NR_SPOTS_IN_TRACK': 3,
+}
+
+
+def get_file_hash(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_file_fingerprint(file_path: str) -> dict:
+    file_stat = os.stat(file_path)
+    return {
+        'Size': file_stat.st_size,
+        'Modification Time': file_stat.st_mtime_ns,
+        'SHA-256': get_file_hash(file_path)}
+
+
+def file_matches_fingerprint(file_path: str, fingerprint: dict) -> bool:
+    if fingerprint is None or not os.path.exists(file_path):
+        return False
+    file_stat = os.stat(file_path)
+    if file_stat.st_size != fingerprint['Size']:
+        return False
+    if file_stat.st_mtime_ns == fingerprint['Modification Time']:
+        return True
+    return get_file_hash(file_path) == fingerprint['SHA-256']
+
+
+def get_generate_squares_parameters(
+        select_parameters: dict,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> dict:
+    """
+    The complete set of parameters that determines the output of Generate Squares, in the form stored in the manifest.
+    """
+
+    parameters = {
+        'Select Parameters': select_parameters,
+        'Nr of Squares in Row': nr_of_squares_in_row,
+        'Min Required R Squared': min_required_r_squared,
+        'Min Tracks to Calculate Tau': min_tracks_for_tau,
+        'Paint Configuration': {
+            attribute: get_paint_attribute_with_default('Generate Squares', attribute, default)
+            for attribute, default in GENERATE_SQUARES_ATTRIBUTES.items()},
+        'TrackMate Configuration': {
+            attribute: get_paint_attribute_with_default('TrackMate', attribute, default)
+            for attribute, default in TRACKMATE_ATTRIBUTES.items()}}
+
+    # Round trip through JSON, so that the parameters compare equal to the ones read back from a manifest
+    return json.loads(json.dumps(parameters))
+
+
+def get_input_fingerprints(experiment_path: str) -> dict:
+    return {file_name: get_file_fingerprint(os.path.join(experiment_path, file_name))
+            for file_name in INPUT_FILES if os.path.exists(os.path.join(experiment_path, file_name))}
+
+
+def read_manifest(experiment_path: str) -> dict:
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        paint_logger.warning(f"The manifest {manifest_path} could not be read and is ignored")
+        return None
+
+
+def write_manifest(experiment_path: str, input_fingerprints: dict, parameters: dict) -> None:
+    """
+    Write the manifest after the output files have been written. The file is replaced atomically.
+    """
+
+    manifest = {
+        'Parameters': parameters,
+        'Inputs': input_fingerprints,
+        'Outputs': {file_name: get_file_fingerprint(os.path.join(experiment_path, file_name))
+                    for file_name in OUTPUT_FILES}}
+
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(temp_path, manifest_path)
+
+
+def remove_manifest(experiment_path: str) -> None:
+    manifest_path = os.path.join(experiment_path, MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def refresh_manifest_outputs(experiment_path: str) -> None:
+    """
+    Record the current output files as up to date, for instance after the user saved changes in the Recording Viewer.
+    Nothing happens when the Experiment has no manifest.
+    """
+
+    manifest = read_manifest(experiment_path)
+    if manifest is not None and all(os.path.exists(os.path.join(experiment_path, f)) for f in OUTPUT_FILES):
+        write_manifest(experiment_path, manifest['Inputs'], manifest['Parameters'])
+
+
+def experiment_is_up_to_date(experiment_path: str, parameters: dict) -> bool:
+    """
+    An Experiment is up to date when the parameters are the ones in the manifest and the output files are still the
+    ones that were written.
+    """
+
+    manifest = read_manifest(experiment_path)
+    if manifest is None or manifest['Parameters'] != parameters:
+        return False
+    return all(file_matches_fingerprint(os.path.join(experiment_path, file_name), manifest['Outputs'].get(file_name))
+               for file_name in OUTPUT_FILES)
+
+
+def source_files_are_already_processed(source_experiment_path: str, experiment_path: str, parameters: dict) -> bool:
+    """
+    The input files in a source directory need not be copied into an Experiment when the Experiment is up to date
+    for these parameters and was generated from files with the same content.
+    """
+
+    if not experiment_is_up_to_date(experiment_path, parameters):
+        return False
+    manifest = read_manifest(experiment_path)
+    return all(file_matches_fingerprint(os.path.join(source_experiment_path, file_name),
+                                        manifest['Inputs'].get(file_name))
+               for file_name in INPUT_FILES)
@@ -1,13 +1,21 @@
 import os
 import sys
+from multiprocessing.shared_memory import SharedMemory
 
 import numpy as np
 import pandas as pd
 
 from src.Application.Generate_Squares.Curvefit_and_Plot import (
     compile_duration,
-    curve_fit_and_plot
+    compile_duration_from_histogram,
+    curve_fit_and_plot,
+    curve_fit_batched,
+    get_duration_in_frames,
+    get_duration_in_seconds,
+    get_frame_bins,
+    maximum_likelihood_fit
 )
+from src.Application.Support.Table_Schema import read_paint_table, read_paint_table_in_chunks
 from src.Fiji.LoggerConfig import paint_logger
 from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
 
@@ -59,68 +67,287 @@ def get_square_coordinates(nr_of_squares_in_row, sequence_number):
     return x0, y0, x1, y1
 
 
-def calc_variability(df_tracks, square_nr, nr_of_squares_in_row, granularity):
+def get_square_boundaries(nr_of_squares_in_row: int) -> np.ndarray:
     """
-    The variability is calculated by creating a grid of granularity x granularity in the square for
-    which tracks_fd specifies the tracks
-    :param df_tracks: A dataframe that contains the tracks of the square for which the variability is calculated
-    :param square_nr: The sequence number of the square for which the variability is calculated
+    The boundaries x0 (and x1) of the squares in a row, identical for the columns.
+    """
+    width = 82.0864 / nr_of_squares_in_row
+    return np.arange(nr_of_squares_in_row + 1) * width
+
+
+def grids_nest(fine_nr_of_squares_in_row: int, coarse_nr_of_squares_in_row: int) -> bool:
+    """
+    A coarse grid nests in a fine grid when every coarse boundary is exactly (not just approximately) a fine
+    boundary. The squares of the coarse grid then consist of whole squares of the fine grid.
+    """
+    if fine_nr_of_squares_in_row % coarse_nr_of_squares_in_row != 0:
+        return False
+    ratio = fine_nr_of_squares_in_row // coarse_nr_of_squares_in_row
+    return np.array_equal(get_square_boundaries(coarse_nr_of_squares_in_row),
+                          get_square_boundaries(fine_nr_of_squares_in_row)[::ratio])
+
+
+def get_row_and_col_nr_of_tracks(df_tracks: pd.DataFrame, nr_of_squares_in_row: int) -> tuple:
+    """
+    Determine in one pass for every track the row and column of the square it falls in.
+    The square boundaries are exactly the ones from get_square_coordinates, so a track on the boundary between
+    two squares belongs to the square to the right or below, as it did with the per-square masks.
+
+    :return: Two arrays with the row and column number of each track; -1 or nr_of_squares_in_row outside the grid
+    """
+
+    boundaries = get_square_boundaries(nr_of_squares_in_row)
+
+    # Find the column and row for each track: boundaries[i] <= x < boundaries[i + 1]
+    col_nrs = np.searchsorted(boundaries, df_tracks['Track X Location'].to_numpy(dtype=float), side='right') - 1
+    row_nrs = np.searchsorted(boundaries, df_tracks['Track Y Location'].to_numpy(dtype=float), side='right') - 1
+    return row_nrs, col_nrs
+
+
+def get_square_nr_from_row_and_col(row_nrs: np.ndarray, col_nrs: np.ndarray, nr_of_squares_in_row: int) -> np.ndarray:
+    inside = ((col_nrs >= 0) & (col_nrs < nr_of_squares_in_row) &
+              (row_nrs >= 0) & (row_nrs < nr_of_squares_in_row))
+    return np.where(inside, row_nrs * nr_of_squares_in_row + col_nrs, -1)
+
+
+def get_square_nr_of_tracks(df_tracks: pd.DataFrame, nr_of_squares_in_row: int) -> np.ndarray:
+    """
+    Determine in one pass for every track the sequence number of the square it falls in.
+
+    :param df_tracks: A dataframe that contains the tracks of a recording
+    :param nr_of_squares_in_row: The number of rows and columns in the image
+    :return: An array with the square sequence number of each track, -1 for tracks outside the grid
+    """
+
+    row_nrs, col_nrs = get_row_and_col_nr_of_tracks(df_tracks, nr_of_squares_in_row)
+    return get_square_nr_from_row_and_col(row_nrs, col_nrs, nr_of_squares_in_row)
+
+
+def group_tracks_by_square(df_tracks: pd.DataFrame, nr_of_squares_in_row: int, square_nrs: np.ndarray = None) -> tuple:
+    """
+    Bin the tracks of a recording into squares and sort them by square, so that the tracks of every square
+    form a contiguous slice. The original order of the tracks is kept within a square.
+    The 'Square Nr' column of df_tracks is filled in the same pass (empty for tracks outside the grid).
+
+    :param df_tracks: A dataframe that contains the tracks of a recording
+    :param nr_of_squares_in_row: The number of rows and columns in the image
+    :param square_nrs: The square numbers of the tracks, when already known (see get_square_nr_of_tracks)
+    :return: The tracks sorted by square and an array of offsets: the tracks of square n are in
+             rows offsets[n] to offsets[n + 1] of the sorted tracks
+    """
+
+    if square_nrs is None:
+        square_nrs = get_square_nr_of_tracks(df_tracks, nr_of_squares_in_row)
+    square_nr_column = pd.array(square_nrs, dtype='Int64')
+    square_nr_column[square_nrs < 0] = pd.NA
+    df_tracks['Square Nr'] = square_nr_column
+
+    order = np.argsort(square_nrs, kind='stable')
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    offsets = np.searchsorted(square_nrs[order], np.arange(nr_total_squares + 1), side='left')
+    return df_tracks.iloc[order], offsets
+
+
+# ----------------------------------------------------------------------------------------------------
+# Grouped reductions over tracks that are sorted by square (see group_tracks_by_square).
+# The tracks of square n are in rows offsets[n] to offsets[n + 1]. Empty squares give NaN (0 for the sum),
+# just like the pandas reductions on an empty selection of tracks.
+# ----------------------------------------------------------------------------------------------------
+
+def grouped_count(offsets: np.ndarray) -> np.ndarray:
+    return np.diff(offsets)
+
+
+def grouped_max(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    result = np.full(len(offsets) - 1, np.nan)
+    non_empty = np.flatnonzero(np.diff(offsets) > 0)
+    if len(non_empty) > 0:
+        result[non_empty] = np.fmax.reduceat(values[:offsets[-1]], offsets[non_empty])
+    return result
+
+
+def grouped_sum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    The sum is deliberately taken per square with numpy's own summation, rather than with np.add.reduceat, which
+    adds strictly sequentially. That keeps totals and means bit-identical to the per-square Series reductions, so
+    values that sit exactly on a rounding boundary are rounded the same way.
+    """
+    values = np.where(np.isnan(values), 0.0, values)
+    result = np.zeros(len(offsets) - 1)
+    for square_nr in np.flatnonzero(np.diff(offsets) > 0):
+        result[square_nr] = values[offsets[square_nr]:offsets[square_nr + 1]].sum()
+    return result
+
+
+def grouped_count_of_values(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    cumulative_count = np.concatenate([[0], np.cumsum(~np.isnan(values))])
+    return cumulative_count[offsets[1:]] - cumulative_count[offsets[:-1]]
+
+
+def grouped_mean(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    counts = grouped_count_of_values(values, offsets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = grouped_sum(values, offsets) / counts
+    return np.where(counts > 0, result, np.nan)
+
+
+def grouped_sort(values: np.ndarray, offsets: np.ndarray) -> tuple:
+    """
+    Sort the values within each square in one pass. NaN values go last within their square.
+    Returns the sorted values and the number of values that are not NaN in each square.
+    """
+    nr_squares = len(offsets) - 1
+
+    # Tracks before offsets[0] or after offsets[-1] are outside the grid and keep their place
+    square_nrs = np.full(len(values), -1)
+    square_nrs[offsets[0]:offsets[-1]] = np.repeat(np.arange(nr_squares), np.diff(offsets))
+    square_nrs[offsets[-1]:] = nr_squares
+    sorted_values = values[np.lexsort((values, square_nrs))]
+    return sorted_values, grouped_count_of_values(values, offsets)
+
+
+def grouped_median_of_sorted(sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    The median of the counts[n] sorted values from starts[n] on, averaging the middle elements. NaN for no values.
+    """
+    result = np.full(len(starts), np.nan)
+    non_empty = np.flatnonzero(counts > 0)
+    lower = sorted_values[starts[non_empty] + (counts[non_empty] - 1) // 2]
+    upper = sorted_values[starts[non_empty] + counts[non_empty] // 2]
+    result[non_empty] = (lower + upper) / 2
+    return result
+
+
+def grouped_median(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Sort the values within each square (NaN values go last and are ignored) and average the middle elements.
+    """
+    nr_squares = len(offsets) - 1
+    if len(values) == 0:
+        return np.full(nr_squares, np.nan)
+
+    sorted_values, counts = grouped_sort(values, offsets)
+    return grouped_median_of_sorted(sorted_values, offsets[:-1], counts)
+
+
+def grouped_order_statistics(values: np.ndarray, offsets: np.ndarray, fraction: float) -> tuple:
+    """
+    The median, the maximum, and the medians of the longest and of the shortest fraction of the values of every
+    square, from a single grouped sort. The longest and shortest fractions hold at least one value and are taken
+    as in calculate_median_long_track and calculate_median_short_track, including any NaN values, which are then
+    ignored. Empty squares give NaN.
+    """
+    nr_squares = len(offsets) - 1
+    if len(values) == 0:
+        return tuple(np.full(nr_squares, np.nan) for _ in range(4))
+
+    sorted_values, counts = grouped_sort(values, offsets)
+    starts = offsets[:-1]
+    nr_values = np.diff(offsets)
+    nr_values_in_fraction = np.maximum(np.round(fraction * nr_values).astype(int), 1)
+
+    median = grouped_median_of_sorted(sorted_values, starts, counts)
+    maximum = np.full(nr_squares, np.nan)
+    maximum[counts > 0] = sorted_values[(starts + counts - 1)[counts > 0]]
+
+    # The longest values are the last in the square, the NaN values come after them
+    first_long = np.minimum(nr_values - nr_values_in_fraction, counts)
+    median_long = grouped_median_of_sorted(sorted_values, starts + first_long, counts - first_long)
+
+    median_short = grouped_median_of_sorted(sorted_values, starts, np.minimum(nr_values_in_fraction, counts))
+
+    return median, maximum, median_long, median_short
+
+
+def calc_variability_of_squares(df_tracks: pd.DataFrame, nr_of_squares_in_row: int, granularity: int) -> np.ndarray:
+    """
+    The variability is calculated by creating a grid of granularity x granularity in each square and counting the
+    tracks in each grid cell. The variability of a square is the standard deviation of the counts divided by the
+    average. This is done for all squares of a recording at once: the grid cell of every track is determined with
+    integer arithmetic and all the counts are made with a single bincount.
+
+    :param df_tracks: A dataframe that contains the tracks of a recording, with 'Square Nr' filled in
     :param nr_of_squares_in_row: The number of rows and columns in the image
     :param granularity: Specifies how fine the grid is that is created
-    :return:
+    :return: The variability of every square, 0 for squares without tracks
     """
 
-    # Create the matrix for the variability analysis
-    matrix = np.zeros((granularity, granularity), dtype=int)
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    square_nrs = df_tracks['Square Nr'].to_numpy(dtype=float, na_value=np.nan)
+    in_square = ~np.isnan(square_nrs)
+    square_nrs = square_nrs[in_square].astype(int)
+    x = df_tracks['Track X Location'].to_numpy(dtype=float)[in_square]
+    y = df_tracks['Track Y Location'].to_numpy(dtype=float)[in_square]
 
-    # Loop over all the tracks in the square and determine where they sit in the grid
-    for index, row in df_tracks.iterrows():
-        # Retrieve the x and y values expressed in micrometers
-        x = float(row["Track X Location"])
-        y = float(row["Track Y Location"])
+    # The width of the image is 82.0864 micrometer. The width and height of a square can be calculated
+    width = 82.0864 / nr_of_squares_in_row
+    height = width
 
-        # The width of the image is 82.0864 micrometer. The width and height of a square can be calculated
-        width = 82.0864 / nr_of_squares_in_row
-        height = width
+    # Calculate the top-left corner (x0, y0) of the square of each track and the grid indices (xi, yi) in the square
+    x0 = (square_nrs % nr_of_squares_in_row) * width
+    y0 = (square_nrs // nr_of_squares_in_row) * height
+    xi = np.minimum((((x - x0) / width) * granularity).astype(int), granularity - 1)
+    yi = np.minimum((((y - y0) / height) * granularity).astype(int), granularity - 1)
 
-        # Get the grid indices for this track and update the matrix
-        xi, yi = get_indices(x, y, width, height, square_nr, nr_of_squares_in_row, 10)
-        matrix[yi, xi] += 1
+    # Count the tracks in every grid cell of every square
+    cell_nrs = (square_nrs * granularity + yi) * granularity + xi
+    matrix = np.bincount(cell_nrs, minlength=nr_total_squares * granularity * granularity)
+    matrix = matrix.reshape(nr_total_squares, granularity * granularity)
 
     # Calculate the variability by dividing the standard deviation by the average
-    std = np.std(matrix)
-    mean = np.mean(matrix)
-    if mean != 0:
-        variability = std / mean
-    else:
-        variability = 0
+    std = np.std(matrix, axis=1)
+    mean = np.mean(matrix, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variability = np.where(mean != 0, std / mean, 0)
     return variability
 
 
-def get_indices(x1: float, y1: float, width: float, height: float, square_seq_nr: int, nr_of_squares_in_row: int,
-                granularity: int) -> tuple[int, int]:
+# ----------------------------------------------------------------------------------------------------
+# Shared track columns. To process the recordings of an experiment in parallel, the numeric track columns are
+# placed in shared memory once, with the tracks of every recording contiguous. A worker then only needs the name of
+# the shared memory block, its layout and the range of rows of its recording.
+# ----------------------------------------------------------------------------------------------------
+
+def share_track_columns(df_tracks: pd.DataFrame, order: np.ndarray) -> tuple:
     """
-    Given coordinates (x1, y1) of the track, calculate the indices of the grid
+    Copy the numeric columns of df_tracks, in the given row order, into a new shared memory block.
+    Every column is stored contiguously with its own dtype.
 
-    :param x1: The x coordinate of the track
-    :param y1: The y coordinate of the track
-    :param width: The width of a grid in the square
-    :param height: The height of a grid in the square
-    :param square_seq_nr: The number of the square for which the variability is calculated
-    :param nr_of_squares_in_row: The numbers of rows and columns in the full image
-    :param granularity: Specifies how fine the grid is that is overlaid on the square
-    :return: The indices (xi, yi) of the grid
+    :param df_tracks: The tracks of an experiment
+    :param order: The row positions of the tracks in the order in which they are to be stored
+    :return: The shared memory block (to be closed and unlinked by the caller) and its layout, a list of
+             (column name, dtype, byte offset) tuples
     """
 
-    # Calculate the top-left corner (x0, y0) of the square
-    x0 = (square_seq_nr % nr_of_squares_in_row) * width
-    y0 = (square_seq_nr // nr_of_squares_in_row) * height
+    columns = df_tracks.select_dtypes(include='number').columns
+    layout = []
+    nr_bytes = 0
+    for column in columns:
+        dtype = df_tracks[column].dtype
+        layout.append((column, dtype.str, nr_bytes))
+        nr_bytes += dtype.itemsize * len(order)
 
-    # Calculate the grid indices (xi, yi) for the track
-    xi = int(((x1 - x0) / width) * granularity)
-    yi = int(((y1 - y0) / height) * granularity)
+    shared_block = SharedMemory(create=True, size=max(nr_bytes, 1))
+    for column, dtype, offset in layout:
+        shared_column = np.ndarray(len(order), dtype=dtype, buffer=shared_block.buf, offset=offset)
+        shared_column[:] = df_tracks[column].to_numpy()[order]
+        del shared_column  # A block can only be closed when no arrays refer to it anymore
+    return shared_block, layout
 
-    return xi, yi
+
+def read_shared_track_columns(shared_block_name: str, layout: list, nr_tracks: int, start: int,
+                              stop: int) -> pd.DataFrame:
+    """
+    Read rows start to stop of the shared track columns (see share_track_columns) into a dataframe.
+    """
+
+    shared_block = SharedMemory(name=shared_block_name)
+    try:
+        return pd.DataFrame({
+            column: np.ndarray(nr_tracks, dtype=dtype, buffer=shared_block.buf, offset=offset)[start:stop].copy()
+            for column, dtype, offset in layout})
+    finally:
+        shared_block.close()
 
 
 def check_experiment_integrity(df_experiment):
@@ -216,13 +443,42 @@ def extra_constraints_on_tracks_for_tau_calculation(df_tracks_in_square):
 
 
 def create_unique_key_for_tracks(df):
-    df['Unique Key'] = df['Ext Recording Name'] + ' - ' + df['Track Label'].str.split('_').str[1]
-    df.set_index('Unique Key', inplace=True, drop=False)
+    """
+    Returns the tracks with the text 'Unique Key' as the first column, for writing them to a CSV file. Inside the
+    pipeline, tracks are identified by their composite key (see index_tracks_by_composite_key).
+    """
 
-    # Reorder the columns
-    cols = list(df.columns)
-    cols.insert(0, cols.pop(cols.index('Unique Key')))
-    df = df[cols]
+    if df.empty:
+        return df
+    unique_keys = df['Ext Recording Name'].astype(object) + ' - ' + df['Track Label'].str.split('_').str[1]
+    df = df.drop(columns=['Unique Key'], errors='ignore')
+    df.insert(0, 'Unique Key', unique_keys)
+    return df
+
+
+def get_composite_keys(recording_codes, numbers) -> np.ndarray:
+    """
+    The 64-bit keys of tracks or squares: the code of the Recording in the upper 32 bits and the Track Id or
+    Square Nr in the lower 32 bits.
+    """
+
+    return (np.asarray(recording_codes, dtype=np.int64) << 32) | np.asarray(numbers, dtype=np.int64)
+
+
+def index_tracks_by_composite_key(df, recording_code: int = None):
+    """
+    Index the tracks by their composite key, in place, and drop the text 'Unique Key' column, which is only made
+    again when the tracks are written. The Recordings are numbered in order of appearance, unless all tracks belong
+    to the Recording with recording_code.
+    """
+
+    if recording_code is None:
+        recording_codes, _ = pd.factorize(df['Ext Recording Name'])
+    else:
+        recording_codes = np.full(len(df), recording_code)
+    df.index = pd.Index(get_composite_keys(recording_codes, df['Track Id'].to_numpy()), name='Composite Key')
+    if 'Unique Key' in df.columns:
+        df.drop(columns=['Unique Key'], inplace=True)
     return df
 
 
@@ -288,7 +544,7 @@ def calculate_tau(
     """
     Calculate the Tau for the square if requested. Use error codes:
        -1: too few points to try to fit
-       -2: curve fitting tries, but failed
+       -2: curve fitting tries, but failed (the R squared is then 0, so this becomes -3 when an R squared is required)
        -3: curve fitting succeeded, but R2 is too low
     """
 
@@ -307,7 +563,142 @@ def calculate_tau(
     return tau, r_squared
 
 
-def calculate_median_long_track(df_tracks):
+def get_min_track_duration_in_frames() -> int:
+    """
+    The duration of the shortest track TrackMate keeps: a track of MIN_NR_SPOTS_IN_TRACK spots spans one frame less.
+    """
+
+    return max(get_paint_attribute_with_default('TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 3) - 1, 0)
+
+
+def calculate_tau_of_squares(
+        df_tracks: pd.DataFrame,
+        nr_of_squares_in_row: int,
+        min_tracks_for_tau: int,
+        min_required_r_squared: float,
+        max_histograms_per_batch: int = 500,
+        tau_fit_mode: str = 'Batched Curve Fit'
+) -> tuple:
+    """
+    Calculate the Tau for all squares of a recording with batched curve fitting instead of one fit per square.
+    The duration histograms of the squares are stacked and fitted together (see curve_fit_batched), or, with
+    tau_fit_mode 'Maximum Likelihood', the Tau is estimated from the durations (see maximum_likelihood_fit).
+    The same error codes as in calculate_tau are used:
+       -1: too few points to try to fit
+       -2: curve fitting tries, but failed (the R squared is then 0, so this becomes -3 when an R squared is required)
+       -3: curve fitting succeeded, but R2 is too low
+
+    :param df_tracks: A dataframe that contains the tracks of a recording, with 'Square Nr' filled in
+    :return: Two arrays with the Tau and R squared of every square
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    tau = np.full(nr_total_squares, -1.0)
+    r_squared = np.zeros(nr_total_squares)
+
+    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks)
+    square_nrs = df_tracks_for_tau['Square Nr'].to_numpy(dtype=float, na_value=np.nan)
+    in_square = ~np.isnan(square_nrs)
+    square_nrs = square_nrs[in_square].astype(int)
+    frames = get_duration_in_frames(df_tracks_for_tau['Track Duration'].to_numpy(dtype=float)[in_square])
+
+    # Only squares with enough tracks are fitted
+    nr_tracks_for_tau = np.bincount(square_nrs, minlength=nr_total_squares)
+    squares_to_fit = np.flatnonzero(nr_tracks_for_tau >= min_tracks_for_tau)
+    if len(squares_to_fit) == 0:
+        return tau, r_squared
+
+    # The histograms of all squares share the same duration bins
+    bins, bin_nrs = get_frame_bins(frames)
+    histogram_nrs = np.full(nr_total_squares, -1)
+    histogram_nrs[squares_to_fit] = np.arange(len(squares_to_fit))
+    track_histogram_nrs = histogram_nrs[square_nrs]
+    in_fit = track_histogram_nrs >= 0
+    frequencies = np.bincount(track_histogram_nrs[in_fit] * len(bins) + bin_nrs[in_fit],
+                              minlength=len(squares_to_fit) * len(bins)).reshape(len(squares_to_fit), len(bins))
+
+    # Fit in batches to limit the memory needed for the Jacobians
+    min_frames = get_min_track_duration_in_frames()
+    for start in range(0, len(squares_to_fit), max_histograms_per_batch):
+        batch = squares_to_fit[start:start + max_histograms_per_batch]
+        batch_frequencies = frequencies[start:start + max_histograms_per_batch]
+        if tau_fit_mode == 'Maximum Likelihood':
+            batch_tau, batch_r_squared = maximum_likelihood_fit(bins, batch_frequencies, min_frames)
+        else:
+            batch_tau, batch_r_squared = curve_fit_batched(get_duration_in_seconds(bins), batch_frequencies)
+
+        # Tau was calculated, but not reliable; failed fits have an R squared of 0 and are treated the same way
+        batch_tau[batch_r_squared < min_required_r_squared] = -3
+        tau[batch] = batch_tau
+        r_squared[batch] = batch_r_squared
+
+    return tau, r_squared
+
+
+def get_duration_histograms_of_squares(df_tracks: pd.DataFrame, nr_of_squares_in_row: int) -> tuple:
+    """
+    Count the tracks of a recording per square, in total and by track duration. Only the tracks that are used for a
+    Tau (see extra_constraints_on_tracks_for_tau_calculation) are counted by duration.
+    The Tau and Density of any selection of squares then follow from these counts, without going back to the tracks.
+
+    :param df_tracks: A dataframe that contains the tracks of a recording, with 'Square Nr' filled in
+    :return: The durations that occur (in frames), a (squares x durations) array with the number of tracks of each
+    duration in each square, and the number of tracks in each square
+    """
+
+    nr_total_squares = nr_of_squares_in_row * nr_of_squares_in_row
+
+    square_nrs = df_tracks['Square Nr'].to_numpy(dtype=float, na_value=np.nan)
+    in_square = ~np.isnan(square_nrs)
+    nr_tracks_in_squares = np.bincount(square_nrs[in_square].astype(int), minlength=nr_total_squares)
+
+    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks[in_square])
+    square_nrs = df_tracks_for_tau['Square Nr'].to_numpy(dtype=float).astype(int)
+    frames, frame_bin_nrs = get_frame_bins(get_duration_in_frames(df_tracks_for_tau['Track Duration']))
+    duration_histograms = np.bincount(square_nrs * len(frames) + frame_bin_nrs,
+                                      minlength=nr_total_squares * len(frames))
+    duration_histograms = duration_histograms.reshape(nr_total_squares, len(frames))
+
+    return frames, duration_histograms, nr_tracks_in_squares
+
+
+def calculate_tau_from_duration_histograms(
+        duration_histograms: tuple,
+        square_nrs: np.ndarray,
+        min_tracks_for_tau: int,
+        min_required_r_squared: float
+) -> tuple:
+    """
+    Calculate the Tau of the tracks in the squares square_nrs, from the counts made by
+    get_duration_histograms_of_squares. The result and the error codes are the same as those of calculate_tau on
+    the tracks of these squares. With the 'Maximum Likelihood' Tau Fit Mode, the Tau is estimated from the
+    durations instead of fitted (see maximum_likelihood_fit).
+    """
+
+    frames, histograms, _ = duration_histograms
+    histogram = histograms[square_nrs].sum(axis=0)
+    tau_fit_mode = get_paint_attribute_with_default('Generate Squares', 'Tau Fit Mode', 'Curve Fit')
+
+    if histogram.sum() < min_tracks_for_tau:  # Too few points to curve fit
+        tau = -1
+        r_squared = 0
+    else:
+        if tau_fit_mode == 'Maximum Likelihood':
+            tau, r_squared = maximum_likelihood_fit(frames, histogram[np.newaxis], get_min_track_duration_in_frames())
+            tau, r_squared = (-2, 0) if tau[0] == -2 else (float(tau[0]), float(r_squared[0]))
+        else:
+            duration_data = compile_duration_from_histogram(frames, histogram)
+            tau, r_squared = curve_fit_and_plot(plot_data=duration_data)
+        if tau == -2:  # Tau calculation failed
+            r_squared = 0
+        if r_squared < min_required_r_squared:  # Tau was calculated, but not reliable
+            tau = -3
+            tau = int(tau)
+
+    return tau, r_squared
+
+
+def calculate_median_long_track(df_tracks, fraction=None):
     """
     Calculate the average of the long tracks for the square
     The long tracks are defined as the longest 10% of the tracks
@@ -316,28 +707,30 @@ def calculate_median_long_track(df_tracks):
     if nr_of_tracks == 0:
         median_long_track = 0
     else:
-        df_tracks.sort_values(by=['Track Duration'], inplace=True)
-        fraction = get_paint_attribute_with_default('Generate Squares',
-                                       'Fraction of Squares to Determine Background', 0.1)
-        nr_tracks_to_average = max(round(fraction * nr_of_tracks),  1)
-        median_long_track = df_tracks.tail(nr_tracks_to_average)['Track Duration'].median()
+        if fraction is None:
+            fraction = get_paint_attribute_with_default('Generate Squares',
+                                                        'Fraction of Squares to Determine Background', 0.1)
+        _, _, median_long_track, _ = grouped_order_statistics(
+            df_tracks['Track Duration'].to_numpy(dtype=float), np.array([0, nr_of_tracks]), fraction)
+        median_long_track = median_long_track[0]
     return median_long_track
 
 
-def calculate_median_short_track(df_tracks):
+def calculate_median_short_track(df_tracks, fraction=None):
     """
-    Calculate the average of the long tracks for the square
-    The long tracks are defined as the longest 10% of the tracks
+    Calculate the average of the short tracks for the square
+    The short tracks are defined as the shortest 10% of the tracks
     """
     nr_of_tracks = len(df_tracks)
     if nr_of_tracks == 0:
         median_short_track = 0
     else:
-        df_tracks.sort_values(by=['Track Duration'], inplace=True)
-        fraction = get_paint_attribute_with_default('Generate Squares',
-                                       'Fraction of Squares to Determine Background', 0.1)
-        nr_tracks_to_average = max(round(fraction * nr_of_tracks),  1)
-        median_short_track = df_tracks.head(nr_tracks_to_average)['Track Duration'].median()
+        if fraction is None:
+            fraction = get_paint_attribute_with_default('Generate Squares',
+                                                        'Fraction of Squares to Determine Background', 0.1)
+        _, _, _, median_short_track = grouped_order_statistics(
+            df_tracks['Track Duration'].to_numpy(dtype=float), np.array([0, nr_of_tracks]), fraction)
+        median_short_track = median_short_track[0]
     return median_short_track
 
 
@@ -355,13 +748,13 @@ def read_tracks_of_experiment(experiment_path: str) -> pd.DataFrame:
             # Return empty DataFrame with required columns
             return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
-        df_tracks_of_experiment = pd.read_csv(file_path)
+        df_tracks_of_experiment = read_paint_table(file_path, 'All Tracks')
 
         if df_tracks_of_experiment.empty:
             paint_logger.warning(f"No tracks found in {file_path}")
             return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
-        df_tracks_of_experiment = create_unique_key_for_tracks(df_tracks_of_experiment)
+        df_tracks_of_experiment = index_tracks_by_composite_key(df_tracks_of_experiment)
         df_tracks_of_experiment['Square Nr'] = None
         df_tracks_of_experiment['Label Nr'] = None
         return df_tracks_of_experiment
@@ -372,12 +765,55 @@ def read_tracks_of_experiment(experiment_path: str) -> pd.DataFrame:
         return pd.DataFrame(columns=['Square Nr', 'Label Nr'])
 
 
+def read_tracks_of_experiment_by_recording(experiment_path: str, nr_rows_in_chunk: int = None):
+    """
+    Read the All Tracks file for an Experiment in chunks and yield the name and tracks of one Recording at a time, as
+    soon as all its tracks have been read. The tracks get the same columns as with read_tracks_of_experiment.
+    Only the tracks of one Recording and one chunk are in memory at a time. The file must hold the tracks of a
+    Recording together, as it does when TrackMate writes it; a ValueError is raised when it does not.
+    """
+
+    file_path = os.path.join(experiment_path, 'All Tracks.csv')
+    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+        paint_logger.warning(f"'All Tracks.csv' file in {experiment_path} is empty or doesn't exist")
+        return
+    if nr_rows_in_chunk is None:
+        nr_rows_in_chunk = get_paint_attribute_with_default('Generate Squares', 'Nr of Tracks in Chunk', 100000)
+
+    def tracks_of_recording(pieces):
+        df_tracks_of_recording = index_tracks_by_composite_key(pd.concat(pieces), len(recording_names_read) - 1)
+        df_tracks_of_recording['Square Nr'] = None
+        df_tracks_of_recording['Label Nr'] = None
+        return df_tracks_of_recording
+
+    recording_name = None
+    recording_names_read = set()
+    pieces = []
+    for df_chunk in read_paint_table_in_chunks(file_path, 'All Tracks', nr_rows_in_chunk):
+
+        # Split the chunk where the Recording changes
+        names = df_chunk['Ext Recording Name'].to_numpy()
+        boundaries = [0, *(np.flatnonzero(names[1:] != names[:-1]) + 1), len(names)]
+        for start, stop in zip(boundaries[:-1], boundaries[1:]):
+            if names[start] != recording_name:
+                if pieces:
+                    yield recording_name, tracks_of_recording(pieces)
+                recording_name = names[start]
+                if recording_name in recording_names_read:
+                    raise ValueError(f"The tracks of {recording_name} are not together in {file_path}")
+                recording_names_read.add(recording_name)
+                pieces = []
+            pieces.append(df_chunk.iloc[start:stop])
+
+    if pieces:
+        yield recording_name, tracks_of_recording(pieces)
+
 
 def read_recordings_of_experiment(experiment_path: str) -> pd.DataFrame:
     """
     Read the All Recordings file for an Experiment
     """
-    df_recordings_of_experiment = pd.read_csv(os.path.join(experiment_path, 'All Recordings.csv'))
+    df_recordings_of_experiment = read_paint_table(os.path.join(experiment_path, 'All Recordings.csv'), 'All Recordings')
     if df_recordings_of_experiment is None:
         paint_logger.error(
             f"Function 'process_experiment' failed: Likely, {experiment_path} is not a valid  \
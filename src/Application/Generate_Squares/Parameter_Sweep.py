@@ -0,0 +1,200 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calc_area_of_square,
+    calculate_density,
+    get_duration_histograms_of_squares,
+    get_min_track_duration_in_frames)
+from src.Application.Generate_Squares.Curvefit_and_Plot import (
+    compile_duration_from_histogram,
+    curve_fit_and_plot,
+    maximum_likelihood_fit)
+from src.Application.Recording_Viewer.Select_Squares import select_squares_with_neighbours
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# A parameter sweep evaluates the Recording Tau, R squared and Density for every combination of selection
+# parameters, using the squares and tracks of an earlier Generate Squares run.
+#
+# The selection of all combinations is done at once on arrays of shape (combinations, squares). The tracks of a
+# Recording are counted once into a table of squares by track duration (get_duration_histograms_of_squares), so the
+# duration histogram of any selection is a matrix product. Selections that end up with the same histogram share one curve fit.
+#
+# The selection follows the rules used for the Recording Tau in Generate Squares (squares with an invalid Tau are
+# included), so a combination gives the same values as generating the squares with those parameters.
+# ----------------------------------------------------------------------------------------------------
+
+PARAMETER_SWEEP_COLUMNS = {
+    'min_required_density_ratio': 'Min Required Density Ratio',
+    'max_allowable_variability': 'Max Allowable Variability',
+    'min_track_duration': 'Min Track Duration',
+    'max_track_duration': 'Max Track Duration',
+    'min_required_r_squared': 'Min Required R Squared',
+    'neighbour_mode': 'Neighbour Mode'}
+
+# The columns of All Squares and All Tracks that a parameter sweep uses ('Square Manually Excluded' when present)
+PARAMETER_SWEEP_SQUARE_COLUMNS = [
+    'Ext Recording Name', 'Square Nr', 'Concentration', 'Density Ratio', 'Variability', 'Max Track Duration',
+    'R Squared', 'Tau']
+PARAMETER_SWEEP_TRACK_COLUMNS = ['Ext Recording Name', 'Square Nr', 'Track Duration', 'Diffusion Coefficient']
+
+
+def evaluate_parameter_sweep(
+        df_squares: pd.DataFrame,
+        df_tracks: pd.DataFrame,
+        parameter_grid: dict,
+        min_tracks_for_tau: int,
+        min_required_r_squared: float,
+        nr_of_squares_in_row: int = None) -> pd.DataFrame:
+    """
+    Evaluate all combinations of the selection parameters in parameter_grid for every Recording in df_squares.
+
+    parameter_grid holds a list of values for each of the select parameters (the keys of pack_select_parameters).
+    min_tracks_for_tau and min_required_r_squared determine whether a Recording Tau is accepted, as in Generate
+    Squares. The number of squares in a row is derived from the squares of a Recording when not given.
+
+    Returns one row per Recording and combination with the Recording Tau, R squared and Density, using the error
+    codes of calculate_tau.
+    """
+
+    combinations = list(itertools.product(*[parameter_grid[parameter] for parameter in PARAMETER_SWEEP_COLUMNS]))
+    df_combinations = pd.DataFrame(combinations, columns=list(PARAMETER_SWEEP_COLUMNS.values()))
+    paint_logger.debug(f"Evaluating {len(df_combinations)} parameter combinations")
+
+    tracks_by_recording = dict(list(df_tracks.groupby('Ext Recording Name', sort=False)))
+    results = []
+    for recording_name, df_squares_of_recording in df_squares.groupby('Ext Recording Name', sort=False):
+        df_tracks_of_recording = tracks_by_recording.get(recording_name, df_tracks.iloc[0:0])
+        df_result = evaluate_parameter_sweep_for_recording(
+            df_squares_of_recording,
+            df_tracks_of_recording,
+            df_combinations,
+            min_tracks_for_tau,
+            min_required_r_squared,
+            nr_of_squares_in_row)
+        df_result.insert(0, 'Ext Recording Name', recording_name)
+        results.append(df_result)
+
+    if len(results) == 0:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True)
+
+
+def evaluate_parameter_sweep_for_recording(
+        df_squares_of_recording: pd.DataFrame,
+        df_tracks_of_recording: pd.DataFrame,
+        df_combinations: pd.DataFrame,
+        min_tracks_for_tau: int,
+        min_required_r_squared: float,
+        nr_of_squares_in_row: int = None) -> pd.DataFrame:
+
+    df_squares_of_recording = df_squares_of_recording.sort_values('Square Nr')
+    nr_squares = len(df_squares_of_recording)
+    if nr_of_squares_in_row is None:
+        nr_of_squares_in_row = int(round(np.sqrt(nr_squares)))
+    if nr_squares != nr_of_squares_in_row * nr_of_squares_in_row or \
+            not np.array_equal(df_squares_of_recording['Square Nr'].to_numpy(), np.arange(nr_squares)):
+        raise ValueError(f"The squares of a recording do not form a grid of {nr_of_squares_in_row} by "
+                         f"{nr_of_squares_in_row} squares")
+
+    # The selection of all combinations at once
+    selected = select_squares_for_combinations(df_squares_of_recording, df_combinations, nr_of_squares_in_row)
+
+    # Count the tracks of every square, in total and by track duration for the tracks that are used for the Tau
+    frames, duration_histograms, nr_tracks_in_squares = get_duration_histograms_of_squares(
+        df_tracks_of_recording, nr_of_squares_in_row)
+
+    selected_as_int = selected.astype(np.int64)
+    nr_tracks = selected_as_int @ nr_tracks_in_squares
+    histograms = selected_as_int @ duration_histograms
+
+    # Fit every distinct histogram once
+    tau = np.full(len(df_combinations), -1.0)
+    r_squared = np.zeros(len(df_combinations))
+    enough_tracks = histograms.sum(axis=1) >= min_tracks_for_tau
+    if enough_tracks.any():
+        unique_histograms, histogram_indices = np.unique(histograms[enough_tracks], axis=0, return_inverse=True)
+        fits = fit_duration_histograms(frames, unique_histograms)
+        tau[enough_tracks] = fits[histogram_indices.ravel(), 0]
+        r_squared[enough_tracks] = fits[histogram_indices.ravel(), 1]
+    tau[enough_tracks & (r_squared < min_required_r_squared)] = -3
+
+    # The Density of the tracks in the selected squares
+    concentration = float(df_squares_of_recording['Concentration'].iloc[0])
+    area = calc_area_of_square(nr_of_squares_in_row)
+    density = [calculate_density(nr_tracks=int(n), area=area, time=100, concentration=concentration)
+               for n in nr_tracks]
+
+    df_result = df_combinations.copy()
+    df_result['Nr Selected Squares'] = selected.sum(axis=1)
+    df_result['Nr Tracks'] = nr_tracks
+    df_result['Tau'] = np.round(tau, 0)
+    df_result['R Squared'] = np.round(r_squared, 3)
+    df_result['Density'] = np.round(density, 5)
+    return df_result
+
+
+def select_squares_for_combinations(
+        df_squares_of_recording: pd.DataFrame,
+        df_combinations: pd.DataFrame,
+        nr_of_squares_in_row: int) -> np.ndarray:
+    """
+    The squares selected for the Recording Tau for every combination, as a boolean array of shape
+    (combinations, squares). The squares must be ordered by Square Nr.
+    """
+
+    def parameter(column):
+        return df_combinations[column].to_numpy(dtype=float)[:, np.newaxis]
+
+    density_ratio = df_squares_of_recording['Density Ratio'].to_numpy(dtype=float)
+    variability = df_squares_of_recording['Variability'].to_numpy(dtype=float)
+    max_track_duration = df_squares_of_recording['Max Track Duration'].to_numpy(dtype=float)
+    square_r_squared = df_squares_of_recording['R Squared'].to_numpy(dtype=float)
+    square_tau = df_squares_of_recording['Tau'].to_numpy(dtype=float)
+
+    selected = (
+            (density_ratio >= parameter('Min Required Density Ratio')) &
+            (variability <= parameter('Max Allowable Variability')) &
+            (max_track_duration >= parameter('Min Track Duration')) &
+            (max_track_duration <= parameter('Max Track Duration')) &
+            ((square_r_squared >= parameter('Min Required R Squared')) | (square_tau < 0)))
+
+    neighbour_modes = df_combinations['Neighbour Mode'].to_numpy()
+    for neighbour_mode in np.unique(neighbour_modes):
+        rows = neighbour_modes == neighbour_mode
+        grid = selected[rows].reshape(-1, nr_of_squares_in_row, nr_of_squares_in_row)
+        selected[rows] = select_squares_with_neighbours(grid, neighbour_mode).reshape(grid.shape[0], -1)
+
+    if 'Square Manually Excluded' in df_squares_of_recording.columns:
+        selected &= ~(df_squares_of_recording['Square Manually Excluded'] == True).to_numpy()
+
+    return selected
+
+
+def fit_duration_histograms(frames: np.ndarray, histograms: np.ndarray) -> np.ndarray:
+    """
+    Fit the Tau of each histogram with the Tau Fit Mode of Generate Squares. Returns the Tau and R squared of each
+    histogram as an array of shape (nr_histograms, 2).
+    """
+
+    tau_fit_mode = get_paint_attribute_with_default('Generate Squares', 'Tau Fit Mode', 'Curve Fit')
+    if tau_fit_mode == 'Maximum Likelihood':
+        tau, r_squared = maximum_likelihood_fit(frames, histograms, get_min_track_duration_in_frames())
+        fits = np.column_stack([tau, r_squared]).astype(float)
+    else:
+        fits = np.array([fit_duration_histogram(frames, histogram) for histogram in histograms],
+                        dtype=float).reshape(-1, 2)
+    fits[fits[:, 0] == -2, 1] = 0  # Tau calculation failed
+    return fits
+
+
+def fit_duration_histogram(frames: np.ndarray, histogram: np.ndarray) -> tuple:
+    duration_data = compile_duration_from_histogram(frames, histogram)
+    tau, r_squared = curve_fit_and_plot(plot_data=duration_data)
+    if tau == -2:  # Tau calculation failed
+        r_squared = 0
+    return tau, r_squared
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Generate_Squares.Generate_Squares_Manifest import (
+    GENERATE_SQUARES_ATTRIBUTES,
+    TRACKMATE_ATTRIBUTES)
+from src.Application.Support.Table_Sidecar import decode_table_columns, encode_table_columns
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# The square statistics of a Recording (Tau, R squared, Density, Variability and the track statistics of every
+# square) do not depend on the selection parameters. They are cached per Experiment, so that running the same data
+# with other selection parameters only repeats the selection and the Recording Tau.
+#
+# A cache entry is keyed on the content of the track columns and the Recording attributes that the statistics are
+# calculated from, together with the parameters that change them. The entry holds the squares of the Recording
+# before selection and the square numbers of its tracks. The entries are stored column by column in a .npz file, in
+# the same way as the sidecars (see Table_Sidecar), with a format and version that are checked when it is read.
+# ----------------------------------------------------------------------------------------------------
+
+SQUARE_STATISTICS_CACHE_FILE_NAME = 'Square Statistics Cache.npz'
+
+# The cache holds no pickled objects; a cache of another format or version is ignored and written again
+SQUARE_STATISTICS_CACHE_FORMAT = 'Square Statistics Cache'
+SQUARE_STATISTICS_CACHE_VERSION = 1
+
+# How the square numbers of the tracks of a Recording are stored
+INTEGER_SQUARE_NRS = 'Integer'  # A nullable integer array; tracks outside the squares are missing
+MISSING_SQUARE_NRS = 'Missing'  # No square numbers, for a Recording without tracks
+
+# The track columns from which the square statistics are calculated
+SQUARE_STATISTICS_TRACK_COLUMNS = [
+    'Track X Location',
+    'Track Y Location',
+    'Track Duration',
+    'Track Displacement',
+    'Track Max Speed',
+    'Track Mean Speed',
+    'Diffusion Coefficient',
+    'Diffusion Coefficient Ext']
+
+# The Recording attributes that are copied into the squares
+SQUARE_STATISTICS_RECORDING_FIELDS = [
+    'Recording Sequence Nr',
+    'Ext Recording Name',
+    'Experiment Name',
+    'Experiment Date',
+    'Condition Nr',
+    'Replicate Nr',
+    'Probe',
+    'Probe Type',
+    'Cell Type',
+    'Adjuvant',
+    'Concentration',
+    'Threshold',
+    'Nr Spots']
+
+
+def get_square_statistics_key(
+        df_tracks_of_recording: pd.DataFrame,
+        recording_data: pd.Series,
+        nr_of_squares_in_row: int,
+        min_required_r_squared: float,
+        min_tracks_for_tau: int) -> str:
+    key = hashlib.sha256()
+    for column in SQUARE_STATISTICS_TRACK_COLUMNS:
+        key.update(column.encode())
+        if column in df_tracks_of_recording.columns:
+            key.update(np.ascontiguousarray(df_tracks_of_recording[column].to_numpy(dtype=float)).tobytes())
+    parameters = [str(recording_data.get(field)) for field in SQUARE_STATISTICS_RECORDING_FIELDS]
+    parameters += [str(nr_of_squares_in_row), str(min_required_r_squared), str(min_tracks_for_tau)]
+    parameters += [str(get_paint_attribute_with_default('Generate Squares', attribute, default))
+                   for attribute, default in GENERATE_SQUARES_ATTRIBUTES.items()]
+    parameters += [str(get_paint_attribute_with_default('TrackMate', attribute, default))
+                   for attribute, default in TRACKMATE_ATTRIBUTES.items()]
+    key.update(repr(parameters).encode())
+    return key.hexdigest()
+
+
+def read_square_statistics_cache(experiment_path: str) -> dict:
+    """
+    Returns the cache entries of an Experiment by key. A cache that is missing, can not be read or was written in
+    another format is ignored.
+    """
+
+    cache_path = os.path.join(experiment_path, SQUARE_STATISTICS_CACHE_FILE_NAME)
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with np.load(cache_path, allow_pickle=False) as arrays:
+            description = json.loads(str(arrays['Description']))
+            if (description.get('Format') != SQUARE_STATISTICS_CACHE_FORMAT or
+                    description.get('Version') != SQUARE_STATISTICS_CACHE_VERSION):
+                paint_logger.info(f"The square statistics cache {cache_path} has another format and is ignored")
+                return {}
+
+            square_statistics = {}
+            for entry_nr, entry in enumerate(description['Entries']):
+                key_prefix = f"Entry {entry_nr} "
+                df_squares = pd.DataFrame(decode_table_columns(arrays, entry['Columns'], key_prefix),
+                                          index=pd.RangeIndex(entry['Nr Rows']))
+                if entry['Square Nrs'] == MISSING_SQUARE_NRS:
+                    square_nrs = np.full(len(arrays[key_prefix + 'Square Nrs']), None, dtype=object)
+                else:
+                    square_nrs = pd.arrays.IntegerArray(arrays[key_prefix + 'Square Nrs'],
+                                                        arrays[key_prefix + 'Square Nrs Missing'])
+                square_statistics[entry['Key']] = (df_squares, square_nrs)
+    except (OSError, ValueError, KeyError) as e:
+        paint_logger.warning(f"The square statistics cache {cache_path} could not be read and is ignored: {e}")
+        return {}
+    return square_statistics
+
+
+def write_square_statistics_cache(experiment_path: str, square_statistics: dict) -> None:
+    """
+    Write the cache entries of the Recordings that were just processed. The file is replaced atomically.
+    Recordings whose squares or square numbers can not be stored without pickling are left out.
+    """
+
+    arrays = {}
+    entries = []
+    for key, (df_squares, square_nrs) in square_statistics.items():
+        key_prefix = f"Entry {len(entries)} "
+        try:
+            columns, entry_arrays = encode_table_columns(df_squares, key_prefix)
+        except ValueError as e:
+            paint_logger.debug(f"Square statistics not cached: {e}")
+            continue
+        if isinstance(square_nrs, pd.arrays.IntegerArray):
+            square_nrs_kind = INTEGER_SQUARE_NRS
+            entry_arrays[key_prefix + 'Square Nrs'] = square_nrs.to_numpy(dtype=square_nrs.dtype.numpy_dtype,
+                                                                          na_value=0)
+            entry_arrays[key_prefix + 'Square Nrs Missing'] = np.asarray(square_nrs.isna())
+        elif pd.isna(np.asarray(square_nrs, dtype=object)).all():
+            square_nrs_kind = MISSING_SQUARE_NRS
+            entry_arrays[key_prefix + 'Square Nrs'] = np.zeros(len(square_nrs), dtype=np.int64)
+        else:
+            paint_logger.debug("Square statistics not cached: the square numbers of the tracks can not be stored")
+            continue
+        entries.append({'Key': key, 'Columns': columns, 'Nr Rows': len(df_squares), 'Square Nrs': square_nrs_kind})
+        arrays.update(entry_arrays)
+
+    description = {
+        'Format': SQUARE_STATISTICS_CACHE_FORMAT,
+        'Version': SQUARE_STATISTICS_CACHE_VERSION,
+        'Entries': entries}
+    arrays['Description'] = np.array(json.dumps(description))
+
+    cache_path = os.path.join(experiment_path, SQUARE_STATISTICS_CACHE_FILE_NAME)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(temp_path, cache_path)
+
+    # The cache used to be pickled; such a file is not read anymore
+    old_cache_path = os.path.join(experiment_path, 'Square Statistics Cache.pkl')
+    if os.path.exists(old_cache_path):
+        os.remove(old_cache_path)
@@ -12,14 +12,16 @@ from tkinter import *
 from tkinter import messagebox
 from tkinter import ttk
 
-import pandas as pd
 from PIL import Image
 
 from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
-    calculate_tau,
-    extra_constraints_on_tracks_for_tau_calculation,
+    calculate_tau_from_duration_histograms,
+    get_duration_histograms_of_squares,
     calc_area_of_square,
-    calculate_density)
+    calculate_density,
+    create_unique_key_for_tracks,
+    index_tracks_by_composite_key)
+from src.Application.Generate_Squares.Generate_Squares_Manifest import refresh_manifest_outputs
 from src.Application.Recording_Viewer.Class_Define_Cell_Dialog import DefineCellDialog
 from src.Application.Recording_Viewer.Class_Heatmap_Dialog import HeatMapDialog
 from src.Application.Recording_Viewer.Class_Select_Recording_Dialog import SelectRecordingDialog
@@ -35,6 +37,7 @@ from src.Application.Recording_Viewer.Recording_Viewer_Support_Functions import
     test_if_square_is_in_rectangle,
     save_as_png)
 from src.Application.Recording_Viewer.Select_Squares import (
+    CLUSTER_COLUMNS,
     relabel_tracks,
     select_squares_and_label,
     select_all_squares,
@@ -42,6 +45,8 @@ from src.Application.Recording_Viewer.Select_Squares import (
 from src.Application.Support.General_Support_Functions import (
     read_squares_from_file,
     set_application_icon)
+from src.Application.Support.Table_Schema import read_paint_table
+from src.Application.Support.Track_Store import open_track_store
 from src.Fiji.LoggerConfig import (
     paint_logger,
     paint_logger_change_file_handler_name)
@@ -114,7 +119,9 @@ class RecordingViewer:
         self.df_all_squares = None
         self.df_squares = None
         self.df_all_tracks = None
+        self.track_store = None
         self.df_experiment = None
+        self.duration_histograms = {}
 
         # UI state variables
         self.start_x = None
@@ -339,9 +346,10 @@ class RecordingViewer:
             self.show_error_and_exit("No 'All Squares.csv.csv' file, Did you select an image directory?")
 
         # Read the 'All Recordings' file
-        self.df_experiment = pd.read_csv(os.path.join(self.user_specified_directory, 'All Recordings.csv'),
-                                         dtype={'Max Allowable Variability': float,
-                                                'Min Required Density Ratio': float})
+        self.df_experiment = read_paint_table(os.path.join(self.user_specified_directory, 'All Recordings.csv'),
+                                              'All Recordings',
+                                              dtype={'Max Allowable Variability': float,
+                                                     'Min Required Density Ratio': float})
 
         if self.df_experiment is None:
             self.show_error_and_exit("No 'All Recordings' file, Did you select an image directory?")
@@ -364,13 +372,25 @@ class RecordingViewer:
         if set(self.df_all_squares['Ext Recording Name']) != set(df_filtered['Ext Recording Name']):
             self.show_error_and_exit(
                 "The recordings in the 'All Squares' file do not align with the 'All Recordings' file")
-        # Read the 'All Tracks' file
-        self.df_all_tracks = pd.read_csv(os.path.join(self.user_specified_directory, 'All Tracks.csv'))
+        # Read the 'All Tracks' file, with compact types as it is by far the largest
+        self.df_all_tracks = read_paint_table(os.path.join(self.user_specified_directory, 'All Tracks.csv'),
+                                              'All Tracks', compact=True)
         if self.df_all_tracks is None:
             self.show_error_and_exit("No 'All Tracks' file, Did you select an image directory?")
         if 'Unique Key' not in self.df_all_tracks.columns:
             self.show_error_and_exit("No 'Unique Key' in the All Tracks file. Did you run Generate Squares?")
-        self.df_all_tracks.set_index('Unique Key', inplace=True, drop=False)
+        # The text key is made again when the tracks are saved
+        index_tracks_by_composite_key(self.df_all_tracks)
+        self.duration_histograms = {}
+
+        # The tracks of a single recording or square are looked up in the track store, so that not all tracks have
+        # to be scanned. The squares of the tracks do not change in the viewer, only their labels. When no store can
+        # be made, the tracks are taken from self.df_all_tracks.
+        try:
+            self.track_store = open_track_store(os.path.join(self.user_specified_directory, 'All Tracks.csv'))
+        except (OSError, ValueError) as e:
+            paint_logger.warning(f"No track store could be made, the tracks are searched instead: {e}")
+            self.track_store = None
 
         self.nr_of_squares_in_row = int(self.df_experiment.iloc[0]['Nr of Squares in Row'])
 
@@ -1037,19 +1057,24 @@ class RecordingViewer:
 
 
         already_selected = self.df_squares.loc[(self.df_squares['Col Nr'] == col) & (self.df_squares['Row Nr'] == row), 'Selected'].iloc[0]
-        print(f"Row = {row} and Col = {col}: {already_selected}")
+        paint_logger.debug(f"Row = {row} and Col = {col}: {already_selected}")
 
         # Set self.track_click to indicate that the user clicked on an empty space
         self.track_click = True
 
         if not already_selected:
             square_nr =  (row - 1) * self.nr_of_squares_in_row + col
-            df_tracks_for_square = self.df_all_tracks[
-                (self.df_all_tracks['Square Nr'] == square_nr) & (self.df_all_tracks['Ext Recording Name'] == self.image_name)]
-            df_tracks_for_square.to_csv('~/Downloads/Tracks_for_square.csv')
+            if self.track_store is not None:
+                df_tracks_for_square = self.track_store.get_tracks_of_square(self.image_name, square_nr)
+            else:
+                df_tracks_for_square = self.df_all_tracks[
+                    (self.df_all_tracks['Square Nr'] == square_nr) &
+                    (self.df_all_tracks['Ext Recording Name'] == self.image_name)]
             if len(df_tracks_for_square) != 0:
-                df_tracks_for_square.drop(columns=['Unique Key', 'Unique Key', 'Ext Recording Name', 'Nr Spots', 'Nr Gaps', 'Longest Gap', 'Track Total Distance', 'Label Nr'], inplace=True)
-                print (df_tracks_for_square.to_string(index=False))
+                df_tracks_for_square = df_tracks_for_square.drop(
+                    columns=['Unique Key', 'Ext Recording Name', 'Nr Spots', 'Nr Gaps', 'Longest Gap', 'Label Nr'],
+                    errors='ignore')
+                paint_logger.debug(df_tracks_for_square.to_string(index=False))
         return already_selected
 
 
@@ -1256,8 +1281,8 @@ class RecordingViewer:
         # Update the label information in the tracks and squares data corresponding to the image
         dfs, dft = relabel_tracks(df_recording_squares, df_recording_tracks)
 
-        # Update the label information in the All Squares and All Tracks dataframes
-        self.df_all_tracks.update(dft, overwrite=True)
+        # Update the label information in the All Squares and All Tracks dataframes. Only the label columns of the
+        # tracks are copied, so the compact column types of All Tracks are kept
         self.df_all_squares.update(dfs, overwrite=True)
 
         self.df_all_tracks.loc[dft.index, 'Label Nr'] = dft['Label Nr']
@@ -1266,6 +1291,9 @@ class RecordingViewer:
         self.df_all_squares.loc[dfs.index, 'Label Nr'] = dfs['Label Nr']
         self.df_all_squares.loc[dfs.index, 'Square Nr'] = dfs['Square Nr']
         self.df_all_squares.loc[dfs.index, 'Selected'] = dfs['Selected']
+        for column in CLUSTER_COLUMNS:
+            if column in dfs.columns:
+                self.df_all_squares.loc[dfs.index, column] = dfs[column]
 
 
     def save_changes_on_exit(self):
@@ -1286,9 +1314,13 @@ class RecordingViewer:
         if save:
             # Save the data
             self.df_all_squares.to_csv(os.path.join(self.user_specified_directory, 'All Squares.csv'), index=False)
-            self.df_all_tracks.to_csv(os.path.join(self.user_specified_directory, 'All Tracks.csv'), index=False)
+            create_unique_key_for_tracks(self.df_all_tracks).to_csv(
+                os.path.join(self.user_specified_directory, 'All Tracks.csv'), index=False)
             self.df_experiment.to_csv(os.path.join(self.user_specified_directory, 'All Recordings.csv'), index=False)
 
+            # The saved changes are deliberate, so Generate Squares should not regard the Experiment as changed
+            refresh_manifest_outputs(self.user_specified_directory)
+
         return save
 
     def user_confirms_save(self, mode):
@@ -1439,22 +1471,31 @@ def recalc_recording_tau_and_density(self):
     if 'Square Manually Excluded' in self.df_squares.columns:
         df_squares_for_single_tau = df_squares_for_single_tau[df_squares_for_single_tau['Square Manually Excluded'] == False]
 
-    df_tracks_for_recording = self.df_all_tracks[self.df_all_tracks['Ext Recording Name'] == self.image_name]
-
-    df_tracks_for_tau = df_tracks_for_recording[
-        df_tracks_for_recording['Square Nr'].isin(df_squares_for_single_tau['Square Nr'])]
-    df_tracks_for_tau = extra_constraints_on_tracks_for_tau_calculation(df_tracks_for_tau)
-
-    tau, r_squared = calculate_tau(
-        df_tracks_for_tau,
+    # The tracks of a recording are counted per square and duration once, after that a recalculation only needs
+    # the counts of the selected squares
+    if self.image_name not in self.duration_histograms:
+        if self.track_store is not None:
+            df_tracks_for_recording = self.track_store.get_tracks_of_recording(
+                self.image_name, columns=['Square Nr', 'Track Duration', 'Diffusion Coefficient'])
+        else:
+            df_tracks_for_recording = self.df_all_tracks[self.df_all_tracks['Ext Recording Name'] == self.image_name]
+        self.duration_histograms[self.image_name] = get_duration_histograms_of_squares(
+            df_tracks_for_recording, self.nr_of_squares_in_row)
+    duration_histograms = self.duration_histograms[self.image_name]
+    selected_square_nrs = df_squares_for_single_tau['Square Nr'].to_numpy(dtype=int)
+
+    tau, r_squared = calculate_tau_from_duration_histograms(
+        duration_histograms,
+        selected_square_nrs,
         # self.min_tracks_for_tau,
         10,
         self.min_required_r_squared)
 
     # Calculate the Density values
+    _, histograms, _ = duration_histograms
     area = calc_area_of_square(self.nr_of_squares_in_row)
     density = calculate_density(
-        nr_tracks=len(df_tracks_for_tau),
+        nr_tracks=int(histograms[selected_square_nrs].sum()),
         area=area,
         time=100,
         # concentration=self.concentration,   # ToDO
@@ -216,7 +216,7 @@ class SelectSquareDialog:
         # Create a label for the neighbour mode
         self.rb_neighbour_label = ttk.Label(self.frame_neighbours, text="Neighbour\nMode", width=10)
 
-        # Create three radio buttons for the neighbour mode
+        # Create four radio buttons for the neighbour mode
         self.neighbour_mode = tk.StringVar(value="")
         self.rb_neighbour_free = tk.Radiobutton(
             self.frame_neighbours, text="Free", variable=self.neighbour_mode, width=10, value="Free",
@@ -227,12 +227,16 @@ class SelectSquareDialog:
         self.rb_neighbour_relaxed = tk.Radiobutton(
             self.frame_neighbours, text="Relaxed", variable=self.neighbour_mode, value="Relaxed",
             command=lambda: self.on_filter_changed('Neighbour Mode'), anchor=tk.W)
+        self.rb_neighbour_cluster = tk.Radiobutton(
+            self.frame_neighbours, text="Cluster", variable=self.neighbour_mode, value="Cluster",
+            command=lambda: self.on_filter_changed('Neighbour Mode'), anchor=tk.W)
 
         # Place the radio buttons and button in the grid
         self.rb_neighbour_label.grid(column=0, row=0, padx=5, pady=5, sticky=tk.W)
         self.rb_neighbour_free.grid(column=0, row=1, padx=5, pady=5, sticky=tk.W)
         self.rb_neighbour_relaxed.grid(column=0, row=2, padx=5, pady=5, sticky=tk.W)
         self.rb_neighbour_strict.grid(column=0, row=3, padx=5, pady=5, sticky=tk.W)
+        self.rb_neighbour_cluster.grid(column=0, row=4, padx=5, pady=5, sticky=tk.W)
 
     # --------------------------------------------------------------------------------------------------------
     # Event Handlers
@@ -1,4 +1,11 @@
 import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# The columns that only the Cluster neighbour mode fills in
+CLUSTER_COLUMNS = ['Cluster Id', 'Cluster Size']
 
 
 # -------------------------------------------------------------------------------------------------------------
@@ -106,16 +113,17 @@ def _select_squares_actual(
                 )
         )
 
-    # Eliminate isolated squares based on neighborhood rules
+    # Eliminate isolated squares based on neighborhood rules, for the squares of all recordings at once
     df_squares.set_index('Square Nr', inplace=True, drop=False)
-    if neighbour_mode == 'Free':
-        pass
-    elif neighbour_mode == 'Strict':
-        select_squares_neighbour_strict(df_squares, nr_of_squares_in_row)
-    elif neighbour_mode == 'Relaxed':
-        select_squares_neighbour_relaxed(df_squares, nr_of_squares_in_row)
-    else:
-        raise ValueError(f"Neighbour mode '{neighbour_mode}' not recognized.")
+    if neighbour_mode != 'Free':
+        df_squares['Selected'] = select_squares_of_recordings_with_neighbours(
+            df_squares, neighbour_mode, nr_of_squares_in_row)
+
+    # Clusters found in an earlier selection in Cluster mode no longer apply: no square is in a cluster now
+    if neighbour_mode != 'Cluster':
+        for column in CLUSTER_COLUMNS:
+            if column in df_squares.columns:
+                df_squares[column] = 0
 
     # Ensure 'Selected' is False for rows where 'Square Manually Excluded' is True
     if 'Square Manually Excluded' in df_squares.columns:
@@ -126,146 +134,124 @@ def _select_squares_actual(
 
 
 
-def select_squares_neighbour_strict(df_squares, nr_of_squares_in_row):
+def select_squares_of_recordings_with_neighbours(df_squares, neighbour_mode, nr_of_squares_in_row):
     """
-    Identifies squares with visible neighbors in strict mode and updates their Selected status.
+    Applies the neighbour rules to the squares of one or more recordings at once. The squares are placed on a
+    (recordings x rows x columns) grid by their 'Row Nr' and 'Col Nr'; positions without a square are not selected.
+    Returns the new 'Selected' values, in the order of df_squares. In Cluster mode, the 'Cluster Id' and
+    'Cluster Size' columns of df_squares are filled in as well.
     """
-    list_of_squares = []
 
-    for index, square in df_squares.iterrows():
-        if not square['Selected']:
-            continue
-
-        row, col = square['Row Nr'], square['Col Nr']
-        square_nr = square['Square Nr']
-
-        # Define neighboring squares based on position
-        neighbours = get_strict_neighbours(row, col, nr_of_squares_in_row)
-
-        # Check if there are visible neighbors
-        has_visible_neighbors = False
-        for nb in neighbours:
-            # Calculate the neighbor index
-            neighbor_index = int((nb[0] - 1) * nr_of_squares_in_row + (nb[1] - 1))
-
-            # Check if the neighbor exists and is visible
-            if neighbor_index in df_squares.index and df_squares.loc[neighbor_index, 'Selected']:
-                has_visible_neighbors = True
-                break  # Exit early if any visible neighbor is found
-
-        # Update visibility based on visible neighbors
-        df_squares.at[square_nr, 'Selected'] = has_visible_neighbors
-        if has_visible_neighbors:
-            list_of_squares.append(square_nr)
-
-    return df_squares, list_of_squares
+    if 'Ext Recording Name' in df_squares.columns:
+        recording_codes, recording_names = pd.factorize(df_squares['Ext Recording Name'])
+    else:
+        recording_codes, recording_names = np.zeros(len(df_squares), dtype=int), [None]
+    row_nrs = df_squares['Row Nr'].to_numpy(dtype=int) - 1
+    col_nrs = df_squares['Col Nr'].to_numpy(dtype=int) - 1
+
+    selected = np.zeros((len(recording_names), nr_of_squares_in_row, nr_of_squares_in_row), dtype=bool)
+    selected[recording_codes, row_nrs, col_nrs] = df_squares['Selected'].to_numpy(dtype=bool)
+    if neighbour_mode == 'Cluster':
+        cluster_ids, cluster_sizes = label_clusters_of_squares(selected, *get_cluster_parameters())
+        df_squares['Cluster Id'] = cluster_ids[recording_codes, row_nrs, col_nrs]
+        df_squares['Cluster Size'] = cluster_sizes[recording_codes, row_nrs, col_nrs]
+        selected = cluster_ids > 0
+    else:
+        selected = select_squares_with_neighbours(selected, neighbour_mode)
+    return selected[recording_codes, row_nrs, col_nrs]
 
 
-def select_squares_neighbour_relaxed(df_squares, nr_of_squares_in_row):
+def select_squares_with_neighbours(selected, neighbour_mode):
     """
-    Updates visibility of squares based on relaxed neighborhood conditions,
-    ensuring isolated border squares are eliminated.
+    Array version of the neighbour rules. 'selected' is a boolean array of shape (..., n, n) with the squares of a
+    recording in row and column order; any leading dimensions (e.g. parameter combinations) are handled at once.
+    Returns which squares stay selected: in Strict mode squares need a selected neighbour left, right, above or
+    below, in Relaxed mode any of the eight surrounding squares counts. In Cluster mode squares must be part of a
+    large enough cluster (see label_clusters_of_squares). Free mode leaves the selection unchanged.
+
+    Deselecting a square never changes the outcome for another square: a square is only deselected when it has no
+    selected neighbours, so it was not the selected neighbour of any square either.
     """
-    # Keep track of squares that remain selected
-    list_of_squares = []
 
-    for index, square in df_squares.iterrows():
-        if not square['Selected']:
-            continue  # Skip unselected squares
-
-        row, col = square['Row Nr'], square['Col Nr']
-        square_nr = square['Square Nr']
-
-        # Get neighbors
-        neighbours = get_relaxed_neighbours(row, col, nr_of_squares_in_row)
+    if neighbour_mode == 'Free':
+        return selected
+    elif neighbour_mode == 'Strict':
+        if selected.shape[-2:] == (1, 1):
+            return selected  # The Strict rules have always let the square of a 1 x 1 grid be its own neighbour
+        offsets = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+    elif neighbour_mode == 'Relaxed':
+        offsets = [(0, -1), (0, 1), (-1, 0), (1, 0), (1, -1), (1, 1), (-1, -1), (-1, 1)]
+    elif neighbour_mode == 'Cluster':
+        cluster_ids, _ = label_clusters_of_squares(selected, *get_cluster_parameters())
+        return cluster_ids > 0
+    else:
+        raise ValueError(f"Neighbour mode '{neighbour_mode}' not recognized.")
 
-        # Check the visibility of neighbors
-        has_visible_neighbors = False
-        for nb in neighbours:
-            # Calculate neighbor index
-            neighbor_index = (nb[0] - 1) * nr_of_squares_in_row + (nb[1] - 1)
+    nr_rows, nr_cols = selected.shape[-2:]
+    padded = np.pad(selected, [(0, 0)] * (selected.ndim - 2) + [(1, 1), (1, 1)])
+    has_selected_neighbour = np.zeros_like(selected)
+    for row_offset, col_offset in offsets:
+        has_selected_neighbour |= padded[..., 1 + row_offset:1 + row_offset + nr_rows,
+                                         1 + col_offset:1 + col_offset + nr_cols]
+    return selected & has_selected_neighbour
 
-            # Ensure the neighbor exists in the grid and is selected
-            if neighbor_index in df_squares.index and df_squares.loc[neighbor_index, 'Selected']:
-                has_visible_neighbors = True
-                break  # Exit early if any visible neighbor is found
 
-        # Update 'Selected' status based on neighbors
-        if has_visible_neighbors:
-            list_of_squares.append(square_nr)
-        else:
-            df_squares.at[square_nr, 'Selected'] = False  # Mark as not visible
+def get_cluster_parameters():
+    """
+    The connectivity (4 or 8) and minimum size of the clusters in Cluster mode, from the Paint configuration.
+    """
 
-    return df_squares, list_of_squares
+    return (get_paint_attribute_with_default('Generate Squares', 'Cluster Connectivity', 8),
+            get_paint_attribute_with_default('Generate Squares', 'Min Cluster Size', 3))
 
 
-def get_strict_neighbours(row, col, nr_of_squares_in_row):
+def label_clusters_of_squares(selected, connectivity, min_cluster_size):
     """
-    Returns neighboring positions for strict neighborhood rule.
+    Finds the clusters of connected selected squares in a boolean array of shape (..., n, n), in one labelling pass
+    over all grids. With connectivity 4 squares connect through their sides, with 8 through their corners as well.
+    Clusters of fewer than min_cluster_size squares are dropped.
+    Returns the Cluster Id of every square, numbered from 1 within each grid in row order and 0 for squares that are
+    not in a cluster, and the size of the cluster of every square.
     """
-    left = (row, max(col - 1, 1))
-    right = (row, min(col + 1, nr_of_squares_in_row))
-    above = (max(row - 1, 1), col)
-    below = (min(row + 1, nr_of_squares_in_row), col)
-
-    if row == 1:
-        return [right, below] if col == 1 else \
-            [left, below] if col == nr_of_squares_in_row else \
-                [left, right, below]
-    elif row == nr_of_squares_in_row:
-        return [right, above] if col == 1 else \
-            [left, above] if col == nr_of_squares_in_row else \
-                [left, right, above]
-    else:
-        return [right, below, above] if col == 1 else \
-            [left, below, above] if col == nr_of_squares_in_row else \
-                [left, right, below, above]
 
+    if connectivity not in (4, 8):
+        raise ValueError(f"Cluster connectivity must be 4 or 8, not {connectivity}.")
 
-def get_relaxed_neighbours(row, col, nr_of_squares_in_row):
-    """
-    Returns all eight possible neighboring positions for relaxed neighborhood rule,
-    strictly considering grid boundaries.
-    """
-    neighbours = []
-    max_row, max_col = nr_of_squares_in_row, nr_of_squares_in_row
+    # Label the grids as one stack, without connections between the grids
+    grids = selected.reshape((-1,) + selected.shape[-2:])
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    labels, nr_labels = ndimage.label(grids, structure=structure)
 
-    # Potential neighbor positions
-    potential_neighbours = [
-        (row, col - 1),  # Left
-        (row, col + 1),  # Right
-        (row - 1, col),  # Above
-        (row + 1, col),  # Below
-        (row + 1, col - 1),  # Below Left
-        (row + 1, col + 1),  # Below Right
-        (row - 1, col - 1),  # Above Left
-        (row - 1, col + 1),  # Above Right
-    ]
+    cluster_sizes = np.bincount(labels.ravel(), minlength=nr_labels + 1)
+    cluster_sizes[0] = 0
+    cluster_sizes[cluster_sizes < min_cluster_size] = 0
 
-    # Filter valid positions within bounds
-    for nb_row, nb_col in potential_neighbours:
-        if 1 <= nb_row <= max_row and 1 <= nb_col <= max_col:
-            neighbours.append((nb_row, nb_col))
+    # The labels run in row order through the stack, so the clusters kept in a grid get consecutive numbers
+    grid_of_label = np.zeros(nr_labels + 1, dtype=int)
+    grid_of_label[labels.ravel()] = np.repeat(np.arange(len(grids)), grids[0].size if len(grids) > 0 else 0)
+    kept_labels = np.flatnonzero(cluster_sizes)
+    kept_grids = grid_of_label[kept_labels]
+    cluster_ids = np.zeros(nr_labels + 1, dtype=int)
+    cluster_ids[kept_labels] = np.arange(len(kept_labels)) - np.searchsorted(kept_grids, kept_grids) + 1
 
-    return neighbours
+    return cluster_ids[labels].reshape(selected.shape), cluster_sizes[labels].reshape(selected.shape)
 
 
 def label_selected_squares(df_squares):
     """
     Assigns label numbers to selected squares in descending order of 'Nr Tracks'.
-    This function changes only df_squares (df_tracks still needs to be aligned
+    This function changes only the 'Label Nr' column of df_squares (df_tracks still needs to be aligned). The order
+    and index of df_squares are left as they are.
     """
 
-    # Sort by 'Nr Tracks' in descending order
-    df_squares.sort_values(by=['Nr Tracks'], inplace=True, ascending=False)
-    df_squares.set_index('Square Nr', inplace=True, drop=False)
-
-    df_squares['Label Nr'] = np.nan  # Initialize the column
-    selected_indices = df_squares.loc[(df_squares['Selected']) & (df_squares['Tau'] >= 0)].index
-    df_squares.loc[selected_indices, 'Label Nr'] = range(1, len(selected_indices) + 1)
+    # The positions of the squares in descending order of 'Nr Tracks', ties in the order sort_values gives them
+    order = df_squares['Nr Tracks'].reset_index(drop=True).sort_values(ascending=False).index.to_numpy()
+    to_label = ((df_squares['Selected']) & (df_squares['Tau'] >= 0)).to_numpy(dtype=bool)[order]
 
-    # Restore original order
-    df_squares.sort_index(inplace=True)
+    label_nrs = np.full(len(df_squares), np.nan)
+    label_nrs[order[to_label]] = np.arange(1, to_label.sum() + 1)
+    df_squares['Label Nr'] = label_nrs
 
 
 def label_selected_squares_and_tracks(df_squares, df_tracks):
@@ -285,17 +271,31 @@ def relabel_tracks(df_squares, df_tracks):
     """
     Propagates labels from df_squares to df_tracks based on 'Square Nr' and 'Ext Recording Name'.
     Requires tracks and squares of the recording to be selected and labeled.
+
+    The recordings are given integer codes and the labels are looked up in a (recording x square) array, so no
+    merge is needed. df_squares is returned unchanged, together with a copy of df_tracks with the new labels; the
+    indexes of both are kept.
     """
-    # Merge the Label Nr column with df_tracks using 'Square Nr' and 'Ext Recording Name' as keys
-    df_squares.reset_index(drop=True, inplace=True)
-    df_tracks = df_tracks.merge(
-        df_squares[['Square Nr', 'Ext Recording Name', 'Label Nr']],
-        on=['Square Nr', 'Ext Recording Name'],
-        how='left',
-        suffixes=('', '_from_squares')  # Avoid '_x' and '_y', rename the merged Label Nr
-    )
-    df_tracks['Label Nr'] = df_tracks['Label Nr_from_squares']  # Use the merged Label Nr
-    df_tracks.drop(columns=['Label Nr_from_squares'], inplace=True)  # Remove the extra column
-    df_tracks.set_index('Unique Key', inplace=True, drop=True)
-    df_squares.set_index('Unique Key', inplace=True, drop=True)
+
+    # Integer codes for the recordings of the squares and the tracks
+    recording_codes, recording_names = pd.factorize(pd.concat(
+        [df_squares['Ext Recording Name'].astype(object), df_tracks['Ext Recording Name'].astype(object)],
+        ignore_index=True))
+    square_recording_codes = recording_codes[:len(df_squares)]
+    track_recording_codes = recording_codes[len(df_squares):]
+
+    # The label of every square, by recording and square number
+    square_nrs = df_squares['Square Nr'].to_numpy(dtype=int)
+    nr_square_nrs = square_nrs.max() + 1 if len(square_nrs) > 0 else 0
+    label_nrs = np.full((len(recording_names), nr_square_nrs), np.nan)
+    label_nrs[square_recording_codes, square_nrs] = df_squares['Label Nr'].to_numpy(dtype=float, na_value=np.nan)
+
+    # Look up the label of every track; tracks outside the squares get none
+    track_square_nrs = df_tracks['Square Nr'].to_numpy(dtype=float, na_value=np.nan)
+    in_square = ((track_recording_codes >= 0) & (track_square_nrs >= 0) & (track_square_nrs < nr_square_nrs))
+    track_label_nrs = np.full(len(df_tracks), np.nan)
+    track_label_nrs[in_square] = label_nrs[track_recording_codes[in_square], track_square_nrs[in_square].astype(int)]
+
+    df_tracks = df_tracks.copy()
+    df_tracks['Label Nr'] = track_label_nrs
     return df_squares, df_tracks
@@ -8,6 +8,7 @@ import pandas as pd
 from PIL import Image, ImageTk
 import tkinter as tk
 
+from src.Application.Support.Table_Schema import read_paint_table
 from src.Fiji.LoggerConfig import paint_logger
 
 pd.options.mode.copy_on_write = True
@@ -21,6 +22,20 @@ def save_squares_to_file(df_squares, square_file_path):
     df_squares.to_csv(square_file_path, index=False)
 
 
+def save_csv_atomically(df, file_path):
+    """
+    Write the dataframe to a temporary file next to file_path and then replace file_path with it, so that an
+    interrupted write never leaves a truncated file behind.
+    """
+    temp_file_path = file_path + '.tmp'
+    try:
+        df.to_csv(temp_file_path, index=False)
+        os.replace(temp_file_path, file_path)
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
 def read_experiment_file(experiment_file_path: str, only_records_to_process: bool = True) -> pd.DataFrame:
     """
     Create the process table by looking for records that were marked for processing
@@ -28,7 +43,7 @@ def read_experiment_file(experiment_file_path: str, only_records_to_process: boo
     """
 
     try:
-        df_experiment = pd.read_csv(experiment_file_path, header=0, skiprows=[])
+        df_experiment = read_paint_table(experiment_file_path, 'All Recordings')
     except IOError:
         return None
 
@@ -70,7 +85,7 @@ def correct_all_recordings_column_types(file_path):
 
 def read_squares_from_file(squares_file_path):
     try:
-        df_squares = pd.read_csv(squares_file_path, header=0, dtype={'Experiment Name': str})
+        df_squares = read_paint_table(squares_file_path, 'All Squares', dtype={'Experiment Name': str})
     except IOError:
         paint_logger.error(f'Read_squares from_file: file {squares_file_path} could not be opened.')
         exit(-1)
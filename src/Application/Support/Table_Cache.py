@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+import pandas as pd
+
+from src.Application.Support.Table_Sidecar import (
+    SIDECAR_EXTENSION,
+    get_csv_fingerprint,
+    read_table_sidecar,
+    write_table_sidecar)
+from src.Fiji.DirectoriesAndLocations import get_paint_cache_directory
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# The table cache keeps parsed tables in ~/Paint/Cache, for files that have no up to date sidecar next to them, for
+# instance because they are on a share that can not be written to.
+#
+# An entry is stored in the sidecar format and named after the path, size and modification time of the CSV, so a
+# changed file simply gets a new entry. Entries are touched when they are used and the least recently used entries
+# are removed when the cache grows beyond 'Table Cache Size MB'.
+# ----------------------------------------------------------------------------------------------------
+
+
+def get_table_cache_path(csv_path: str, csv_fingerprint: dict) -> str:
+    key = repr([os.path.realpath(csv_path), csv_fingerprint['Size'], csv_fingerprint['Modification Time']])
+    return os.path.join(get_paint_cache_directory(), hashlib.sha256(key.encode()).hexdigest() + SIDECAR_EXTENSION)
+
+
+def read_cached_table(csv_path: str) -> pd.DataFrame:
+    """
+    Returns the cached table of a CSV file, or None when the file, as it is now, is not in the cache.
+    """
+
+    cache_path = get_table_cache_path(csv_path, get_csv_fingerprint(csv_path))
+    if not os.path.exists(cache_path):
+        return None
+    df = read_table_sidecar(csv_path, cache_path)
+    if df is not None:
+        try:
+            os.utime(cache_path, None)  # Mark the entry as most recently used
+        except OSError:
+            pass
+    return df
+
+
+def write_cached_table(csv_path: str, df: pd.DataFrame, csv_fingerprint: dict) -> None:
+    cache_path = get_table_cache_path(csv_path, csv_fingerprint)
+    if write_table_sidecar(csv_path, df, csv_fingerprint, cache_path):
+        evict_cached_tables()
+
+
+def evict_cached_tables() -> None:
+    """
+    Remove the least recently used entries until the cache fits in its size budget.
+    """
+
+    cache_directory = get_paint_cache_directory()
+    budget = get_paint_attribute_with_default('Paint', 'Table Cache Size MB', 2000) * 1024 * 1024
+
+    entries = []
+    for file_name in os.listdir(cache_directory):
+        if file_name.endswith(SIDECAR_EXTENSION):
+            entry_stat = os.stat(os.path.join(cache_directory, file_name))
+            entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, file_name))
+
+    cache_size = sum(size for _, size, _ in entries)
+    for _, size, file_name in sorted(entries):
+        if cache_size <= budget:
+            break
+        try:
+            os.remove(os.path.join(cache_directory, file_name))
+            cache_size -= size
+            paint_logger.debug(f"Removed {file_name} from the table cache")
+        except OSError:
+            pass
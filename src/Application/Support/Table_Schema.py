@@ -0,0 +1,260 @@
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from src.Application.Support.Table_Cache import read_cached_table, write_cached_table
+from src.Application.Support.Table_Sidecar import get_csv_fingerprint, read_table_sidecar, write_table_sidecar
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# ----------------------------------------------------------------------------------------------------
+# The columns of the All Tracks, All Squares and All Recordings files and the kind of values they hold.
+#
+# read_paint_table reads a file with these types. By default the columns get the types pandas would infer, so a file
+# that is read and written again does not change. A stage that only analyses the data can ask for the compact types:
+# categories for repeating names, 32-bit numbers and only the columns it needs. Columns that are not in the schema
+# (added by users, for instance) are read as they are.
+# ----------------------------------------------------------------------------------------------------
+
+TEXT = 'Text'
+CATEGORY = 'Category'
+INTEGER = 'Integer'
+OPTIONAL_INTEGER = 'Optional Integer'  # An integer that may be missing, such as the square of a track
+FLOAT = 'Float'
+FLAG = 'Flag'
+
+# The types used by compact reading. Flags are left to pandas, because missing values are allowed there.
+COMPACT_TYPES = {
+    TEXT: str,
+    CATEGORY: 'category',
+    INTEGER: 'int32',
+    OPTIONAL_INTEGER: 'Int32',
+    FLOAT: 'float32'}
+
+ALL_TRACKS_SCHEMA = {
+    'Unique Key': TEXT,
+    'Ext Recording Name': CATEGORY,
+    'Track Id': INTEGER,
+    'Track Label': TEXT,
+    'Nr Spots': FLOAT,
+    'Nr Gaps': INTEGER,
+    'Longest Gap': INTEGER,
+    'Track Duration': FLOAT,
+    'Track X Location': FLOAT,
+    'Track Y Location': FLOAT,
+    'Track Displacement': FLOAT,
+    'Track Max Speed': FLOAT,
+    'Track Median Speed': FLOAT,
+    'Track Mean Speed': FLOAT,
+    'Track Max Speed Calc': FLOAT,
+    'Track Median Speed Calc': FLOAT,
+    'Track Mean Speed Calc': FLOAT,
+    'Diffusion Coefficient': FLOAT,
+    'Diffusion Coefficient Ext': FLOAT,
+    'Total Distance': FLOAT,
+    'Confinement Ratio': FLOAT,
+    'Square Nr': OPTIONAL_INTEGER,
+    'Label Nr': OPTIONAL_INTEGER}
+
+ALL_SQUARES_SCHEMA = {
+    'Unique Key': TEXT,
+    'Recording Sequence Nr': INTEGER,
+    'Ext Recording Name': CATEGORY,
+    'Experiment Name': TEXT,
+    'Experiment Date': TEXT,
+    'Condition Nr': INTEGER,
+    'Replicate Nr': INTEGER,
+    'Square Nr': INTEGER,
+    'Probe': CATEGORY,
+    'Probe Type': CATEGORY,
+    'Cell Type': CATEGORY,
+    'Adjuvant': CATEGORY,
+    'Concentration': FLOAT,
+    'Threshold': INTEGER,
+    'Row Nr': INTEGER,
+    'Col Nr': INTEGER,
+    'Label Nr': OPTIONAL_INTEGER,
+    'Cell Id': OPTIONAL_INTEGER,
+    'Nr Spots': INTEGER,
+    'Nr Tracks': INTEGER,
+    'X0': FLOAT,
+    'Y0': FLOAT,
+    'X1': FLOAT,
+    'Y1': FLOAT,
+    'Selected': FLAG,
+    'Variability': FLOAT,
+    'Density': FLOAT,
+    'Density Ratio': FLOAT,
+    'Tau': FLOAT,
+    'R Squared': FLOAT,
+    'Median Diffusion Coefficient': FLOAT,
+    'Mean Diffusion Coefficient': FLOAT,
+    'Median Diffusion Coefficient Ext': FLOAT,
+    'Mean Diffusion Coefficient Ext': FLOAT,
+    'Median Long Track Duration': FLOAT,
+    'Median Short Track Duration': FLOAT,
+    'Median Displacement': FLOAT,
+    'Max Displacement': FLOAT,
+    'Total Displacement': FLOAT,
+    'Median Max Speed': FLOAT,
+    'Max Max Speed': FLOAT,
+    'Median Mean Speed': FLOAT,
+    'Max Mean Speed': FLOAT,
+    'Max Track Duration': FLOAT,
+    'Total Track Duration': FLOAT,
+    'Median Track Duration': FLOAT,
+    'Square Manually Excluded': FLAG,
+    'Image Excluded': FLAG,
+    'Cluster Id': OPTIONAL_INTEGER,  # Only with the Cluster neighbour mode
+    'Cluster Size': OPTIONAL_INTEGER}
+
+ALL_RECORDINGS_SCHEMA = {
+    'Recording Sequence Nr': INTEGER,
+    'Recording Name': TEXT,
+    'Experiment Date': TEXT,
+    'Experiment Name': TEXT,
+    'Condition Nr': INTEGER,
+    'Replicate Nr': INTEGER,
+    'Probe': CATEGORY,
+    'Probe Type': CATEGORY,
+    'Cell Type': CATEGORY,
+    'Adjuvant': CATEGORY,
+    'Concentration': FLOAT,
+    'Threshold': INTEGER,
+    'Process': TEXT,
+    'Nr Spots': INTEGER,
+    'Nr Tracks': INTEGER,
+    'Run Time': FLOAT,
+    'Ext Recording Name': TEXT,
+    'Recording Size': INTEGER,
+    'Time Stamp': TEXT,
+    'Max Frame Gap': INTEGER,
+    'Gap Closing Max Distance': FLOAT,
+    'Linking Max Distance': FLOAT,
+    'Median Filtering': FLAG,
+    'Nr Spots in All Tracks': INTEGER,
+    'Min Tracks for Tau': OPTIONAL_INTEGER,
+    'Min Required R Squared': FLOAT,
+    'Nr of Squares in Row': OPTIONAL_INTEGER,
+    'Max Allowable Variability': FLOAT,
+    'Min Required Density Ratio': FLOAT,
+    'Exclude': FLAG,
+    'Neighbour Mode': CATEGORY,
+    'Tau': FLOAT,
+    'Density': FLOAT,
+    'R Squared': FLOAT}
+
+SCHEMAS = {
+    'All Tracks': ALL_TRACKS_SCHEMA,
+    'All Squares': ALL_SQUARES_SCHEMA,
+    'All Recordings': ALL_RECORDINGS_SCHEMA}
+
+
+def read_paint_table(
+        file_path: str,
+        table_name: str,
+        columns: list = None,
+        optional_columns: list = None,
+        compact: bool = False,
+        **read_csv_arguments) -> pd.DataFrame:
+    """
+    Read an All Tracks, All Squares or All Recordings file (table_name without '.csv') and check the column types.
+    Only the listed columns are read when columns is given, together with those of optional_columns that the file
+    has. With compact, the columns get the compact types of the schema. Any other arguments, such as dtype, are
+    passed on to pd.read_csv and take precedence.
+    When switched on in Paint.json and unless other arguments are given, the binary sidecar of the file is read when
+    it is up to date (see Table_Sidecar), and written when it is not. Files without a sidecar go through the table
+    cache (see Table_Cache), when that is switched on.
+    Raises a ValueError when a requested column is missing or a column does not hold the values of its type.
+    """
+
+    schema = SCHEMAS[table_name]
+
+    use_sidecar = get_paint_attribute_with_default('Paint', 'Binary Sidecar Files', False)
+    use_cache = get_paint_attribute_with_default('Paint', 'Table Cache', False)
+    if not read_csv_arguments and (use_sidecar or use_cache):
+        df = read_table_sidecar(file_path) if use_sidecar else None
+        if df is None and use_cache:
+            df = read_cached_table(file_path)
+        if df is None:
+            csv_fingerprint = get_csv_fingerprint(file_path)
+            df = pd.read_csv(file_path)
+            if not (use_sidecar and write_table_sidecar(file_path, df, csv_fingerprint)) and use_cache:
+                write_cached_table(file_path, df, csv_fingerprint)
+        if columns is not None:
+            df = df[get_columns_to_read(df.columns, columns, optional_columns, file_path)]
+        if compact:
+            df = apply_compact_types(df, schema, file_path)
+        check_column_types(df, schema, file_path)
+        return df
+
+    if columns is not None:
+        available_columns = pd.read_csv(file_path, nrows=0).columns
+        columns = get_columns_to_read(available_columns, columns, optional_columns, file_path)
+        read_csv_arguments['usecols'] = columns
+
+    if compact:
+        dtype = {column: COMPACT_TYPES[kind] for column, kind in schema.items()
+                 if kind in COMPACT_TYPES and (columns is None or column in columns)}
+        dtype.update(read_csv_arguments.get('dtype', {}))
+        read_csv_arguments['dtype'] = dtype
+
+    try:
+        df = pd.read_csv(file_path, **read_csv_arguments)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"The columns of {file_path} do not have the expected types: {e}")
+
+    check_column_types(df, schema, file_path)
+    return df
+
+
+def read_paint_table_in_chunks(file_path: str, table_name: str, nr_rows_in_chunk: int):
+    """
+    Read a file that is too large to read at once in chunks of nr_rows_in_chunk rows and check the column types of
+    every chunk. The float columns of the schema are read as floats in every chunk, so that a chunk does not get
+    integers where the whole file would not.
+    """
+
+    schema = SCHEMAS[table_name]
+    dtype = {column: 'float64' for column, kind in schema.items() if kind == FLOAT}
+    with pd.read_csv(file_path, chunksize=nr_rows_in_chunk, dtype=dtype) as reader:
+        for df_chunk in reader:
+            check_column_types(df_chunk, schema, file_path)
+            yield df_chunk
+
+
+def get_columns_to_read(available_columns, columns: list, optional_columns: list, file_path: str) -> list:
+    missing_columns = [column for column in columns if column not in available_columns]
+    if missing_columns:
+        raise ValueError(f"Column(s) {', '.join(missing_columns)} not found in {file_path}")
+    return columns + [column for column in optional_columns or [] if column in available_columns]
+
+
+def apply_compact_types(df: pd.DataFrame, schema: dict, file_path: str) -> pd.DataFrame:
+    """
+    Give the columns of a table that was read with the inferred types the compact types of the schema.
+    """
+
+    dtype = {column: COMPACT_TYPES[kind] for column, kind in schema.items()
+             if kind in COMPACT_TYPES and column in df.columns}
+    try:
+        for column, column_type in dtype.items():
+            if column_type is str:
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+            else:
+                df[column] = df[column].astype(column_type)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"The columns of {file_path} do not have the expected types: {e}")
+    return df
+
+
+def check_column_types(df: pd.DataFrame, schema: dict, file_path: str) -> None:
+    for column, kind in schema.items():
+        if column not in df.columns or df[column].isna().all():
+            continue
+        if kind in (INTEGER, OPTIONAL_INTEGER, FLOAT):
+            valid = is_numeric_dtype(df[column]) and not is_bool_dtype(df[column])
+        elif kind == FLAG:
+            valid = is_bool_dtype(df[column]) or df[column].dropna().isin([True, False]).all()
+        else:
+            valid = True
+        if not valid:
+            raise ValueError(f"Column '{column}' in {file_path} does not hold {kind.lower()} values")
@@ -0,0 +1,148 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from src.Fiji.LoggerConfig import paint_logger
+
+# ----------------------------------------------------------------------------------------------------
+# A sidecar is a binary, column by column copy of a CSV file as pandas reads it, stored next to it as a .npz file
+# (e.g. 'All Tracks.npz' next to 'All Tracks.csv'). Loading the arrays is much faster than parsing the CSV.
+#
+# The CSV files remain the files that are exchanged and written; a sidecar is only a faster way to read them. It
+# records the size and modification time of the CSV it was made from and is ignored as soon as the CSV changes.
+# ----------------------------------------------------------------------------------------------------
+
+SIDECAR_EXTENSION = '.npz'
+
+# How the values of a column are stored
+NUMBERS = 'Numbers'  # Any numpy numeric or boolean column
+TEXT = 'Text'  # Strings, with missing values
+FLAGS = 'Flags'  # True and False, with missing values
+
+
+def get_sidecar_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + SIDECAR_EXTENSION
+
+
+def get_csv_fingerprint(csv_path: str) -> dict:
+    csv_stat = os.stat(csv_path)
+    return {'Size': csv_stat.st_size, 'Modification Time': csv_stat.st_mtime_ns}
+
+
+def encode_table_columns(df: pd.DataFrame, key_prefix: str = '') -> tuple:
+    """
+    Convert the columns of a DataFrame to arrays that np.savez can store without pickling. The keys of the arrays
+    start with key_prefix, so that several tables can be stored in one file.
+    Returns the description of the columns and the arrays. Raises a ValueError when a column can not be stored.
+    """
+
+    arrays = {}
+    columns = []
+    for column_nr, column in enumerate(df.columns):
+        values = df[column]
+        key = f"{key_prefix}Column {column_nr}"
+        if (is_numeric_dtype(values) or is_bool_dtype(values)) and isinstance(values.dtype, np.dtype):
+            columns.append([column, NUMBERS])
+            arrays[key] = values.to_numpy()
+            continue
+
+        missing = values.isna().to_numpy()
+        present = values[~missing]
+        if present.map(type).eq(str).all():
+            # The distinct strings are stored once, as UTF-8 separated by NUL characters, with a code for every row
+            columns.append([column, TEXT])
+            codes, distinct_values = pd.factorize(values)
+            joined_values = '\0'.join(distinct_values)
+            if joined_values.count('\0') != max(len(distinct_values) - 1, 0):
+                raise ValueError(f"column '{column}' holds NUL characters")
+            arrays[key] = np.frombuffer(joined_values.encode('utf-8'), dtype=np.uint8)
+            arrays[key + ' Codes'] = codes.astype(np.int32)
+        elif present.map(type).isin([bool, np.bool_]).all():
+            columns.append([column, FLAGS])
+            arrays[key] = np.where(missing, False, values.to_numpy(dtype=object)).astype(bool)
+            arrays[key + ' Missing'] = missing
+        else:
+            raise ValueError(f"column '{column}' has mixed values")
+
+    return columns, arrays
+
+
+def decode_table_columns(arrays, columns: list, key_prefix: str = '') -> dict:
+    """
+    The values of the columns stored by encode_table_columns, by column name.
+    """
+
+    data = {}
+    for column_nr, (column, kind) in enumerate(columns):
+        key = f"{key_prefix}Column {column_nr}"
+        if kind == NUMBERS:
+            data[column] = arrays[key]
+        elif kind == TEXT:
+            codes = arrays[key + ' Codes']
+            distinct_values = arrays[key].tobytes().decode('utf-8').split('\0') if len(codes) > 0 else []
+            values = np.array(distinct_values + [np.nan], dtype=object)
+            data[column] = values[codes]  # Code -1 (missing) picks the NaN at the end
+        else:
+            values = arrays[key].astype(object)
+            values[arrays[key + ' Missing']] = np.nan
+            data[column] = values
+    return data
+
+
+def write_table_sidecar(csv_path: str, df: pd.DataFrame, csv_fingerprint: dict, sidecar_path: str = None) -> bool:
+    """
+    Write the sidecar of a CSV file from the DataFrame that was read from it, with the fingerprint the CSV had
+    before it was read. The sidecar is stored next to the CSV, unless another sidecar_path is given.
+    Nothing is written when a column holds values that a sidecar can not store.
+    """
+
+    try:
+        columns, arrays = encode_table_columns(df)
+    except ValueError as e:
+        paint_logger.debug(f"No sidecar written for {csv_path}: {e}")
+        return False
+
+    description = {'Source': csv_fingerprint, 'Columns': columns, 'Nr Rows': len(df)}
+    arrays['Description'] = np.array(json.dumps(description))
+
+    if sidecar_path is None:
+        sidecar_path = get_sidecar_path(csv_path)
+    temp_path = sidecar_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as sidecar_file:
+            np.savez(sidecar_file, **arrays)
+        os.replace(temp_path, sidecar_path)
+    except OSError as e:
+        paint_logger.debug(f"No sidecar written for {csv_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def read_table_sidecar(csv_path: str, sidecar_path: str = None) -> pd.DataFrame:
+    """
+    Read the sidecar of a CSV file, from next to the CSV unless another sidecar_path is given. Returns None when there
+    is no sidecar or when it was made from another version of the CSV.
+    """
+
+    if sidecar_path is None:
+        sidecar_path = get_sidecar_path(csv_path)
+    if not os.path.exists(sidecar_path) or not os.path.exists(csv_path):
+        return None
+
+    try:
+        with np.load(sidecar_path, allow_pickle=False) as arrays:
+            description = json.loads(str(arrays['Description']))
+            if description['Source'] != get_csv_fingerprint(csv_path):
+                return None
+
+            data = decode_table_columns(arrays, description['Columns'])
+    except (OSError, ValueError, KeyError) as e:
+        paint_logger.debug(f"The sidecar {sidecar_path} could not be read and is ignored: {e}")
+        return None
+
+    return pd.DataFrame(data, index=pd.RangeIndex(description['Nr Rows']))
@@ -0,0 +1,199 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+from src.Application.Support.Table_Schema import read_paint_table
+from src.Application.Support.Table_Sidecar import get_csv_fingerprint
+from src.Fiji.LoggerConfig import paint_logger
+
+# ----------------------------------------------------------------------------------------------------
+# A track store is a copy of an All Tracks file that is made for fetching the tracks of one Recording or one square,
+# stored in a directory next to the file ('All Tracks Store' next to 'All Tracks.csv').
+#
+# The tracks are sorted by Recording and Square Nr, and every column is a separate .npy file that is memory-mapped,
+# so only the rows that are asked for are read from disk. A small index holds the first and last row of every
+# Recording and of every square in a Recording. Text columns are stored as fixed width UTF-8 bytes, with a mask of the
+# missing values when there are any.
+#
+# As with the sidecars, the store records the size and modification time of the CSV and is rebuilt when it changed.
+# ----------------------------------------------------------------------------------------------------
+
+STORE_INDEX_FILE = 'Index.json'
+
+# How the values of a column are stored
+NUMBERS = 'Numbers'
+TEXT = 'Text'
+TEXT_WITH_MISSING = 'Text With Missing'  # Missing values are stored as empty text and marked in a mask
+
+
+def get_track_store_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ' Store'
+
+
+def open_track_store(csv_path: str):
+    """
+    Open the track store of an All Tracks file, after (re)building it when it is missing or out of date.
+    """
+
+    store_path = get_track_store_path(csv_path)
+    if not track_store_is_up_to_date(csv_path, store_path):
+        write_track_store(csv_path)
+    return TrackStore(store_path)
+
+
+def track_store_is_up_to_date(csv_path: str, store_path: str) -> bool:
+    try:
+        with open(os.path.join(store_path, STORE_INDEX_FILE)) as index_file:
+            return json.load(index_file)['Source'] == get_csv_fingerprint(csv_path)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def write_track_store(csv_path: str) -> None:
+    """
+    Build the track store of an All Tracks file. Raises a ValueError when a column can not be stored.
+    """
+
+    csv_fingerprint = get_csv_fingerprint(csv_path)
+    df_tracks = read_paint_table(csv_path, 'All Tracks')
+    store_path = get_track_store_path(csv_path)
+    os.makedirs(store_path, exist_ok=True)
+
+    # The index goes first, so that a store that is being rewritten is never taken for up to date
+    index_path = os.path.join(store_path, STORE_INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    # Sort the tracks by Recording, in the order they appear in, and by square, with the tracks outside squares last
+    recording_codes, recording_names = pd.factorize(df_tracks['Ext Recording Name'], sort=False)
+    if 'Square Nr' in df_tracks.columns:
+        square_nrs = pd.to_numeric(df_tracks['Square Nr']).to_numpy(dtype=float, na_value=np.nan)
+    else:
+        square_nrs = np.full(len(df_tracks), np.nan)
+    square_keys = np.where(np.isnan(square_nrs), np.inf, square_nrs)
+    order = np.lexsort((square_keys, recording_codes))
+    recording_codes = recording_codes[order]
+    square_keys = square_keys[order]
+
+    # The rows of every (Recording, square) group; groups of tracks outside squares are not indexed
+    group_changes = np.ones(len(order), dtype=bool)
+    group_changes[1:] = (recording_codes[1:] != recording_codes[:-1]) | (square_keys[1:] != square_keys[:-1])
+    group_starts = np.flatnonzero(group_changes)
+    group_stops = np.append(group_starts[1:], len(order))
+    in_square = np.isfinite(square_keys[group_starts])
+    group_starts, group_stops = group_starts[in_square], group_stops[in_square]
+    group_recording_codes = recording_codes[group_starts]
+
+    arrays = {
+        'Recording Offsets': np.searchsorted(recording_codes, np.arange(len(recording_names) + 1)),
+        'Square Group Offsets': np.searchsorted(group_recording_codes, np.arange(len(recording_names) + 1)),
+        'Square Nrs': square_keys[group_starts].astype(np.int64),
+        'Square Starts': group_starts,
+        'Square Stops': group_stops}
+
+    columns = []
+    for column_nr, column in enumerate(df_tracks.columns):
+        values = df_tracks[column].to_numpy()[order]
+        if is_numeric_dtype(values) and not is_bool_dtype(values):
+            columns.append([column, NUMBERS])
+            arrays[f"Column {column_nr}"] = values
+        elif pd.Series(values).map(type).eq(str).all():
+            columns.append([column, TEXT])
+            arrays[f"Column {column_nr}"] = np.char.encode(values.astype(str), 'utf-8')
+        elif pd.Series(values).map(type).eq(str).where(~pd.isna(values), True).all():
+            missing = pd.isna(values)
+            columns.append([column, TEXT_WITH_MISSING])
+            arrays[f"Column {column_nr}"] = np.char.encode(np.where(missing, '', values).astype(str), 'utf-8')
+            arrays[f"Column {column_nr} Missing"] = missing
+        else:
+            raise ValueError(f"Column '{column}' of {csv_path} can not be stored in a track store")
+
+    for name, array in arrays.items():
+        array_path = os.path.join(store_path, name + '.npy')
+        np.save(array_path + '.tmp.npy', array)
+        os.replace(array_path + '.tmp.npy', array_path)
+
+    index = {
+        'Source': csv_fingerprint,
+        'Columns': columns,
+        'Recording Names': list(recording_names),
+        'Nr Rows': len(df_tracks)}
+    with open(index_path + '.tmp', 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(index_path + '.tmp', index_path)
+    paint_logger.debug(f"Track store written for {csv_path}")
+
+
+class TrackStore:
+    """
+    The tracks of a track store, fetched by Recording or by square. Fetching takes time in proportion to the number
+    of tracks returned.
+    """
+
+    def __init__(self, store_path: str):
+        with open(os.path.join(store_path, STORE_INDEX_FILE)) as index_file:
+            index = json.load(index_file)
+
+        def load(name):
+            return np.load(os.path.join(store_path, name + '.npy'), mmap_mode='r', allow_pickle=False)
+
+        self.recording_names = index['Recording Names']
+        self.recording_codes = {name: code for code, name in enumerate(self.recording_names)}
+        self.recording_offsets = load('Recording Offsets')
+        self.square_group_offsets = load('Square Group Offsets')
+        self.square_nrs = load('Square Nrs')
+        self.square_starts = load('Square Starts')
+        self.square_stops = load('Square Stops')
+        self.column_kinds = {column: kind for column, kind in index['Columns']}
+        self.column_values = {column: load(f"Column {column_nr}")
+                              for column_nr, (column, _) in enumerate(index['Columns'])}
+        self.column_missing = {column: load(f"Column {column_nr} Missing")
+                               for column_nr, (column, kind) in enumerate(index['Columns'])
+                               if kind == TEXT_WITH_MISSING}
+
+    def get_rows_of_recording(self, recording_name: str) -> tuple:
+        code = self.recording_codes.get(recording_name)
+        if code is None:
+            return 0, 0
+        return int(self.recording_offsets[code]), int(self.recording_offsets[code + 1])
+
+    def get_rows_of_square(self, recording_name: str, square_nr: int) -> tuple:
+        code = self.recording_codes.get(recording_name)
+        if code is None:
+            return 0, 0
+        first_group, last_group = self.square_group_offsets[code], self.square_group_offsets[code + 1]
+        group = first_group + np.searchsorted(self.square_nrs[first_group:last_group], square_nr)
+        if group == last_group or self.square_nrs[group] != square_nr:
+            return 0, 0
+        return int(self.square_starts[group]), int(self.square_stops[group])
+
+    def get_track_columns(self, start: int, stop: int, columns: list = None) -> dict:
+        """
+        The values of rows start to stop of the columns, as read-only arrays backed by the store. Text columns are
+        returned as UTF-8 bytes, with missing values as empty bytes.
+        """
+
+        if columns is None:
+            columns = list(self.column_values)
+        return {column: self.column_values[column][start:stop] for column in columns}
+
+    def get_tracks(self, start: int, stop: int, columns: list = None) -> pd.DataFrame:
+        data = {}
+        for column, values in self.get_track_columns(start, stop, columns).items():
+            if self.column_kinds[column] == TEXT:
+                data[column] = np.char.decode(values, 'utf-8').astype(object)
+            elif self.column_kinds[column] == TEXT_WITH_MISSING:
+                data[column] = np.char.decode(values, 'utf-8').astype(object)
+                data[column][self.column_missing[column][start:stop]] = np.nan
+            else:
+                data[column] = np.array(values)
+        return pd.DataFrame(data, index=pd.RangeIndex(stop - start))
+
+    def get_tracks_of_recording(self, recording_name: str, columns: list = None) -> pd.DataFrame:
+        return self.get_tracks(*self.get_rows_of_recording(recording_name), columns)
+
+    def get_tracks_of_square(self, recording_name: str, square_nr: int, columns: list = None) -> pd.DataFrame:
+        return self.get_tracks(*self.get_rows_of_square(recording_name, square_nr), columns)
@@ -59,6 +59,14 @@ def get_paint_logger_directory():
     return os.path.join(_get_paint_configuration_directory(sub_dir), sub_dir)
 
 
+def get_paint_cache_directory():
+    sub_dir = 'Cache'
+    cache_dir = os.path.join(_get_paint_configuration_directory(sub_dir), sub_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
 def delete_files_in_directory(directory_path):
     """
     Delete all files in the specified directory.
@@ -9,6 +9,11 @@ CRITICAL = logging.CRITICAL
 
 paint_logger_file_name_assigned = False
 
+# In a worker process of a parallel run, the parent process owns the log files. A worker must not create (and thereby
+# truncate) them; its messages are collected and written out by the parent.
+PAINT_WORKER_ENVIRONMENT_VARIABLE = 'PAINT_LOGGER_WORKER'
+paint_logger_in_worker = os.environ.get(PAINT_WORKER_ENVIRONMENT_VARIABLE) == '1'
+
 # ----------------------------------------------------------
 # Set up the logging
 # ----------------------------------------------------------
@@ -33,8 +38,11 @@ console_handler.setFormatter(formatter)
 log_directory = os.path.join(os.path.expanduser('~'), 'Paint', 'Logger')
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
-file_handler = logging.FileHandler(os.path.join(os.path.expanduser('~'), 'Paint', 'Logger', 'paint.log'),
-                                   mode='w')  # Logs to a file   #ToDo
+if paint_logger_in_worker:
+    file_handler = logging.NullHandler()
+else:
+    file_handler = logging.FileHandler(os.path.join(os.path.expanduser('~'), 'Paint', 'Logger', 'paint.log'),
+                                       mode='w')  # Logs to a file   #ToDo
 file_handler.setLevel(logging.INFO)  # All logs at INFO level or higher go to the console
 file_handler.setFormatter(formatter)
 
@@ -84,6 +92,10 @@ def paint_logger_change_file_handler_name(file_name):
     global file_handler
     global paint_logger_file_name_assigned
 
+    if paint_logger_in_worker:
+        paint_logger_file_name_assigned = True
+        return
+
     paint_logger.removeHandler(file_handler)
 
     file_handler = logging.FileHandler(os.path.join(get_paint_logger_directory(), file_name), mode='w')  # Logs to a file
@@ -1,6 +1,9 @@
 import json
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
 
 def get_paint_defaults_file_path():  # ToDo
     return os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults', 'Paint.json')
@@ -27,7 +30,10 @@ default_data = {
     "Paint": {
         "Version": "1.0",
         "Image File Extension": ".nd2",
-        "Fiji Path": "/Applications/Fiji.app"
+        "Fiji Path": "/Applications/Fiji.app",
+        "Binary Sidecar Files": False,
+        "Table Cache": False,
+        "Table Cache Size MB": 2000
     },
     "User Directories": {
         "Project Directory": "~",
@@ -41,6 +47,8 @@ default_data = {
         "Fraction of Squares to Determine Background": 0.1,
         "Exclude zero DC tracks from Tau Calculation": False,
         "Neighbour Mode": "Free",
+        "Cluster Connectivity": 8,
+        "Min Cluster Size": 3,
         "Min Track Duration": 0,
         "Max Track Duration": 1000000,
         "Nr of Squares in Row": 20,
@@ -48,6 +56,15 @@ default_data = {
         'Min Required R Squared': 0.9,
         "Min Required Density Ratio": 2.0,
         "Max Allowable Variability": 10.0,
+        # 'Curve Fit', 'Batched Curve Fit' or 'Maximum Likelihood'. With 'Maximum Likelihood', the R Squared measures
+        # the fit of the survival curve instead of the histogram and is compared with the same Min Required R Squared,
+        # so other squares can pass. Review Min Required R Squared when switching to or from it.
+        "Tau Fit Mode": "Curve Fit",
+        "Nr of Workers": 1,
+        "Nr of Recording Workers": 1,
+        "Cache Square Statistics": True,
+        "Stream Tracks": False,
+        "Nr of Tracks in Chunk": 100000,
 
         "logging": {
             "level": "INFO",
@@ -125,14 +142,179 @@ def load_paint_config(file_path):
         return None
 
 
+class PaintConfiguration(object):
+    """
+    A process-wide, in-memory copy of Paint.json.
+
+    The file is read once and lookups are served from memory. The file is only read again when its modification
+    time or size changes, so edits made by hand or by another process are still picked up.
+
+    Updates are applied in memory immediately and written back to the file in one go. Within a batch_updates()
+    block, all updates are written back together when the block ends. Writing back takes a lock file, merges the
+    updates into the current contents of the file and replaces the file atomically, so parallel workers neither
+    read a half-written file nor lose each other's updates.
+    """
+
+    LOCK_TIMEOUT = 10  # Seconds to wait for the lock file before giving up
+    LOCK_STALE = 60  # A lock file older than this is left over from a crashed process and is removed
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._config = None
+        self._file_stamp = None
+        self._pending_updates = []
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+    def _get_file_stamp(self):
+        try:
+            file_stat = os.stat(self.file_path)
+            return file_stat.st_mtime, file_stat.st_size
+        except OSError:
+            return None
+
+    def get_config(self):
+        """
+        Return the configuration, reading the file only if it was not read before or has changed since.
+        """
+        with self._lock:
+            file_stamp = self._get_file_stamp()
+            if self._config is None or file_stamp is None or file_stamp != self._file_stamp:
+                config = load_paint_config(self.file_path)
+                if config is None:
+                    return None
+                self._config = config
+                self._file_stamp = self._get_file_stamp()
+
+                # Updates that have not been written yet still apply
+                for application, attribute_name, value in self._pending_updates:
+                    if application in self._config:
+                        self._config[application][attribute_name] = value
+            return self._config
+
+    def update(self, application, attribute_name, value):
+        with self._lock:
+            config = self.get_config()
+            if config is None:
+                return
+            if application not in config:
+                paint_logger.error("The '{}' section does not exist in the config file.".format(application))
+                return
+            config[application][attribute_name] = value
+            self._pending_updates.append((application, attribute_name, value))
+            if self._batch_depth == 0:
+                self.flush()
+
+    @contextmanager
+    def batch_updates(self):
+        """
+        Collect the updates made in the block and write them back to the file once, at the end of the block.
+        """
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self.flush()
+
+    def flush(self):
+        """
+        Write the pending updates back to the file.
+        """
+        with self._lock:
+            if not self._pending_updates:
+                return
+            if not self._acquire_file_lock():
+                paint_logger.error("Could not lock the config file {}, changes not saved.".format(self.file_path))
+                return
+            try:
+                # Merge the updates into what is on disk now, another process may have changed the file
+                config = load_paint_config(self.file_path)
+                if config is None:
+                    return
+                for application, attribute_name, value in self._pending_updates:
+                    if application in config:
+                        config[application][attribute_name] = value
+
+                # Write to a temporary file first and then replace the config file in one step
+                temp_file_path = "{}.{}.tmp".format(self.file_path, os.getpid())
+                with open(temp_file_path, "w") as file:
+                    json.dump(config, file, indent=4)
+                    file.flush()
+                    os.fsync(file.fileno())
+                _replace_file(temp_file_path, self.file_path)
+
+                self._config = config
+                self._file_stamp = self._get_file_stamp()
+                self._pending_updates = []
+            except Exception as e:
+                paint_logger.error("An unexpected error occurred while saving the config file: {}".format(str(e)))
+            finally:
+                self._release_file_lock()
+
+    def _lock_file_path(self):
+        return self.file_path + '.lock'
+
+    def _acquire_file_lock(self):
+        deadline = time.time() + self.LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(self._lock_file_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return True
+            except OSError:
+                try:
+                    if time.time() - os.path.getmtime(self._lock_file_path()) > self.LOCK_STALE:
+                        os.remove(self._lock_file_path())
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    return False
+                time.sleep(0.05)
+
+    def _release_file_lock(self):
+        try:
+            os.remove(self._lock_file_path())
+        except OSError:
+            pass
+
+
+def _replace_file(source_path, target_path):
+    try:
+        os.replace(source_path, target_path)
+    except AttributeError:  # Jython (Python 2.7) has no os.replace
+        if os.path.exists(target_path) and os.name == 'nt':
+            os.remove(target_path)
+        os.rename(source_path, target_path)
+
+
+_paint_configurations = {}
+_paint_configurations_lock = threading.Lock()
+
+
+def get_paint_configuration(file_path=None):
+    """
+    Return the process-wide PaintConfiguration for the file (by default the Paint.json in the Defaults directory).
+    """
+    if file_path is None:
+        file_path = get_paint_defaults_file_path()
+    with _paint_configurations_lock:
+        if file_path not in _paint_configurations:
+            _paint_configurations[file_path] = PaintConfiguration(file_path)
+        return _paint_configurations[file_path]
+
+
 def get_paint_attribute_with_default(application, attribute_name, default_value):
-    config = load_paint_config(get_paint_defaults_file_path())
+    config = get_paint_configuration().get_config()
     if config is None:
         paint_logger.error("Error: Configuration file {} not found.".format(get_paint_defaults_file_path()))
         return None
     else:
-        application = config.get(application)
-        value = application.get(attribute_name, None)
+        value = config.get(application, {}).get(attribute_name, None)
         if value is None:
             paint_logger.error("Info: Attribute {} not found in configuration file {}.".format(attribute_name,
                                                                                                 get_paint_defaults_file_path()))
@@ -150,22 +332,16 @@ def get_paint_attribute_with_default(application, attribute_name, default_value)
 
 
 def update_paint_attribute(application, attribute_name, value):
-    try:
-        # Load the current configuration
-        config = load_paint_config(get_paint_defaults_file_path())  # Ensure these functions are defined
-        if application in config:
-            # Check if the attribute exists, if not, create it
-            config[application][attribute_name] = value
-        else:
-            paint_logger.error("The '{}' section does not exist in the config file.".format(application))
-            return
+    """
+    Update an attribute in Paint.json. Inside a paint_config_batch_updates() block the file is written once,
+    at the end of the block.
+    """
+    get_paint_configuration().update(application, attribute_name, value)
+
 
-        # Save the updated configuration back to the file
-        with open(get_paint_defaults_file_path(), "w") as file:
-            json.dump(config, file, indent=4)
+def paint_config_batch_updates():
+    return get_paint_configuration().batch_updates()
 
-    except Exception as e:
-        paint_logger.error("An unexpected error occurred while saving the config file: {}".format(str(e)))
 
 if __name__ == '__main__':
     config = load_paint_config(os.path.join(os.path.expanduser('~'), 'Paint', 'Defaults', 'paint.json'))
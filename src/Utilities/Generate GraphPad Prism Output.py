@@ -1,6 +1,9 @@
-import pandas as pd
 import os
 
+import pandas as pd
+
+from src.Application.Support.Table_Schema import read_paint_table
+
 
 def tau_for_cell_type_and_adjuvant(df, cell_type, adjuvant):
 
@@ -58,14 +61,13 @@ def tau_for_probe_and_adjuvant(df, probe, adjuvant):
     return df_pivot_table
 
 
-def main():
-    # File path for input and output
-    input_file = '/Users/hans/Paint Demo Set/Paint Demo/All Squares.csv'
-    output_file = '/Users/Hans/Downloads/graphpad_table_with_keys.xlsx'
+def main(input_file='/Users/hans/Paint Demo Set/Paint Demo/All Squares.csv',
+         output_file='/Users/Hans/Downloads/graphpad_table_with_keys.xlsx'):
 
-    # Load CSV file
+    # Load CSV file, only the columns that are pivoted and with compact types, as the squares are only analysed
     try:
-        df = pd.read_csv(input_file)
+        df = read_paint_table(input_file, 'All Squares',
+                              columns=['Unique Key', 'Cell Type', 'Probe', 'Adjuvant', 'Tau'], compact=True)
     except FileNotFoundError:
         print(f"File not found: {input_file}")
         exit()
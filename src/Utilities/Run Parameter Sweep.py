@@ -0,0 +1,75 @@
+import os
+import sys
+from tkinter import Tk, filedialog
+
+from src.Application.Generate_Squares.Parameter_Sweep import (
+    evaluate_parameter_sweep,
+    PARAMETER_SWEEP_SQUARE_COLUMNS,
+    PARAMETER_SWEEP_TRACK_COLUMNS)
+from src.Application.Support.Table_Schema import read_paint_table
+from src.Fiji.LoggerConfig import paint_logger
+from src.Fiji.NewPaintConfig import get_paint_attribute_with_default
+
+# The values that are tried for each of the selection parameters
+PARAMETER_GRID = {
+    'min_required_density_ratio': [1.5, 2, 5, 10],
+    'max_allowable_variability': [5, 10, 100],
+    'min_track_duration': [0],
+    'max_track_duration': [1000000],
+    'min_required_r_squared': [0.5, 0.9],
+    'neighbour_mode': ['Free', 'Strict', 'Relaxed']}
+
+
+def run_parameter_sweep(directory, parameter_grid, min_tracks_for_tau=None, min_required_r_squared=None):
+    """
+    Evaluates the Recording Tau, R squared and Density for all combinations of selection parameters, using the
+    All Squares and All Tracks files of an Experiment or Project that has been processed with Generate Squares.
+    The result is written to 'Parameter Sweep.csv' in the same directory.
+    """
+
+    if min_tracks_for_tau is None:
+        min_tracks_for_tau = get_paint_attribute_with_default('Generate Squares', 'Min Tracks to Calculate Tau', 20)
+    if min_required_r_squared is None:
+        min_required_r_squared = get_paint_attribute_with_default('Generate Squares', 'Min Required R Squared', 0.9)
+
+    paint_logger.info(f"Running parameter sweep on {directory}")
+
+    # Read only the columns that are needed, with the values exactly as written, so that the selection boundaries
+    # are the same as in Generate Squares
+    paint_logger.info("Reading All Squares")
+    df_squares = read_paint_table(os.path.join(directory, 'All Squares.csv'), 'All Squares',
+                                  columns=PARAMETER_SWEEP_SQUARE_COLUMNS, optional_columns=['Square Manually Excluded'],
+                                  float_precision='round_trip')
+    paint_logger.info("Reading All Tracks")
+    df_tracks = read_paint_table(os.path.join(directory, 'All Tracks.csv'), 'All Tracks',
+                                 columns=PARAMETER_SWEEP_TRACK_COLUMNS, float_precision='round_trip')
+
+    df_sweep = evaluate_parameter_sweep(df_squares, df_tracks, parameter_grid, min_tracks_for_tau,
+                                        min_required_r_squared)
+    df_sweep.to_csv(os.path.join(directory, 'Parameter Sweep.csv'), index=False)
+
+    paint_logger.info(f"Evaluated {len(df_sweep)} Recording and parameter combinations, written to 'Parameter Sweep.csv'")
+
+
+def ask_sweep_directory():
+    """
+    Ask for the Experiment or Project directory, starting from the Project Directory of the Paint configuration.
+    """
+
+    root = Tk()
+    root.withdraw()
+    project_directory = get_paint_attribute_with_default('User Directories', 'Project Directory', '~')
+    directory = filedialog.askdirectory(initialdir=os.path.expanduser(project_directory))
+    root.destroy()
+    return directory
+
+
+if __name__ == "__main__":
+    # The directory is given on the command line or selected in a dialog
+    sweep_directory = sys.argv[1] if len(sys.argv) > 1 else ask_sweep_directory()
+    if not sweep_directory:
+        paint_logger.info("No directory selected, parameter sweep not run")
+    elif not os.path.isdir(sweep_directory):
+        paint_logger.error(f"{sweep_directory} is not a directory")
+    else:
+        run_parameter_sweep(sweep_directory, PARAMETER_GRID)
@@ -8,6 +8,7 @@ from datetime import datetime
 from src.Application.Compile_Project.Compile_Project import compile_project_output
 from src.Application.Compile_Project.Copy_TM_Data_From_Source import copy_tm_data_from_paint_source_with_images
 from src.Application.Generate_Squares.Generate_Squares import process_project
+from src.Application.Generate_Squares.Generate_Squares_Manifest import get_generate_squares_parameters
 from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
 from src.Application.Support.General_Support_Functions import (
     format_time_nicely,
@@ -72,8 +73,12 @@ def process_json_configuration_block(paint_source_dir,
         paint_logger.info(f"Paint Data directory {project_path} does not exist, directory created.")
         os.makedirs(project_path)
 
-    # Copy the data from Paint Source to the appropriate directory in Paint Data
-    copy_tm_data_from_paint_source_with_images(paint_source_dir, project_path)
+    # Copy the data from Paint Source to the appropriate directory in Paint Data. Unless forced, experiments that
+    # were already generated from the same data with the same parameters are left alone
+    generate_squares_parameters = get_generate_squares_parameters(
+        select_parameters, nr_of_squares_in_row, min_required_r_squared, min_tracks_for_tau)
+    copy_tm_data_from_paint_source_with_images(
+        paint_source_dir, project_path, None if paint_force else generate_squares_parameters)
 
     nr_experiments_processed = process_project(
         project_path=project_path,
@@ -1,6 +1,9 @@
-import pandas as pd
 import os
 
+import pandas as pd
+
+from src.Application.Support.Table_Schema import read_paint_table
+from src.Application.Support.Track_Store import open_track_store
 from src.Fiji.LoggerConfig import paint_logger
 
 def split_tracks_by_cell_type(directory):
@@ -9,10 +12,16 @@ def split_tracks_by_cell_type(directory):
     paint_logger.info("")
 
     paint_logger.info("reading All Recordings ")
-    df_recordings = pd.read_csv(f"{directory}/All Recordings.csv")
+    df_recordings = read_paint_table(f"{directory}/All Recordings.csv", 'All Recordings')
 
-    paint_logger.info("Reading All Tracks")
-    df_all_tracks = pd.read_csv(f"{directory}/All Tracks.csv")
+    paint_logger.info("Opening the All Tracks store")
+    try:
+        track_store = open_track_store(f"{directory}/All Tracks.csv")
+        df_all_tracks = None
+    except (OSError, ValueError) as e:
+        paint_logger.warning(f"No track store could be made, reading All Tracks instead: {e}")
+        track_store = None
+        df_all_tracks = read_paint_table(f"{directory}/All Tracks.csv", 'All Tracks')
 
     paint_logger.info("")
 
@@ -21,9 +30,15 @@ def split_tracks_by_cell_type(directory):
         paint_logger.info(f"Splitting tracks for {cell_type}...")
         safe_cell_type = cell_type.replace('/', '').replace('\\', '').replace(' ', ' ')
         recording_names_list = df_recordings[df_recordings['Cell Type'] == cell_type]['Ext Recording Name'].dropna().unique().tolist()
-        df_all_tracks_for_cell_type = df_all_tracks[df_all_tracks['Ext Recording Name'].isin(recording_names_list)]
-        if not df_all_tracks_for_cell_type.empty:
-            df_all_tracks_for_cell_type = df_all_tracks_for_cell_type.reset_index(drop=True)
+        # Only the tracks of the recordings of the cell type are read, in the order of the All Tracks file
+        if track_store is not None:
+            tracks_of_recordings = [track_store.get_tracks_of_recording(recording_name)
+                                    for recording_name in track_store.recording_names
+                                    if recording_name in recording_names_list]
+        else:
+            tracks_of_recordings = [df_all_tracks[df_all_tracks['Ext Recording Name'].isin(recording_names_list)]]
+        if sum(len(df_tracks) for df_tracks in tracks_of_recordings) > 0:
+            df_all_tracks_for_cell_type = pd.concat(tracks_of_recordings, ignore_index=True)
             df_all_tracks_for_cell_type.to_csv(os.path.join(directory, f"All Tracks - {safe_cell_type}.csv"), index=False)
             paint_logger.info(f"Tracks for cell type '{cell_type}' saved to {safe_cell_type}_Tracks.csv")
         else:
@@ -0,0 +1,37 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The modules are imported as src.Application..., from the root of the repository
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# The Paint configuration, the log files and the table cache live under ~/Paint, and the logger opens its log file
+# as soon as it is imported. The tests therefore run with a home directory of their own, set before any of the
+# modules is imported, so that they never read or change the real ~/Paint.
+TEST_HOME = tempfile.mkdtemp(prefix='paint-tests-')
+os.environ['HOME'] = TEST_HOME
+os.environ['USERPROFILE'] = TEST_HOME
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TEST_HOME, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def paint_home(tmp_path_factory, monkeypatch):
+    """
+    Every test starts from a fresh home directory, so from the default Paint configuration. The configurations that
+    were opened before are forgotten, and worker processes inherit the home directory through the environment.
+    """
+
+    from src.Fiji import NewPaintConfig
+
+    home = tmp_path_factory.mktemp('Home')
+    (home / 'Paint').mkdir()
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('USERPROFILE', str(home))
+    monkeypatch.setattr(NewPaintConfig, '_paint_configurations', {})
+    return home
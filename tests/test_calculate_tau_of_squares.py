@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calculate_tau,
+    calculate_tau_of_squares)
+
+NR_OF_SQUARES_IN_ROW = 2
+MIN_TRACKS_FOR_TAU = 10
+
+
+@pytest.fixture
+def df_tracks():
+    """
+    The tracks of a 2 x 2 recording: square 0 decays exponentially and fits well, the tracks of square 1 all have
+    the same duration so that no curve can be fitted, square 2 has too few tracks and square 3 has none.
+    """
+
+    rng = np.random.default_rng(4)
+    frames = [rng.geometric(0.08, 400) + 2, np.full(30, 5), np.array([3, 4, 5])]
+    square_nrs = [np.full(len(frames_of_square), square_nr) for square_nr, frames_of_square in enumerate(frames)]
+    durations = np.round(np.concatenate(frames) * 0.05, 3)
+    return pd.DataFrame({
+        'Track Duration': durations,
+        'Diffusion Coefficient': np.ones(len(durations)),
+        'Square Nr': pd.array(np.concatenate(square_nrs), dtype='Int64')})
+
+
+def calculate_tau_square_by_square(df_tracks, min_required_r_squared):
+    tau = np.full(NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW, -1.0)
+    r_squared = np.zeros(len(tau))
+    for square_nr in np.unique(df_tracks['Square Nr']):
+        tau[square_nr], r_squared[square_nr] = calculate_tau(
+            df_tracks[df_tracks['Square Nr'] == square_nr], MIN_TRACKS_FOR_TAU, min_required_r_squared)
+    return tau, r_squared
+
+
+@pytest.mark.parametrize('min_required_r_squared, failed_fit_code', [(0.5, -3), (0.0, -2)])
+def test_batched_and_unbatched_tau_agree(df_tracks, min_required_r_squared, failed_fit_code):
+    tau, r_squared = calculate_tau_square_by_square(df_tracks, min_required_r_squared)
+    batched_tau, batched_r_squared = calculate_tau_of_squares(
+        df_tracks, NR_OF_SQUARES_IN_ROW, MIN_TRACKS_FOR_TAU, min_required_r_squared,
+        tau_fit_mode='Batched Curve Fit')
+
+    assert tau[0] > 0
+    assert batched_tau[0] == pytest.approx(tau[0], rel=1e-4)
+    assert batched_r_squared[0] == pytest.approx(r_squared[0], rel=1e-4)
+
+    # The failed fit, the square with too few tracks and the empty square get the same codes
+    assert list(tau[1:]) == [failed_fit_code, -1, -1]
+    assert list(batched_tau[1:]) == [failed_fit_code, -1, -1]
+    assert list(r_squared[1:]) == [0, 0, 0]
+    assert list(batched_r_squared[1:]) == [0, 0, 0]
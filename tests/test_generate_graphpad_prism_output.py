@@ -0,0 +1,52 @@
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+
+SCRIPT_PATH = os.path.join(
+    os.path.dirname(__file__), '..', 'src', 'Utilities', 'Generate GraphPad Prism Output.py')
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('generate_graphpad_prism_output', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def all_squares_path(tmp_path):
+    df_squares = pd.DataFrame({
+        'Unique Key': ['R1 - 0', 'R1 - 1', 'R2 - 0', 'R2 - 1'],
+        'Ext Recording Name': ['R1', 'R1', 'R2', 'R2'],
+        'Square Nr': [0, 1, 0, 1],
+        'Probe': ['1 Tri', '1 Tri', '2 Tri', '1 Tri'],
+        'Cell Type': ['BMDC', 'BMDC', 'BMDC', 'MUSC'],
+        'Adjuvant': ['No', 'No', 'No', 'No'],
+        'Tau': [120.5, -3, 98.0, 77.0]})
+    file_path = tmp_path / 'All Squares.csv'
+    df_squares.to_csv(file_path, index=False)
+    return str(file_path)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_pivot_tables_of_all_squares(all_squares_path, compact):
+    script = load_script()
+    df_squares = script.read_paint_table(all_squares_path, 'All Squares', compact=compact)
+
+    df_cell_type = script.tau_for_cell_type_and_adjuvant(df_squares, 'BMDC', 'No')
+    assert list(df_cell_type['Unique Key']) == ['R1 - 0', 'R2 - 0']
+    assert set(df_cell_type.columns) == {'Unique Key', '1 Tri', '2 Tri'}
+
+    df_probe = script.tau_for_probe_and_adjuvant(df_squares, '1 Tri', 'No')
+    assert list(df_probe['Unique Key']) == ['R1 - 0', 'R2 - 1']
+    assert set(df_probe.columns) == {'Unique Key', 'BMDC', 'MUSC'}
+
+
+def test_main_writes_workbook(all_squares_path, tmp_path):
+    pytest.importorskip('openpyxl')
+    script = load_script()
+    output_file = tmp_path / 'Output' / 'graphpad_table_with_keys.xlsx'
+    script.main(all_squares_path, str(output_file))
+    assert output_file.exists()
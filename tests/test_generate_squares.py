@@ -0,0 +1,187 @@
+import filecmp
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.Application.Generate_Squares.Generate_Squares import process_experiment
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import (
+    calc_variability_of_squares,
+    create_unique_key_for_tracks,
+    get_composite_keys,
+    get_square_coordinates,
+    get_square_nr_of_tracks,
+    group_tracks_by_square,
+    index_tracks_by_composite_key,
+    pack_select_parameters)
+from src.Fiji.NewPaintConfig import update_paint_attribute
+
+# An Experiment of two recordings and the files that Generate Squares wrote for it with the per-square code it had
+# before the binning and the columnar kernel (commit 505b87a), for two grids and neighbour modes
+DATA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'Generate Squares')
+OUTPUT_FILES = ['All Squares.csv', 'All Recordings.csv', 'All Tracks.csv']
+RUNS = {
+    '10 Strict': dict(
+        select_parameters=pack_select_parameters(1.5, 5.0, 0, 1000000, 0.5, 'Strict'),
+        nr_of_squares_in_row=10,
+        min_required_r_squared=0.5,
+        min_tracks_for_tau=10),
+    '7 Relaxed': dict(
+        select_parameters=pack_select_parameters(2.0, 10.0, 0, 1000000, 0.5, 'Relaxed'),
+        nr_of_squares_in_row=7,
+        min_required_r_squared=0.5,
+        min_tracks_for_tau=10)}
+
+
+def random_tracks(nr_of_squares_in_row, nr_tracks=2000, seed=3):
+    """
+    Tracks spread over and just beyond the image, with some exactly on the boundaries of the squares.
+    """
+
+    rng = np.random.default_rng(seed)
+    x = np.round(rng.uniform(-1, 83.5, nr_tracks), 2)
+    y = np.round(rng.uniform(-1, 83.5, nr_tracks), 2)
+    boundaries = np.arange(nr_of_squares_in_row + 1) * (82.0864 / nr_of_squares_in_row)
+    x[:100] = rng.choice(boundaries, 100)
+    y[100:200] = rng.choice(boundaries, 100)
+    return pd.DataFrame({'Track X Location': x, 'Track Y Location': y, 'Track Duration': rng.random(nr_tracks)})
+
+
+def square_nrs_with_masks(df_tracks, nr_of_squares_in_row):
+    """
+    The square of every track as it was determined before the binning: with a mask per square.
+    """
+
+    square_nrs = np.full(len(df_tracks), -1)
+    for square_nr in range(nr_of_squares_in_row * nr_of_squares_in_row):
+        x0, y0, x1, y1 = get_square_coordinates(nr_of_squares_in_row, square_nr)
+        mask = ((df_tracks['Track X Location'] >= x0) &
+                (df_tracks['Track X Location'] < x1) &
+                (df_tracks['Track Y Location'] >= y0) &
+                (df_tracks['Track Y Location'] < y1))
+        square_nrs[mask.to_numpy()] = square_nr
+    return square_nrs
+
+
+@pytest.mark.parametrize('nr_of_squares_in_row', [1, 7, 10, 20, 50])
+def test_square_nrs_match_the_masks(nr_of_squares_in_row):
+    df_tracks = random_tracks(nr_of_squares_in_row)
+    expected = square_nrs_with_masks(df_tracks, nr_of_squares_in_row)
+    assert np.array_equal(get_square_nr_of_tracks(df_tracks, nr_of_squares_in_row), expected)
+
+
+def test_tracks_are_grouped_by_square():
+    nr_of_squares_in_row = 7
+    df_tracks = random_tracks(nr_of_squares_in_row)
+    expected = square_nrs_with_masks(df_tracks, nr_of_squares_in_row)
+
+    df_sorted, offsets = group_tracks_by_square(df_tracks, nr_of_squares_in_row)
+
+    # Square Nr is filled in, empty outside the grid
+    assert df_tracks['Square Nr'].isna().sum() == (expected == -1).sum()
+    assert np.array_equal(df_tracks['Square Nr'].fillna(-1).to_numpy(dtype=int), expected)
+
+    # The tracks of every square form a slice, in their original order
+    for square_nr in range(nr_of_squares_in_row * nr_of_squares_in_row):
+        df_square = df_sorted.iloc[offsets[square_nr]:offsets[square_nr + 1]]
+        assert list(df_square.index) == list(np.flatnonzero(expected == square_nr))
+
+
+def variability_of_square(df_tracks_of_square, square_nr, nr_of_squares_in_row, granularity):
+    """
+    The variability of a square as it was calculated before, track by track. A track that rounds onto the far edge
+    of a grid cell is counted in the last cell, where the old code went out of the matrix.
+    """
+
+    matrix = np.zeros((granularity, granularity), dtype=int)
+    width = height = 82.0864 / nr_of_squares_in_row
+    x0 = (square_nr % nr_of_squares_in_row) * width
+    y0 = (square_nr // nr_of_squares_in_row) * height
+    for _, track in df_tracks_of_square.iterrows():
+        xi = int(((float(track['Track X Location']) - x0) / width) * granularity)
+        yi = int(((float(track['Track Y Location']) - y0) / height) * granularity)
+        matrix[min(yi, granularity - 1), min(xi, granularity - 1)] += 1
+    mean = np.mean(matrix)
+    return np.std(matrix) / mean if mean != 0 else 0
+
+
+@pytest.mark.parametrize('nr_of_squares_in_row', [5, 7, 20])
+def test_variability_matches_the_calculation_per_square(nr_of_squares_in_row):
+    df_tracks = random_tracks(nr_of_squares_in_row)
+    group_tracks_by_square(df_tracks, nr_of_squares_in_row)
+
+    variability = calc_variability_of_squares(df_tracks, nr_of_squares_in_row, 10)
+
+    assert len(variability) == nr_of_squares_in_row * nr_of_squares_in_row
+    for square_nr in range(nr_of_squares_in_row * nr_of_squares_in_row):
+        df_tracks_of_square = df_tracks[df_tracks['Square Nr'] == square_nr]
+        assert variability[square_nr] == variability_of_square(df_tracks_of_square, square_nr, nr_of_squares_in_row, 10)
+
+
+def test_composite_keys_hold_the_recording_and_the_number():
+    recording_codes = np.array([0, 0, 1, 7, 2 ** 31 - 1])
+    numbers = np.array([0, 2 ** 32 - 1, 0, 123456, 5])
+    keys = get_composite_keys(recording_codes, numbers)
+    assert keys.dtype == np.int64
+    assert len(set(keys)) == len(keys)
+    assert np.array_equal(keys >> 32, recording_codes)
+    assert np.array_equal(keys & 0xFFFFFFFF, numbers)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_tracks_are_keyed_by_composite_key_and_written_with_text_keys(compact):
+    df_tracks = pd.read_csv(os.path.join(DATA_PATH, '10 Strict', 'All Tracks.csv'))
+    old_unique_keys = df_tracks['Unique Key'].tolist()
+    if compact:
+        df_tracks['Ext Recording Name'] = df_tracks['Ext Recording Name'].astype('category')
+
+    index_tracks_by_composite_key(df_tracks)
+    assert 'Unique Key' not in df_tracks.columns
+    assert df_tracks.index.is_unique
+    recording_codes, _ = pd.factorize(df_tracks['Ext Recording Name'])
+    assert np.array_equal(df_tracks.index.to_numpy() >> 32, recording_codes)
+    assert np.array_equal(df_tracks.index.to_numpy() & 0xFFFFFFFF, df_tracks['Track Id'])
+
+    # The text keys are the same as the ones made from the name and label before
+    df_written = create_unique_key_for_tracks(df_tracks)
+    assert df_written.columns[0] == 'Unique Key'
+    assert df_written['Unique Key'].tolist() == old_unique_keys
+    assert 'Unique Key' not in df_tracks.columns
+
+
+def test_tracks_of_one_recording_get_its_code():
+    df_tracks = pd.read_csv(os.path.join(DATA_PATH, 'Input', 'All Tracks.csv'))
+    df_recording = df_tracks[df_tracks['Ext Recording Name'] == df_tracks['Ext Recording Name'].iloc[-1]].copy()
+    index_tracks_by_composite_key(df_recording, recording_code=3)
+    assert (df_recording.index.to_numpy() >> 32 == 3).all()
+
+
+def generate_squares(tmp_path, run, **kwargs):
+    experiment_path = str(tmp_path / 'Experiment')
+    shutil.copytree(os.path.join(DATA_PATH, 'Input'), experiment_path)
+    assert process_experiment(experiment_path, **RUNS[run], **kwargs)
+    return experiment_path
+
+
+def assert_same_output(experiment_path, run):
+    for file_name in OUTPUT_FILES:
+        assert filecmp.cmp(os.path.join(experiment_path, file_name), os.path.join(DATA_PATH, run, file_name),
+                           shallow=False), f"{file_name} of {run} differs"
+
+
+@pytest.mark.parametrize('run', RUNS)
+def test_output_is_unchanged(tmp_path, run):
+    assert_same_output(generate_squares(tmp_path, run), run)
+
+
+@pytest.mark.parametrize('run', RUNS)
+def test_output_is_unchanged_with_recording_workers(tmp_path, run):
+    assert_same_output(generate_squares(tmp_path, run, nr_of_recording_workers=2), run)
+
+
+@pytest.mark.parametrize('run', RUNS)
+def test_output_is_unchanged_with_streamed_tracks(tmp_path, run):
+    update_paint_attribute('Generate Squares', 'Stream Tracks', True)
+    assert_same_output(generate_squares(tmp_path, run), run)
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.Application.Generate_Squares.Generate_Squares import (
+    process_experiment,
+    process_experiment_for_resolutions,
+    process_project)
+from src.Application.Generate_Squares.Generate_Squares_Manifest import MANIFEST_FILE_NAME
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
+
+RECORDING_NAME = '240104-Exp-1-A1-1-threshold-5'
+
+
+def write_recordings(experiment_path, nr_tracks):
+    pd.DataFrame([{
+        'Recording Sequence Nr': 1, 'Recording Name': RECORDING_NAME[:-12], 'Experiment Date': 240104,
+        'Experiment Name': 240104, 'Condition Nr': 1, 'Replicate Nr': 1, 'Probe': '6 Mono',
+        'Probe Type': 'Simple', 'Cell Type': 'BMDC', 'Adjuvant': 'No', 'Concentration': 10,
+        'Threshold': 5, 'Process': 'Yes', 'Nr Spots': 340441, 'Nr Tracks': nr_tracks, 'Run Time': 15.8,
+        'Ext Recording Name': RECORDING_NAME, 'Recording Size': 1057996800,
+        'Time Stamp': 'Mon Jan  6 14:45:13 2025', 'Max Frame Gap': 3, 'Gap Closing Max Distance': 1.2,
+        'Linking Max Distance': 0.6, 'Median Filtering': False, 'Nr Spots in All Tracks': 226461}]).to_csv(
+        os.path.join(experiment_path, 'All Recordings.csv'), index=False)
+
+
+def write_tracks(experiment_path, nr_tracks):
+    rng = np.random.default_rng(7)
+    frames = rng.geometric(0.08, nr_tracks) + 2
+    values = {column: np.round(rng.exponential(1, nr_tracks), 2) for column in [
+        'Track Displacement', 'Track Max Speed', 'Track Median Speed', 'Track Mean Speed', 'Track Max Speed Calc',
+        'Track Median Speed Calc', 'Track Mean Speed Calc', 'Diffusion Coefficient', 'Diffusion Coefficient Ext',
+        'Total Distance', 'Confinement Ratio']}
+    pd.DataFrame({
+        'Ext Recording Name': RECORDING_NAME,
+        'Track Id': np.arange(nr_tracks),
+        'Track Label': [f'Track_{i}' for i in range(nr_tracks)],
+        'Nr Spots': frames.astype(float),
+        'Nr Gaps': 0,
+        'Longest Gap': 0,
+        'Track Duration': np.round(frames * 0.05, 3),
+        'Track X Location': np.round(rng.uniform(0, 82, nr_tracks), 2),
+        'Track Y Location': np.round(rng.uniform(0, 82, nr_tracks), 2),
+        **values}).to_csv(os.path.join(experiment_path, 'All Tracks.csv'), index=False)
+
+
+@pytest.fixture
+def project_path(tmp_path):
+    """
+    A project with one Experiment that can be processed and one whose All Tracks file is missing.
+    """
+
+    for experiment_dir, has_tracks in [('240104', True), ('240116', False)]:
+        experiment_path = tmp_path / experiment_dir
+        experiment_path.mkdir()
+        write_recordings(str(experiment_path), 2000)
+        if has_tracks:
+            write_tracks(str(experiment_path), 2000)
+    return str(tmp_path)
+
+
+PARAMETERS = dict(
+    select_parameters=pack_select_parameters(2.0, 10.0, 0, 1000000, 0.9, 'Free'),
+    nr_of_squares_in_row=5,
+    min_required_r_squared=0.9,
+    min_tracks_for_tau=20)
+
+
+def test_experiment_without_tracks_fails(project_path):
+    assert process_experiment(os.path.join(project_path, '240104'), **PARAMETERS)
+    assert not process_experiment(os.path.join(project_path, '240116'), **PARAMETERS)
+    assert os.path.exists(os.path.join(project_path, '240104', MANIFEST_FILE_NAME))
+    assert not os.path.exists(os.path.join(project_path, '240116', MANIFEST_FILE_NAME))
+
+
+@pytest.mark.parametrize('nr_of_workers', [1, 2])
+def test_failed_experiment_is_not_counted(project_path, nr_of_workers):
+    assert process_project(project_path, **PARAMETERS, paint_force=True, nr_of_workers=nr_of_workers) == 1
+
+
+def test_experiment_without_tracks_fails_for_resolutions(project_path):
+    parameters = dict(PARAMETERS, nrs_of_squares_in_row=[10, 5])
+    del parameters['nr_of_squares_in_row']
+    assert process_experiment_for_resolutions(os.path.join(project_path, '240104'), **parameters)
+    assert not process_experiment_for_resolutions(os.path.join(project_path, '240116'), **parameters)
+    assert os.path.exists(os.path.join(project_path, '240104', 'All Squares - 5.csv'))
+    assert not os.path.exists(os.path.join(project_path, '240116', 'All Squares - 5.csv'))
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
+from src.Application.Recording_Viewer.Select_Squares import (
+    select_squares_of_recordings_with_neighbours,
+    select_squares_with_parameters)
+
+NR_OF_SQUARES_IN_ROW = 3
+
+
+def make_squares(selectable):
+    square_nrs = np.arange(NR_OF_SQUARES_IN_ROW * NR_OF_SQUARES_IN_ROW)
+    return pd.DataFrame({
+        'Ext Recording Name': 'Recording',
+        'Square Nr': square_nrs,
+        'Row Nr': square_nrs // NR_OF_SQUARES_IN_ROW + 1,
+        'Col Nr': square_nrs % NR_OF_SQUARES_IN_ROW + 1,
+        'Density Ratio': np.where(selectable, 10.0, 0.0),
+        'Variability': 1.0,
+        'Max Track Duration': 1.0,
+        'R Squared': 0.95,
+        'Tau': 100.0})
+
+
+def select(df_squares, neighbour_mode):
+    select_parameters = pack_select_parameters(2.0, 10.0, 0, 1000000, 0.9, neighbour_mode)
+    select_squares_with_parameters(df_squares, select_parameters, NR_OF_SQUARES_IN_ROW, only_valid_tau=True)
+
+
+def test_cluster_columns_are_reset_outside_cluster_mode():
+    # An L-shaped cluster of three squares in the top left corner and an isolated square in the bottom right
+    df_squares = make_squares([True, True, False,
+                               True, False, False,
+                               False, False, True])
+
+    select(df_squares, 'Cluster')
+    assert list(df_squares['Selected']) == [True, True, False, True, False, False, False, False, False]
+    assert list(df_squares['Cluster Size']) == [3, 3, 0, 3, 0, 0, 0, 0, 0]
+
+    select(df_squares, 'Free')
+    assert df_squares['Selected'].sum() == 4
+    assert (df_squares['Cluster Id'] == 0).all()
+    assert (df_squares['Cluster Size'] == 0).all()
+
+
+# ----------------------------------------------------------------------------------------------------
+# The neighbour rules as they were applied before, square by square to the squares of one recording
+# ----------------------------------------------------------------------------------------------------
+
+def get_strict_neighbours(row, col, nr_of_squares_in_row):
+    left = (row, max(col - 1, 1))
+    right = (row, min(col + 1, nr_of_squares_in_row))
+    above = (max(row - 1, 1), col)
+    below = (min(row + 1, nr_of_squares_in_row), col)
+    if row == 1:
+        return [right, below] if col == 1 else [left, below] if col == nr_of_squares_in_row else [left, right, below]
+    elif row == nr_of_squares_in_row:
+        return [right, above] if col == 1 else [left, above] if col == nr_of_squares_in_row else [left, right, above]
+    else:
+        return [right, below, above] if col == 1 else [left, below, above] if col == nr_of_squares_in_row else \
+            [left, right, below, above]
+
+
+def get_relaxed_neighbours(row, col, nr_of_squares_in_row):
+    return [(row + row_offset, col + col_offset)
+            for row_offset, col_offset in [(0, -1), (0, 1), (-1, 0), (1, 0), (1, -1), (1, 1), (-1, -1), (-1, 1)]
+            if 1 <= row + row_offset <= nr_of_squares_in_row and 1 <= col + col_offset <= nr_of_squares_in_row]
+
+
+def select_with_neighbours_per_square(selected, neighbour_mode, nr_of_squares_in_row):
+    selected = list(selected)
+    get_neighbours = get_strict_neighbours if neighbour_mode == 'Strict' else get_relaxed_neighbours
+    for square_nr in range(len(selected)):
+        if not selected[square_nr]:
+            continue
+        row, col = square_nr // nr_of_squares_in_row + 1, square_nr % nr_of_squares_in_row + 1
+        selected[square_nr] = any(selected[(nb_row - 1) * nr_of_squares_in_row + nb_col - 1]
+                                  for nb_row, nb_col in get_neighbours(row, col, nr_of_squares_in_row))
+    return selected
+
+
+@pytest.mark.parametrize('neighbour_mode', ['Strict', 'Relaxed'])
+@pytest.mark.parametrize('nr_of_squares_in_row', [1, 2, 5, 8])
+def test_neighbour_rules_match_the_rules_per_square(neighbour_mode, nr_of_squares_in_row):
+    rng = np.random.default_rng(nr_of_squares_in_row)
+    nr_squares = nr_of_squares_in_row * nr_of_squares_in_row
+    nr_recordings = 20
+
+    # Recordings with few to many selected squares, with the squares of the recordings in shuffled order
+    selected = rng.random((nr_recordings, nr_squares)) < np.linspace(0.1, 0.9, nr_recordings)[:, np.newaxis]
+    square_nrs = np.tile(np.arange(nr_squares), nr_recordings)
+    df_squares = pd.DataFrame({
+        'Ext Recording Name': np.repeat([f'Recording {nr}' for nr in range(nr_recordings)], nr_squares),
+        'Square Nr': square_nrs,
+        'Row Nr': square_nrs // nr_of_squares_in_row + 1,
+        'Col Nr': square_nrs % nr_of_squares_in_row + 1,
+        'Selected': selected.ravel()}).sample(frac=1, random_state=1)
+
+    expected = np.concatenate([select_with_neighbours_per_square(selected_of_recording, neighbour_mode,
+                                                                 nr_of_squares_in_row)
+                               for selected_of_recording in selected])
+    expected = expected[df_squares.index]
+
+    result = select_squares_of_recordings_with_neighbours(df_squares, neighbour_mode, nr_of_squares_in_row)
+    assert np.array_equal(result, expected)
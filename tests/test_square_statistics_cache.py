@@ -0,0 +1,100 @@
+import filecmp
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from src.Application.Generate_Squares import Generate_Squares
+from src.Application.Generate_Squares.Generate_Squares import process_experiment
+from src.Application.Generate_Squares.Generate_Squares_Support_Functions import pack_select_parameters
+from src.Application.Generate_Squares.Square_Statistics_Cache import SQUARE_STATISTICS_CACHE_FILE_NAME
+from src.Fiji.NewPaintConfig import update_paint_attribute
+
+INPUT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'Generate Squares', 'Input')
+OUTPUT_FILES = ['All Squares.csv', 'All Recordings.csv', 'All Tracks.csv']
+FREE = pack_select_parameters(1.5, 5.0, 0, 1000000, 0.5, 'Free')
+RELAXED = pack_select_parameters(2.0, 10.0, 0.2, 1000000, 0.6, 'Relaxed')
+
+
+@pytest.fixture
+def compiled_recordings(monkeypatch):
+    """
+    The names of the recordings whose square statistics are calculated rather than taken from the cache.
+    """
+
+    compiled = []
+    compile_square_statistics_of_recording = Generate_Squares.compile_square_statistics_of_recording
+
+    def compile_and_record(df_tracks_of_recording, recording_data, *args, **kwargs):
+        compiled.append(recording_data['Ext Recording Name'])
+        return compile_square_statistics_of_recording(df_tracks_of_recording, recording_data, *args, **kwargs)
+
+    monkeypatch.setattr(Generate_Squares, 'compile_square_statistics_of_recording', compile_and_record)
+    return compiled
+
+
+@pytest.fixture
+def experiment_path(tmp_path):
+    experiment_path = str(tmp_path / 'Experiment')
+    shutil.copytree(INPUT_PATH, experiment_path)
+    return experiment_path
+
+
+def generate_squares(experiment_path, select_parameters=FREE, min_required_r_squared=0.5):
+    assert process_experiment(experiment_path, select_parameters, 10, min_required_r_squared, 10)
+
+
+def test_other_selection_uses_the_cache(experiment_path, compiled_recordings, tmp_path):
+    generate_squares(experiment_path)
+    assert len(compiled_recordings) == 2
+    assert os.path.exists(os.path.join(experiment_path, SQUARE_STATISTICS_CACHE_FILE_NAME))
+
+    compiled_recordings.clear()
+    generate_squares(experiment_path, RELAXED)
+    assert compiled_recordings == []
+
+    # The output is the same as without the cache
+    update_paint_attribute('Generate Squares', 'Cache Square Statistics', False)
+    uncached_path = str(tmp_path / 'Uncached')
+    shutil.copytree(INPUT_PATH, uncached_path)
+    generate_squares(uncached_path, RELAXED)
+    assert not os.path.exists(os.path.join(uncached_path, SQUARE_STATISTICS_CACHE_FILE_NAME))
+    for file_name in OUTPUT_FILES:
+        assert filecmp.cmp(os.path.join(experiment_path, file_name), os.path.join(uncached_path, file_name),
+                           shallow=False), f"{file_name} differs"
+
+
+def test_other_parameters_miss_the_cache(experiment_path, compiled_recordings):
+    generate_squares(experiment_path)
+
+    compiled_recordings.clear()
+    generate_squares(experiment_path, min_required_r_squared=0.8)
+    assert len(compiled_recordings) == 2
+
+    compiled_recordings.clear()
+    update_paint_attribute('TrackMate', 'MIN_NR_SPOTS_IN_TRACK', 4)
+    generate_squares(experiment_path, min_required_r_squared=0.8)
+    assert len(compiled_recordings) == 2
+
+
+def test_changed_tracks_miss_the_cache(experiment_path, compiled_recordings):
+    generate_squares(experiment_path)
+
+    # Change the duration of one track of the first recording
+    tracks_path = os.path.join(experiment_path, 'All Tracks.csv')
+    df_tracks = pd.read_csv(tracks_path)
+    df_tracks.loc[0, 'Track Duration'] += 0.05
+    df_tracks.to_csv(tracks_path, index=False)
+
+    compiled_recordings.clear()
+    generate_squares(experiment_path)
+    assert compiled_recordings == [df_tracks.loc[0, 'Ext Recording Name']]
+
+
+def test_cache_is_not_used_when_switched_off(experiment_path, compiled_recordings):
+    update_paint_attribute('Generate Squares', 'Cache Square Statistics', False)
+    generate_squares(experiment_path)
+    generate_squares(experiment_path)
+    assert len(compiled_recordings) == 4
+    assert not os.path.exists(os.path.join(experiment_path, SQUARE_STATISTICS_CACHE_FILE_NAME))
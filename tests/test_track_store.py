@@ -0,0 +1,40 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.Application.Support.Track_Store import open_track_store
+
+TRACKS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'Generate Squares', '10 Strict', 'All Tracks.csv')
+
+
+def test_tracks_of_a_square_come_from_the_store(tmp_path):
+    tracks_path = str(tmp_path / 'All Tracks.csv')
+    shutil.copy(TRACKS_PATH, tracks_path)
+    df_tracks = pd.read_csv(tracks_path)
+    recording_name = df_tracks['Ext Recording Name'].iloc[-1]
+
+    track_store = open_track_store(tracks_path)
+    df_square = track_store.get_tracks_of_square(recording_name, 45)
+
+    expected = df_tracks[(df_tracks['Ext Recording Name'] == recording_name) & (df_tracks['Square Nr'] == 45)]
+    assert len(df_square) > 0
+    assert df_square['Unique Key'].tolist() == expected['Unique Key'].tolist()
+    assert np.array_equal(df_square['Track Duration'], expected['Track Duration'])
+
+
+def test_text_with_missing_values_is_stored(tmp_path):
+    tracks_path = str(tmp_path / 'All Tracks.csv')
+    df_tracks = pd.read_csv(TRACKS_PATH)
+    df_tracks.loc[df_tracks.index % 3 == 0, 'Track Label'] = np.nan
+    df_tracks.to_csv(tracks_path, index=False)
+    recording_name = df_tracks['Ext Recording Name'].iloc[0]
+
+    track_store = open_track_store(tracks_path)
+    df_recording = track_store.get_tracks_of_recording(recording_name, columns=['Track Id', 'Track Label'])
+
+    expected = df_tracks[df_tracks['Ext Recording Name'] == recording_name].set_index('Track Id')['Track Label']
+    df_recording = df_recording.set_index('Track Id')['Track Label']
+    assert df_recording.isna().sum() == expected.isna().sum() > 0
+    assert df_recording.sort_index().equals(expected.sort_index().astype(object))